@@ -1,9 +1,21 @@
 __author__ = 'scmason'
-from .essential_serializer import PickleSerializer, JSONSerializer
+from .essential_serializer import PickleSerializer, JSONSerializer, JSONLinesSerializer, BinarySerializer, LazyDocuments
+from .essential_compression import CompressedSerializer, NoCompression, ZlibCodec, BZ2Codec, LZMACodec
 from .keys import Keys
-from .essential_index import EssentialIndex
-from .query_filter import QueryFilter
+from .essential_journal import EssentialJournal
+from .essential_lock import ReadWriteLock
+from .essential_storage import FileStorage, DirectoryStorage, BackgroundSave
+from .essential_flusher import SyncFlusher
+from .essential_parallel import ParallelScan
+from .essential_index import EssentialIndex, EssentialOrderedIndex
+from .essential_columns import EssentialColumnIndex, ColumnStore
+from .essential_projection import Projection
+from .essential_cache import QueryCache
+from .query_filter import QueryFilter, Param
 from .local_collection import LocalCollection
-from .collection import Collection
+from .essential_cursor import Cursor
+from .essential_metrics import DatabaseMetrics, CollectionMetrics, Histogram, SlowQueryLog, TimedReadWriteLock
+from .essential_aggregate import Pipeline
+from .collection import Collection, InsertManyResult, BulkWriteError, PreparedQuery
 from .essential_db import EssentialDB
 
@@ -1,11 +1,78 @@
 
 
 from essentialdb import LocalCollection
+from essentialdb import QueryFilter
+from essentialdb import Cursor
+from essentialdb import Pipeline
+from essentialdb import QueryCache
 from .essential_oid import EssentialOID
 
+
+class InsertManyResult:
+    """
+    The result of Collection.insert_many.
+    """
+
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+
+    def __repr__(self):
+        return "InsertManyResult: " + str(len(self.inserted_ids)) + " inserted"
+
+
+class BulkWriteError(Exception):
+    """
+    Raised by Collection.insert_many when some documents couldn't be inserted. result holds the InsertManyResult for
+    the documents that were, and errors is a list of (position, exception) for those that weren't.
+    """
+
+    def __init__(self, result, errors):
+        Exception.__init__(self, str(len(errors)) + " document(s) could not be inserted")
+        self.result = result
+        self.errors = errors
+
+
+class PreparedQuery:
+    """
+    A query parsed once by Collection.prepare, to be run many times with different values for its Params::
+
+        by_author = books.prepare({'author': Param('author'), 'year': {'$gt': Param('year')}})
+        by_author.find(author='Langston Hughes', year=1930)
+        by_author.count(author='Ezra Pound', year=1900)
+
+    """
+
+    def __init__(self, collection, query_filter):
+        self.collection = collection
+        self.query_filter = query_filter
+
+    def bind(self, **params):
+        """
+        Get the QueryFilter with params filled in. Collection methods taking a query accept it in place of a query
+        document.
+        """
+        return self.query_filter.bind(params)
+
+    def find(self, filter=None, cursor=False, projection=None, **params):
+        return self.collection.find(self.bind(**params), filter, cursor, projection)
+
+    def find_one(self, filter=None, projection=None, **params):
+        return self.collection.find_one(self.bind(**params), filter, projection)
+
+    def count(self, **params):
+        return self.collection.count(self.bind(**params))
+
+    def update(self, update, **params):
+        return self.collection.update(self.bind(**params), update)
+
+    def remove(self, **params):
+        return self.collection.remove(self.bind(**params))
+
+
 class Collection:
 
-    def __init__(self,  documents,  threading_lock,  onsync_callback,  autosync=False, name=None):
+    def __init__(self,  documents,  threading_lock,  onsync_callback,  autosync=False, name=None, journal=None,
+                 flusher=None, query_mode="compiled", metrics=None, parallel=None):
         """
 
         Kwargs:
@@ -23,12 +90,18 @@ class Collection:
 
         """
 
-        self.collection = LocalCollection(documents)
+        self.collection = LocalCollection(documents, query_mode, parallel)
         self.sync = onsync_callback
         self.threading_lock = threading_lock
         self.autosync = autosync
         self.collection_name = name
+        self.journal = journal
+        self.flusher = flusher
         self.dirty = False
+        # CollectionMetrics, if the database records them
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.instrument(self)
 
     def __del__(self):
         # TODO: Test if dirty before forcing sync
@@ -71,22 +144,61 @@ class Collection:
                 author_collection.insert_one(author)
 
         """
+        results = self._insert_one(document)
+        self._cleanup()
+        return results
+
+    def _insert_one(self, document):
         if "_id" not in document:
             document["_id"] = str(EssentialOID.generate_next_id())
 
-        with self.threading_lock:
+        with self.threading_lock.write_lock():
             results = self.collection.insert_one(document)
-
-        self._cleanup()
+            self._log("insert", document)
         return results
 
-    def _cleanup(self):
+    def _log(self, operation, *args):
         """
-        Internal function, used to finalize any outstanding tasks after inserts
-        and other operations that alter the state of the database.
+        Internal function, marks the collection dirty and appends a record of a change to the journal (if there is
+        one). Must be called while holding the lock, so records are logged in the order they were applied.
+        """
+        self.dirty = True
+        if self.journal is not None:
+            self.journal.append((operation, self.collection_name) + args)
+
+    def _apply(self, operation, *args):
+        """
+        Internal function, re-applies a journal record written by _log.
         """
         self.dirty = True
-        if self.autosync:
+        if operation == "insert":
+            self.collection.insert_one(args[0])
+        elif operation == "insert_many":
+            self.collection.insert_many(args[0])
+        elif operation == "set":
+            self.collection.set(args[0], args[1])
+        elif operation == "update":
+            self.collection.update(args[0], args[1])
+        elif operation == "remove":
+            self.collection.remove(args[0])
+
+    @staticmethod
+    def _query_document(query):
+        # the journal records query documents, not prepared filters
+        if isinstance(query, QueryFilter):
+            return query.to_query()
+        return query
+
+    def _cleanup(self, operations=1):
+        """
+        Internal function, used to finalize any outstanding tasks after inserts
+        and other operations that alter the state of the database. When the
+        database has a sync policy, the flusher is notified instead of syncing
+        inline.
+        """
+        if self.flusher is not None:
+            self.flusher.notify(operations)
+        elif self.autosync:
             self.sync()
 
 
@@ -110,8 +222,9 @@ class Collection:
             with my_db.cache as request_cache:
                 request_cache.set( request.url, response.text )
         """
-        with self.threading_lock:
+        with self.threading_lock.write_lock():
             self.collection.set(key, value)
+            self._log("set", key, value)
 
         self._cleanup()
         return key
@@ -135,17 +248,28 @@ class Collection:
                 response.text = request_cache.get( request.url )
 
         """
-        return self.collection.get(key)
+        with self.threading_lock.read_lock():
+            return self.collection.get(key)
 
-    def insert_many(self, documents):
+    def insert_many(self, documents, ordered=True):
         """
-        Inserts a list of documents into the collection using the same process as oulined for insert_one
+        Inserts a list of documents into the collection using the same process as oulined for insert_one, but as a
+        single batch: the lock is taken once, ids are generated together, each index is updated in one pass and the
+        database is synced (or the sync policy notified) once for the whole batch.
+
+        Documents that can't be inserted (those that aren't dictionaries, or have an unhashable _id) are reported in a
+        BulkWriteError, raised after the batch is inserted. With ordered=True (the default), the batch stops at the
+        first bad document; with ordered=False, every other document is still inserted. If the indexes can't take the
+        batch, none of it is inserted, and every document is reported in the BulkWriteError.
 
         Args:
             documents (list) A list of documents (dict) to insert.
 
+        Kwargs:
+            ordered (bool): Stop at the first document that can't be inserted.
+
         Returns
-            The number of documents inserted into the store.
+            An InsertManyResult, with the inserted_ids in the order they were inserted.
 
         Example::
 
@@ -155,18 +279,59 @@ class Collection:
                 author_collection.insert_many(authors)
 
         """
-        for doc in documents:
-            self.insert_one(doc)
-        self._cleanup()
-        return True
-
-    def find_one(self, query=None, filter=None):
+        valid = []
+        positions = []
+        errors = []
+        for position, document in enumerate(documents):
+            error = self._validate(document)
+            if error is not None:
+                errors.append((position, error))
+                if ordered:
+                    break
+            else:
+                valid.append(document)
+                positions.append(position)
+
+        missing_ids = [document for document in valid if "_id" not in document]
+        for document, _id in zip(missing_ids, EssentialOID.generate_ids(len(missing_ids))):
+            document["_id"] = _id
+
+        inserted_ids = []
+        if valid:
+            with self.threading_lock.write_lock():
+                try:
+                    inserted_ids = self.collection.insert_many(valid)
+                except Exception as error:
+                    # the batch was rolled back, so nothing is logged
+                    errors = sorted(errors + [(position, error) for position in positions], key=lambda item: item[0])
+                    raise BulkWriteError(InsertManyResult([]), errors)
+                self._log("insert_many", valid)
+            self._cleanup(len(valid))
+
+        result = InsertManyResult(inserted_ids)
+        if errors:
+            raise BulkWriteError(result, errors)
+        return result
+
+    @staticmethod
+    def _validate(document):
+        if not isinstance(document, dict):
+            return TypeError("document must be a dict, not " + document.__class__.__name__)
+        if "_id" in document:
+            try:
+                hash(document["_id"])
+            except TypeError as e:
+                return e
+        return None
+
+    def find_one(self, query=None, filter=None, projection=None):
         """
-        Finds one document that matches the query. If multiple documents match (or query is not specified), a single
-        random document is returned from the result set.
+        Finds one document that matches the query. If multiple documents match, the first one found is returned,
+        without looking any further. If query is not specified, a random document is returned.
 
         Kwargs:
             query (dict): If specified, the query to be ran on the collection.
+            projection (dict): If specified, the fields to return (see find).
 
         Returns
             A single matching document or None if no documents match query or the collection is empty.
@@ -177,9 +342,10 @@ class Collection:
                 document = author_collection.find_one({'first': 'Ezra', 'last': 'Pound'})
 
         """
-        return self.collection.find_one(query, filter)
+        with self.threading_lock.read_lock():
+            return self.collection.find_one(query, filter, projection)
 
-    def find(self, query={}, filter=None):
+    def find(self, query={}, filter=None, cursor=False, projection=None):
         """
         Finds all documents that match the query. If query is not specified, all documents in the collection will be
         returned.
@@ -187,6 +353,9 @@ class Collection:
         Kwargs:
             query (dict): If specified, the query to be ran on the collection.
             filter (fund): If specified, results will be ran through provided function before inclustion in results
+            cursor (bool): If True, return a Cursor evaluating the query lazily instead of a list.
+            projection (dict): If specified, the fields to return, either included ({'title': 1, 'author.last': 1})
+                or excluded ({'details': 0}). The _id is included unless it is excluded ({'_id': 0}).
         Returns:
             A list of matching documents or None if no documents match query or the collection is empty.
 
@@ -195,9 +364,75 @@ class Collection:
             with library_db.authors as author_collection:
                 document = author_collection.find({'last': 'Smith'})
 
+                # the third page of 20
+                page = list(author_collection.find({'last': 'Smith'}, cursor=True).skip(40).limit(20))
+
+                # just the names
+                names = author_collection.find({'last': 'Smith'}, projection={'first': 1, 'last': 1, '_id': 0})
+
+        """
+        if cursor:
+            return Cursor(self, query, filter, projection)
+
+        with self.threading_lock.read_lock():
+            return self.collection.find(query, filter, projection)
+
+    def aggregate(self, pipeline):
         """
+        Run an aggregation pipeline (see Pipeline) on the collection. The pipeline is lazy: documents are read, in
+        batches under the collection's read lock, as the results are iterated.
 
-        return self.collection.find(query, filter)
+        Args:
+            pipeline (list): The stages, each a dictionary like {'$match': {...}}.
+
+        Returns:
+            A generator yielding the results.
+
+        Example::
+
+            with library_db.tickets as ticket_collection:
+                per_project = ticket_collection.aggregate([
+                    {'$match': {'status': 'open'}},
+                    {'$group': {'_id': '$project', 'open': {'$sum': 1}, 'points': {'$avg': '$points'}}},
+                    {'$sort': {'open': -1}}
+                ])
+                for project in per_project:
+                    print(project['_id'], project['open'], project['points'])
+
+        """
+        return Pipeline(pipeline).run(self)
+
+    def explain(self, query={}, filter=None):
+        """
+        Run a query, reporting how it was run rather than its results. Use Cursor.explain to include sorting, skip
+        and limit.
+
+        Kwargs:
+            query (dict): If specified, the query to be ran on the collection.
+            filter (func): If specified, documents must also pass the function.
+
+        Returns:
+            A dictionary describing the query's execution:
+
+            * query - the query as it was parsed, as a query document
+            * candidate_indexes - the queried fields that have an index (and the _id, if it is queried)
+            * access_path - "index" if the _id or indexes narrowed the documents down, "scan" if every document was
+              tested
+            * indexes_used - the fields whose index (or the _id) narrowed the documents down
+            * residual - the terms of the query left to test on each document
+            * candidates - the number of documents the indexes narrowed the query down to, None for a scan
+            * documents_examined - the number of documents read
+            * returned - the number of documents matching
+            * timings - the seconds spent planning (plan), finding the documents (filter) and in total
+
+        Example::
+
+            with library_db.tickets as ticket_collection:
+                print(ticket_collection.explain({'status': 'open', 'due': {'$lt': today}}))
+
+        """
+        with self.threading_lock.read_lock():
+            return self.collection.explain(query, filter)
 
     def update(self, query, update):
         """
@@ -216,17 +451,82 @@ class Collection:
                 updated = book_collection.update({'year': {'$gt': 1900}}, {'period': 'Modern'})
 
         """
-        with self.threading_lock:
+        with self.threading_lock.write_lock():
             results = self.collection.update(query, update)
+            if results:
+                self._log("update", self._query_document(query), update)
 
         self._cleanup()
         return results
 
-    def count(self):
+    def prepare(self, query):
+        """
+        Parse a query once, to run many times. Values to be filled in when the query is run are marked with Params.
+
+        Args:
+            query (dict): The query template.
+
+        Returns:
+            A PreparedQuery.
+
+        Example::
+
+            from essentialdb import Param
+
+            with library_db.books as book_collection:
+                by_author = book_collection.prepare({'author': Param('author')})
+                for author in authors:
+                    books = by_author.find(author=author)
+
         """
-        Get the total number of documents in the collection.
+        return PreparedQuery(self, QueryFilter(query))
+
+    def count(self, query=None, filter=None):
         """
-        return self.collection.count()
+        Count the documents that match the query, or all the documents in the collection if query is not specified.
+        A query answered entirely by indexes is counted from their posting lists without reading the documents,
+        anything else is counted as it is matched, without building a list of the results.
+
+        Kwargs:
+            query (dict): If specified, the query to be ran on the collection.
+            filter (func): If specified, documents must also pass the function to be counted.
+
+        Returns:
+            The number of matching documents.
+
+        Example::
+
+            with library_db.tickets as ticket_collection:
+                open_tickets = ticket_collection.count({'status': 'open'})
+
+        """
+        with self.threading_lock.read_lock():
+            return self.collection.count(query, filter)
+
+    def distinct(self, field, query=None):
+        """
+        Get the distinct values of field, among the documents matching query if it is specified. Documents without
+        the field are skipped. If the field is indexed, the values come from the index: all its keys when there is no
+        query, or the values it holds for the matches of a query answered entirely by indexes.
+
+        Args:
+            field (str): The field, which may be a dotted path into nested documents.
+
+        Kwargs:
+            query (dict): If specified, only the documents matching the query are considered.
+
+        Returns:
+            A list of the distinct values.
+
+        Example::
+
+            with library_db.tickets as ticket_collection:
+                for status in ticket_collection.distinct('status'):
+                    print(status, ticket_collection.count({'status': status}))
+
+        """
+        with self.threading_lock.read_lock():
+            return self.collection.distinct(field, query)
 
     def remove(self, query=None):
         """
@@ -243,16 +543,29 @@ class Collection:
             with library_db.books as book_collection:
                 document = book_collection.remove({'period': 'Modern'})
         """
-        with self.threading_lock:
+        with self.threading_lock.write_lock():
             results = self.collection.remove(query)
+            if results:
+                self._log("remove", self._query_document(query))
         self._cleanup()
         return results
 
     def createIndex(self, index, options=None):
         """
-        Create an index.
+        Create an index. "hashed" indexes answer equality queries, ordered indexes (1 or -1, for ascending or
+        descending) also answer range queries ($gt, $gte, $lt, $lte). "columnar" indexes (which need numpy) answer
+        range queries on numbers and strings with vectorized masks, and counts and numeric aggregates without reading
+        the documents.
+
+        Example::
+
+            with library_db.books as book_collection:
+                book_collection.createIndex({'author': 'hashed'})
+                book_collection.createIndex({'year': 1})
+
         """
-        results = self.collection.createIndex(index, options)
+        with self.threading_lock.write_lock():
+            results = self.collection.createIndex(index, options)
         self._cleanup()
         return results
 
@@ -260,10 +573,46 @@ class Collection:
         """
         Drop  all indexes.
         """
-        results = self.collection.dropIndexes()
+        with self.threading_lock.write_lock():
+            results = self.collection.dropIndexes()
         self._cleanup()
         return results
 
+    def enable_cache(self, max_entries=1000, max_bytes=32 * 1024 * 1024, fields=False):
+        """
+        Cache the results of find and find_one (without a filter function), for collections that are queried far more
+        often than they change. The least recently used results are evicted once there are more than max_entries of
+        them or they hold more than max_bytes. Every change discards the cached results - with fields=True, an update
+        only discards those of queries testing (or projections copying) the fields it sets. The cached lists are
+        copied for each caller, and so are projected documents, but the documents themselves are shared, as they
+        always are.
+
+        Kwargs:
+            max_entries (int): The most results to keep.
+            max_bytes (int): The most memory (estimated) the results can hold.
+            fields (bool): Invalidate by the fields updates set, rather than on every change.
+
+        Returns:
+            The QueryCache, see its stats.
+
+        Example::
+
+            with settings_db.config as config_collection:
+                config_collection.enable_cache(max_entries=100)
+                flags = config_collection.find({'type': 'flag'})
+
+        """
+        with self.threading_lock.write_lock():
+            self.collection.cache = QueryCache(max_entries, max_bytes, fields)
+        return self.collection.cache
+
+    def disable_cache(self):
+        """
+        Stop caching query results, discarding those cached.
+        """
+        with self.threading_lock.write_lock():
+            self.collection.cache = None
+
     def _get_collection_documents_raw(self):
         return self.collection.documents
 
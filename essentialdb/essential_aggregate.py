@@ -0,0 +1,505 @@
+import itertools
+from essentialdb import Projection, Cursor, EssentialColumnIndex
+from .essential_cursor import sort_documents, sort_value
+from .essential_index import field_value
+
+_missing = object()
+
+
+def expression(spec):
+    """
+    Get a function evaluating an aggregation expression on a document: "$field" (or "$dotted.path") is the value of
+    the field, a dictionary is evaluated field by field, and anything else is a constant. A missing field evaluates
+    to None inside a dictionary and is left out, on its own it evaluates to _missing.
+    """
+    if isinstance(spec, str) and spec.startswith("$"):
+        field = spec[1:]
+
+        def value(document):
+            try:
+                return document[field]
+            except Exception:
+                pass
+            found, found_value = field_value(document, field)
+            return found_value if found else _missing
+        return value
+    if isinstance(spec, dict):
+        for key in spec:
+            if isinstance(key, str) and key.startswith("$"):
+                raise ValueError("unsupported expression operator " + key)
+        fields = [(key, expression(spec[key])) for key in spec]
+
+        def evaluate(document):
+            result = {}
+            for key, function in fields:
+                item = function(document)
+                if item is not _missing:
+                    result[key] = item
+            return result
+        return evaluate
+    return lambda document: spec
+
+
+def _hashable(value):
+    # a key grouping equal values together, whatever their type
+    if isinstance(value, dict):
+        return (dict, tuple((key, _hashable(value[key])) for key in value))
+    if isinstance(value, list):
+        return (list, tuple(_hashable(item) for item in value))
+    try:
+        hash(value)
+    except TypeError:
+        return (type(value), repr(value))
+    return value
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class Pipeline:
+    """
+    An aggregation pipeline, run by Collection.aggregate::
+
+        pipeline = Pipeline([
+            {'$match': {'status': 'open'}},
+            {'$group': {'_id': '$project', 'tickets': {'$sum': 1}, 'latest': {'$max': '$due'}}},
+            {'$sort': {'tickets': -1}},
+            {'$limit': 10}
+        ])
+
+    The stages are:
+
+    * $match - keep the documents matching a query
+    * $project - a projection (see Projection), where a "$field" value sets a field to another field's value
+    * $group - group the documents by the _id expression, with fields accumulated by $sum, $avg, $min, $max or $push
+    * $unwind - one copy of each document for each item of an array field ("$field", or {'path': '$field',
+      'preserveNullAndEmptyArrays': True} to keep the documents without any)
+    * $sort - sort by fields, 1 for ascending and -1 for descending
+    * $skip and $limit
+
+    The stages are generators feeding each other, so documents flow through the pipeline one at a time and only
+    $group (holding one accumulator per group) and $sort (holding its input, or the top documents if a $limit follows)
+    have to see all of their input before producing any output. The leading $match, $sort, $skip and $limit stages
+    are run by a Cursor, so the query can be answered from indexes, a sort by an ordered index stops early and the
+    documents are read in batches. When every document is read by a $group or $sort before anything is returned, the
+    stages up to it run under a single read lock instead, as find does. A $group of everything into a single group
+    (a constant _id) by $sum, $avg, $min and $max of columnar fields, straight after the $match stages, is worked out
+    from the columns without reading the documents (see EssentialColumnIndex).
+    """
+
+    stage_names = ("$match", "$project", "$group", "$unwind", "$sort", "$skip", "$limit")
+
+    def __init__(self, stages):
+        self.stages = []
+        for stage in stages:
+            if not isinstance(stage, dict) or len(stage) != 1:
+                raise ValueError("each stage must be a dictionary with a single key, not " + repr(stage))
+            (name, spec), = stage.items()
+            if name not in self.stage_names:
+                raise ValueError("unsupported pipeline stage " + repr(name))
+            if name == "$sort":
+                if not isinstance(spec, dict) or not spec or any(direction not in (1, -1) for direction in
+                                                                   spec.values()):
+                    raise ValueError("$sort takes a dictionary of fields to 1 or -1, not " + repr(spec))
+                spec = list(spec.items())
+            elif name == "$skip" and (not isinstance(spec, int) or spec < 0):
+                raise ValueError("$skip takes an integer of at least 0, not " + repr(spec))
+            elif name == "$limit" and (not isinstance(spec, int) or spec < 1):
+                raise ValueError("$limit takes a positive integer, not " + repr(spec))
+            elif name == "$group":
+                spec = self._compile_group(spec)
+            elif name == "$project":
+                spec = self._compile_project(spec)
+            elif name == "$unwind":
+                spec = self._compile_unwind(spec)
+            self.stages.append((name, spec))
+
+    def run(self, collection):
+        """
+        Get a generator yielding the results of the pipeline on collection.
+        """
+        query, sort, skip, limit, stages = self._leading()
+        blocking = self._blocking(stages)
+        if blocking is not None and sort is None and not skip and not limit:
+            documents = self._drain(collection, query, stages, blocking)
+            first = blocking + 1
+        else:
+            cursor = Cursor(collection, query).skip(skip).limit(limit)
+            if sort is not None:
+                cursor.sort(sort)
+            documents = self._stream(cursor)
+            first = 0
+        for position in range(first, len(stages)):
+            name, spec = stages[position]
+            if name == "$sort":
+                documents = self._sort(documents, spec, self._limit_after(stages, position))
+            else:
+                documents = getattr(self, "_" + name[1:])(documents, spec, collection)
+        return documents
+
+    def _leading(self):
+        # the leading $match (all of them), $sort, $skip and $limit stages, which a cursor can run, and the stages
+        # left over
+        stages = self.stages
+        queries = []
+        while stages and stages[0][0] == "$match":
+            queries.append(stages[0][1])
+            stages = stages[1:]
+        query = {} if not queries else queries[0] if len(queries) == 1 else {"$and": queries}
+        sort, skip, limit = None, 0, 0
+        if stages and stages[0][0] == "$sort":
+            sort = stages[0][1]
+            stages = stages[1:]
+        if stages and stages[0][0] == "$skip":
+            skip = stages[0][1]
+            stages = stages[1:]
+        if stages and stages[0][0] == "$limit":
+            limit = stages[0][1]
+            stages = stages[1:]
+        return query, sort, skip, limit, stages
+
+    @staticmethod
+    def _blocking(stages):
+        # the position of the first $group or $sort, if only streaming stages come before it
+        for position, (name, spec) in enumerate(stages):
+            if name in ("$group", "$sort"):
+                return position
+            if name not in ("$match", "$project", "$unwind"):
+                return None
+        return None
+
+    @staticmethod
+    def _stream(cursor):
+        # iterating a sorted cursor sorts it straight away, so it isn't iterated until the first result is wanted
+        for document in cursor:
+            yield document
+
+    def _drain(self, collection, query, stages, blocking):
+        # the stages up to the blocking one read every document before it returns anything, so they run under a
+        # single read lock, like find, rather than batch by batch - the results are returned after it is released
+        local = collection.collection
+        with collection.threading_lock.read_lock():
+            name, spec = stages[blocking]
+            results = self._columnar(local, query, spec) if blocking == 0 and name == "$group" else None
+            if results is None:
+                documents = local._filter(query).iter_filter(local.documents, None, local.indexes, local.query_mode)
+                for name, spec in stages[:blocking]:
+                    documents = getattr(self, "_" + name[1:])(documents, spec, collection)
+                name, spec = stages[blocking]
+                if name == "$group":
+                    results = self._grouped(documents, spec)
+                else:
+                    results = sort_documents(list(documents), spec, self._limit_after(stages, blocking))
+        for document in results:
+            yield document
+
+    @staticmethod
+    def _columnar(local, query, spec):
+        # a $group of everything the query matches into a single group, answered from the columnar indexes without
+        # reading the documents - None if it can't be
+        columnar = spec[2]
+        if columnar is None:
+            return None
+        group_id, accumulators = columnar
+        indexes = local.indexes
+        if not all(isinstance(indexes.get(argument), EssentialColumnIndex) for field, name, argument, constant in
+                   accumulators if argument is not None):
+            return None
+        if query:
+            columns = local._filter(query).column_mask(indexes)
+            if columns is None:
+                return None
+            store, mask = columns
+        elif local.column_store is not None and local.column_store.columns:
+            store = local.column_store
+            mask = store.live()
+        else:
+            return None
+
+        count = int(mask.sum())
+        if not count:
+            return []
+        result = {"_id": group_id}
+        for field, name, argument, constant in accumulators:
+            if argument is None:
+                result[field] = constant * count
+                continue
+            done, value = store.reduce(mask, argument, name)
+            if not done:
+                return None
+            result[field] = value
+        return [result]
+
+    @staticmethod
+    def _limit_after(stages, position):
+        # the number of documents a $sort has to produce, if $skip/$limit stages follow it
+        skip = 0
+        for name, spec in stages[position + 1:]:
+            if name == "$skip":
+                skip += spec
+            elif name == "$limit":
+                return skip + spec
+            else:
+                return None
+        return None
+
+    @staticmethod
+    def _match(documents, query, collection):
+        local = collection.collection
+        test = local._filter(query).tester(None, local.query_mode)
+        if test is None:
+            return documents
+        return (document for document in documents if test(document) is True)
+
+    @staticmethod
+    def _sort(documents, sort, limit=None):
+        for document in sort_documents(list(documents), sort, limit):
+            yield document
+
+    @staticmethod
+    def _skip(documents, skip, collection):
+        return itertools.islice(documents, skip, None)
+
+    @staticmethod
+    def _limit(documents, limit, collection):
+        return itertools.islice(documents, limit)
+
+    @staticmethod
+    def _compile_project(spec):
+        if not isinstance(spec, dict):
+            raise ValueError("$project takes a dictionary, not " + repr(spec))
+        computed = [(field, expression(value)) for field, value in spec.items()
+                    if not isinstance(value, (bool, int))]
+        projection = Projection({field: value for field, value in spec.items() if isinstance(value, (bool, int))})
+        if computed and not projection.inclusion and projection.fields:
+            raise ValueError("$project can't both exclude fields and compute them")
+        return projection, computed
+
+    @staticmethod
+    def _project(documents, spec, collection):
+        projection, computed = spec
+        if not computed:
+            return map(projection.apply, documents)
+        return (Pipeline._computed(document, projection, computed) for document in documents)
+
+    @staticmethod
+    def _computed(document, projection, computed):
+        # only the _id (unless it is excluded), the fields included and the computed fields are kept
+        if not isinstance(document, dict):
+            return document
+        if projection.fields:
+            result = projection.apply(document)
+        else:
+            result = {"_id": document["_id"]} if projection.include_id and "_id" in document else {}
+        for field, function in computed:
+            value = function(document)
+            if value is not _missing:
+                result[field] = value
+        return result
+
+    @staticmethod
+    def _compile_unwind(spec):
+        preserve = False
+        if isinstance(spec, dict):
+            preserve = bool(spec.get("preserveNullAndEmptyArrays", False))
+            spec = spec.get("path")
+        if not isinstance(spec, str) or not spec.startswith("$"):
+            raise ValueError("$unwind takes a field path starting with $, not " + repr(spec))
+        return spec[1:], preserve
+
+    @staticmethod
+    def _unwind(documents, spec, collection):
+        field, preserve = spec
+        path = field.split('.')
+        for document in documents:
+            found, value = field_value(document, field)
+            if not found or value is None or (isinstance(value, list) and not value):
+                if preserve:
+                    yield document
+                continue
+            if not isinstance(value, list):
+                yield document
+                continue
+            literal = field in document
+            for item in value:
+                yield _replaced(document, field if literal else path, item)
+
+    @staticmethod
+    def _compile_group(spec):
+        if not isinstance(spec, dict) or "_id" not in spec:
+            raise ValueError("$group takes a dictionary with an _id, not " + repr(spec))
+        key = expression(spec["_id"])
+        accumulators = []
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            if not isinstance(accumulator, dict) or len(accumulator) != 1:
+                raise ValueError("$group field " + repr(field) + " must be a single accumulator")
+            (name, argument), = accumulator.items()
+            if name not in _accumulators:
+                raise ValueError("unsupported accumulator " + repr(name))
+            constant = argument if name == "$sum" and _is_number(argument) else None
+            accumulators.append((field, _accumulators[name], expression(argument), constant))
+        return key, accumulators, Pipeline._compile_columnar(spec)
+
+    @staticmethod
+    def _compile_columnar(spec):
+        # (_id, [(field, accumulator name, argument field or None, constant)]) for a group of every document into one
+        # (a constant _id) by $sum of an int constant, or $sum, $avg, $min and $max of fields, which the columnar
+        # indexes might answer - otherwise None
+        group_id = spec["_id"]
+        if isinstance(group_id, (dict, list)) or isinstance(group_id, str) and group_id.startswith("$"):
+            return None
+        accumulators = []
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (name, argument), = accumulator.items()
+            if name == "$sum" and argument.__class__ is int:
+                accumulators.append((field, name, None, argument))
+            elif name in ("$sum", "$avg", "$min", "$max") and isinstance(argument, str) and \
+                    argument.startswith("$"):
+                accumulators.append((field, name, argument[1:], None))
+            else:
+                return None
+        return group_id, accumulators
+
+    @staticmethod
+    def _group(documents, spec, collection):
+        for result in Pipeline._grouped(documents, spec):
+            yield result
+
+    @staticmethod
+    def _grouped(documents, spec):
+        # the list of groups, once every document is read
+        key, accumulators, columnar = spec
+        # {'$sum': <number>} just counts, the rest evaluate their expression for each document
+        counts = [(position, constant) for position, (field, accumulator, function, constant) in
+                  enumerate(accumulators, 1) if constant is not None]
+        steps = [(position, accumulator.add, function) for position, (field, accumulator, function, constant) in
+                 enumerate(accumulators, 1) if constant is None]
+        groups = {}
+        for document in documents:
+            _id = key(document)
+            if _id is _missing:
+                _id = None
+            try:
+                group = groups[_id]
+            except (KeyError, TypeError):
+                hashable = _hashable(_id)
+                group = groups.get(hashable)
+                if group is None:
+                    group = groups[hashable] = [_id] + [accumulator.start() for field, accumulator, function, constant
+                                                        in accumulators]
+            for position, constant in counts:
+                group[position] += constant
+            for position, add, function in steps:
+                value = function(document)
+                if value is not _missing:
+                    group[position] = add(group[position], value)
+
+        results = []
+        for group in groups.values():
+            result = {"_id": group[0]}
+            for position, (field, accumulator, function, constant) in enumerate(accumulators, 1):
+                result[field] = accumulator.result(group[position])
+            results.append(result)
+        return results
+
+
+def _replaced(document, field, value):
+    # a copy of document with field (a key, or a path as a list) set to value, copying the nested documents on the way
+    result = dict(document)
+    if not isinstance(field, list):
+        result[field] = value
+        return result
+    target = result
+    for item in field[:-1]:
+        target[item] = dict(target[item])
+        target = target[item]
+    target[field[-1]] = value
+    return result
+
+
+class _Sum:
+    # numbers are added up, anything else is ignored
+    @staticmethod
+    def start():
+        return 0
+
+    @staticmethod
+    def add(state, value):
+        cls = value.__class__
+        if cls is int or cls is float or _is_number(value):
+            return state + value
+        return state
+
+    @staticmethod
+    def result(state):
+        return state
+
+
+class _Avg:
+    @staticmethod
+    def start():
+        return [0, 0]
+
+    @staticmethod
+    def add(state, value):
+        cls = value.__class__
+        if cls is int or cls is float or _is_number(value):
+            state[0] += value
+            state[1] += 1
+        return state
+
+    @staticmethod
+    def result(state):
+        return state[0] / state[1] if state[1] else None
+
+
+class _Min:
+    # compared in sort order, None is ignored
+    @staticmethod
+    def start():
+        return _missing
+
+    @staticmethod
+    def add(state, value):
+        if value is None:
+            return state
+        if state is _missing or sort_value(value) < sort_value(state):
+            return value
+        return state
+
+    @staticmethod
+    def result(state):
+        return None if state is _missing else state
+
+
+class _Max(_Min):
+    @staticmethod
+    def add(state, value):
+        if value is None:
+            return state
+        if state is _missing or sort_value(value) > sort_value(state):
+            return value
+        return state
+
+
+class _Push:
+    @staticmethod
+    def start():
+        return []
+
+    @staticmethod
+    def add(state, value):
+        state.append(value)
+        return state
+
+    @staticmethod
+    def result(state):
+        return state
+
+
+_accumulators = {"$sum": _Sum, "$avg": _Avg, "$min": _Min, "$max": _Max, "$push": _Push}
@@ -0,0 +1,157 @@
+import collections
+import sys
+import threading
+
+
+def _normalized(value):
+    # a hashable form of a query (or projection) value - dictionaries don't depend on the order of their keys, and
+    # values of different types (1, 1.0 and True) are kept apart. Raises TypeError for anything else unhashable.
+    if isinstance(value, dict):
+        pairs = [(key, _normalized(item)) for key, item in value.items()]
+        try:
+            # the keys are distinct, so only they are compared
+            pairs.sort()
+        except TypeError:
+            pairs.sort(key=lambda pair: repr(pair[0]))
+        return dict, tuple(pairs)
+    if isinstance(value, (list, tuple)):
+        return value.__class__, tuple(_normalized(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset, frozenset(_normalized(item) for item in value)
+    hash(value)
+    return value.__class__, value
+
+
+def estimate_size(value):
+    """
+    Estimate the memory held by value in bytes, counting the dictionaries, lists and tuples it holds too.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += sys.getsizeof(key) + estimate_size(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += estimate_size(item)
+    return size
+
+
+def _overlaps(field, touched):
+    # whether changing touched can change field (or the other way around), for dotted paths too
+    if field == touched:
+        return True
+    if not isinstance(field, str) or not isinstance(touched, str):
+        return False
+    return field.startswith(touched + ".") or touched.startswith(field + ".")
+
+
+class QueryCache:
+    """
+    A cache of a collection's query results (see Collection.enable_cache), keyed by the operation, the query and the
+    projection - the order of the keys in a query doesn't matter. The least recently used results are evicted once
+    there are more than max_entries of them, or they hold more than max_bytes (as estimated by estimate_size).
+
+    Every write to the collection bumps its version, and results cached at an earlier version are discarded when they
+    are next looked up. With fields=True, an update only discards the results depending on the fields it sets: those
+    whose query reads one of them, or whose projection copies one of them. Documents are updated in place, so the
+    results of other queries still hold the current documents. Inserts and removes discard everything.
+
+    Cached results are shared between the callers getting them - don't change them. The collection copies them (and
+    the projected documents in them) for each caller.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=32 * 1024 * 1024, fields=False):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.fields = fields
+        self.version = 0
+        # key -> (version, results, size, dependencies), least recently used first
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # readers share the collection's lock, so they need their own to share the cache
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(operation, query, projection=None):
+        """
+        Get the cache key for operation (a name) with query and projection, or None if they can't be cached.
+        """
+        if hasattr(query, "to_query"):
+            query = query.to_query()
+        try:
+            return operation, _normalized(query), _normalized(projection)
+        except TypeError:
+            return None
+
+    def get(self, key):
+        """
+        Get the results cached for key, or None if there are none at the current version.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] != self.version:
+                self._discard(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, results, dependencies=None):
+        """
+        Cache results for key. dependencies are the fields the results depend on, or None if they depend on every
+        field.
+        """
+        size = estimate_size(results)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._discard(key)
+            self.entries[key] = (self.version, results, size, dependencies)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._discard(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, fields=None):
+        """
+        Discard the results a write could have changed: those depending on fields (the fields an update set) when
+        the cache tracks fields, otherwise all of them.
+        """
+        with self.lock:
+            if fields is None or not self.fields:
+                self.version += 1
+                return
+            for key, entry in list(self.entries.items()):
+                dependencies = entry[3]
+                if dependencies is None or any(_overlaps(field, touched) for field in dependencies
+                                               for touched in fields):
+                    self._discard(key)
+
+    def _discard(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry[2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """
+        Get a dictionary of the number of entries, the bytes they hold, and the hits, misses and evictions so far.
+        """
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
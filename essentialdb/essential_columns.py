@@ -0,0 +1,363 @@
+from .essential_index import EssentialIndex, range_operators
+from .keys import Keys
+
+try:
+    import numpy
+except ImportError:
+    # columnar indexes are optional, install them with: pip install essentialdb[columnar]
+    numpy = None
+
+# what each row of a column holds: free rows belong to no document, "other" values (bools, None, ints too large for a
+# float64, NaN, any other type and dotted fields shadowed by a nested value) can't be compared in the arrays
+FREE, MISSING, INT, FLOAT, STR, OTHER = range(6)
+
+# ints up to this magnitude are held exactly by a float64
+_exact = 2 ** 53
+
+column_operators = ("$eq", "$in") + range_operators
+
+
+def kind(value):
+    """
+    Get the kind of row value is held in.
+    """
+    cls = value.__class__
+    if cls is int:
+        return INT if -_exact <= value <= _exact else OTHER
+    if cls is float:
+        return FLOAT if value == value else OTHER
+    if cls is str:
+        return STR
+    return OTHER
+
+
+def comparable(value):
+    """
+    Check whether a query value can be compared with a column's arrays: a number (but not a bool, NaN or an int too
+    large for a float64) or a string.
+    """
+    return kind(value) in (INT, FLOAT, STR)
+
+
+class _Column:
+    # the values of one field: numbers in a float64 array, strings as codes into a dictionary of the distinct strings
+
+    def __init__(self, capacity):
+        self.kinds = numpy.zeros(capacity, numpy.uint8)
+        self.numbers = numpy.zeros(capacity, numpy.float64)
+        self.codes = numpy.full(capacity, -1, numpy.int32)
+        self.strings = {}
+
+    def grow(self, capacity):
+        for name in ("kinds", "numbers", "codes"):
+            old = getattr(self, name)
+            new = numpy.zeros(capacity, old.dtype) if name != "codes" else numpy.full(capacity, -1, old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def code(self, string):
+        code = self.strings.get(string)
+        if code is None:
+            code = self.strings[string] = len(self.strings)
+        return code
+
+
+class ColumnStore:
+    """
+    The columns of a collection's columnar indexes (see EssentialColumnIndex). Each document has a row, at the same
+    position in every column, so the terms of a conjunction on several columnar fields are answered together by
+    combining boolean masks over the rows. Rows freed by removed documents are reused.
+
+    Equality, $in, $gt, $gte, $lt and $lte with a number or string are answered exactly for the rows holding numbers
+    or strings - a number never matches a string, as in a query - while rows holding any other kind of value are
+    returned as candidates to be tested directly.
+    """
+
+    def __init__(self):
+        if numpy is None:
+            raise ImportError("columnar indexes need numpy, install it with: pip install essentialdb[columnar]")
+        self.columns = {}
+        # _id -> row and row -> _id (None for a free row)
+        self.rows = {}
+        self.ids = []
+        # row -> the number of columns holding it, a row is freed when no column does
+        self.held = []
+        self.free = []
+        self.capacity = 0
+
+    def add_column(self, field):
+        if field in self.columns:
+            self.drop_column(field)
+        self.columns[field] = _Column(self.capacity)
+
+    def drop_column(self, field):
+        self.clear_column(field)
+        del self.columns[field]
+
+    def clear_column(self, field):
+        column = self.columns[field]
+        count = len(self.ids)
+        for row in numpy.flatnonzero(column.kinds[:count]).tolist():
+            self._release(row)
+        column.kinds[:] = FREE
+        column.codes[:] = -1
+        column.strings = {}
+
+    def _row(self, _id):
+        row = self.rows.get(_id)
+        if row is None:
+            if self.free:
+                row = self.free.pop()
+                self.ids[row] = _id
+            else:
+                row = len(self.ids)
+                self.ids.append(_id)
+                self.held.append(0)
+                if row >= self.capacity:
+                    self.capacity = max(1024, self.capacity * 2)
+                    for column in self.columns.values():
+                        column.grow(self.capacity)
+            self.rows[_id] = row
+        return row
+
+    def _release(self, row):
+        self.held[row] -= 1
+        if not self.held[row]:
+            del self.rows[self.ids[row]]
+            self.ids[row] = None
+            self.free.append(row)
+
+    def set(self, field, _id, row_kind, value):
+        """
+        Set the value of field for the document _id, where row_kind is its kind (see kind, or MISSING).
+        """
+        column = self.columns[field]
+        row = self._row(_id)
+        if column.kinds[row] == FREE:
+            self.held[row] += 1
+        column.kinds[row] = row_kind
+        column.codes[row] = column.code(value) if row_kind == STR else -1
+        if row_kind == INT or row_kind == FLOAT:
+            column.numbers[row] = value
+
+    def set_many(self, field, items):
+        """
+        Set the values of field for a batch of (_id, kind, value) items at once.
+        """
+        column = self.columns[field]
+        items = {_id: (row_kind, value) for _id, row_kind, value in items}
+        if not items:
+            return
+        rows = [self._row(_id) for _id in items]
+        kinds = column.kinds
+        held = self.held
+        for row in rows:
+            if kinds[row] == FREE:
+                held[row] += 1
+        values = list(items.values())
+        rows = numpy.array(rows, numpy.intp)
+        kinds[rows] = [row_kind for row_kind, value in values]
+        column.numbers[rows] = [value if row_kind == INT or row_kind == FLOAT else 0.0 for row_kind, value in values]
+        column.codes[rows] = [column.code(value) if row_kind == STR else -1 for row_kind, value in values]
+
+    def clear(self, field, _id):
+        """
+        Remove the document _id from the column of field.
+        """
+        row = self.rows.get(_id)
+        column = self.columns[field]
+        if row is None or column.kinds[row] == FREE:
+            return
+        column.kinds[row] = FREE
+        column.codes[row] = -1
+        self._release(row)
+
+    def _term(self, field, operator, value):
+        # (matches, uncertain) masks over the rows for one term
+        column = self.columns[field]
+        count = len(self.ids)
+        kinds = column.kinds[:count]
+        uncertain = kinds == OTHER
+        values = value if operator == "$in" else [value]
+        strings = [item for item in values if item.__class__ is str]
+        numbers = [item for item in values if item.__class__ is not str]
+
+        if operator in ("$eq", "$in"):
+            codes = [column.strings[item] for item in strings if item in column.strings]
+        else:
+            compare = Keys.comparisons[operator]
+            codes = [code for string, code in column.strings.items() if compare(string, value)] if strings else []
+        if not codes:
+            matches = numpy.zeros(count, bool)
+        elif len(codes) == 1:
+            matches = column.codes[:count] == codes[0]
+        else:
+            matches = numpy.isin(column.codes[:count], codes)
+
+        if numbers:
+            if operator == "$in":
+                found = numpy.isin(column.numbers[:count], numbers)
+            else:
+                found = Keys.comparisons[operator](column.numbers[:count], value)
+            matches |= found & ((kinds == INT) | (kinds == FLOAT))
+        return matches, uncertain
+
+    def mask(self, terms):
+        """
+        Get the rows matching every term.
+
+        Args:
+            terms (list): (field, operator, value) tuples, where operator is one of column_operators and value is
+                comparable (for $in, a list of comparable values).
+
+        Returns:
+            A tuple of (candidates, exact), where candidates is a boolean array over the rows and exact is False if
+            some of the candidates hold values that have to be tested directly.
+        """
+        matches = candidates = None
+        for field, operator, value in terms:
+            term_matches, uncertain = self._term(field, operator, value)
+            term_candidates = term_matches | uncertain if uncertain.any() else term_matches
+            if matches is None:
+                matches, candidates = term_matches, term_candidates
+            else:
+                matches = matches & term_matches
+                candidates = candidates & term_candidates
+        exact = candidates is matches or numpy.count_nonzero(candidates) == numpy.count_nonzero(matches)
+        return candidates, exact
+
+    def find(self, terms):
+        """
+        Find the documents matching every term (see mask).
+
+        Returns:
+            A tuple of (candidates, exact), where candidates is an ordered set (dict) of _ids.
+        """
+        candidates, exact = self.mask(terms)
+        ids = self.ids
+        return dict.fromkeys([ids[row] for row in numpy.flatnonzero(candidates).tolist()]), exact
+
+    def live(self):
+        """
+        Get a mask of the rows belonging to documents.
+        """
+        count = len(self.ids)
+        if not self.columns:
+            return numpy.zeros(count, bool)
+        return next(iter(self.columns.values())).kinds[:count] != FREE
+
+    def reduce(self, mask, field, operator):
+        """
+        Work out the $sum, $avg, $min or $max of field over the rows in mask the way an aggregation $group does.
+        $sum and $avg add up the numbers, ignoring strings and missing values; $min and $max compare numbers only.
+
+        Returns:
+            A tuple of (done, result), where done is False if some of the rows hold values the arrays can't account
+            for, so the documents have to be read.
+        """
+        column = self.columns[field]
+        count = len(self.ids)
+        kinds = column.kinds[:count][mask]
+        if (kinds == OTHER).any():
+            return False, None
+        numeric = (kinds == INT) | (kinds == FLOAT)
+        values = column.numbers[:count][mask][numeric]
+        floats = (kinds == FLOAT).any()
+
+        if operator in ("$min", "$max"):
+            if (kinds == STR).any():
+                # strings sort after numbers
+                return False, None
+            if not len(values):
+                return True, None
+            position = values.argmin() if operator == "$min" else values.argmax()
+            value = values[position].item()
+            return True, value if floats and kinds[numeric][position] == FLOAT else int(value)
+
+        if not floats:
+            if len(values) and float(numpy.abs(values).max()) * len(values) < 2 ** 63:
+                total = int(values.astype(numpy.int64).sum())
+            else:
+                total = sum(int(value) for value in values.tolist())
+        else:
+            total = float(values.sum())
+        if operator == "$sum":
+            return True, total
+        return True, total / len(values) if len(values) else None
+
+
+class EssentialColumnIndex(EssentialIndex):
+    """
+    A hash index that also keeps the values of its field in a column of the collection's ColumnStore, so range and
+    equality queries on it (together with any other columnar fields in the same conjunction) are answered with
+    vectorized masks, and counts and numeric aggregates without reading the documents. Needs numpy.
+    """
+
+    def __init__(self, field_key, store, index_type='columnar', index_name=None):
+        EssentialIndex.__init__(self, field_key, index_type, index_name)
+        self.store = store
+        self._path = field_key.split('.') if isinstance(field_key, str) and "." in field_key else None
+        self._pending = None
+        store.add_column(field_key)
+
+    def _kind(self, document):
+        # (kind, value) of the row for document
+        found, value = self._value(document)
+        if not found:
+            return MISSING, None
+        if self._path is not None and self._is_shadowed(document):
+            # a failed comparison with the key goes on to try the nested value
+            return OTHER, None
+        return kind(value), value
+
+    def _is_shadowed(self, document):
+        try:
+            document[self.field_key]
+            current = document
+            for item in self._path:
+                current = current[item]
+            return True
+        except Exception:
+            return False
+
+    def create_index(self, data):
+        self.clear()
+        self._bulk_update((key, data[key]) for key in data)
+        return self.index
+
+    def update_index(self, document, _id=None):
+        EssentialIndex.update_index(self, document, _id)
+        if _id is None:
+            _id = document['_id']
+        row_kind, value = self._kind(document)
+        if self._pending is not None:
+            self._pending.append((_id, row_kind, value))
+        else:
+            self.store.set(self.field_key, _id, row_kind, value)
+
+    def update_index_many(self, documents):
+        """
+        Add a batch of documents to the index, filling their rows of the column in at once.
+        """
+        self._bulk_update((document['_id'], document) for document in documents)
+
+    def _bulk_update(self, items):
+        # items are (_id, document) pairs
+        self._pending = []
+        try:
+            for _id, document in items:
+                self.update_index(document, _id)
+        finally:
+            pending, self._pending = self._pending, None
+            self.store.set_many(self.field_key, pending)
+
+    def remove_from_index(self, document, _id=None):
+        if _id is None and '_id' in document:
+            _id = document['_id']
+        if _id is not None:
+            self.store.clear(self.field_key, _id)
+        return EssentialIndex.remove_from_index(self, document, _id)
+
+    def clear(self):
+        EssentialIndex.clear(self)
+        self.store.clear_column(self.field_key)
@@ -0,0 +1,107 @@
+import bz2
+import gzip
+import io
+import lzma
+
+
+class NoCompression:
+    """
+    Pass-through codec, handy as a baseline when benchmarking.
+    """
+
+    name = "none"
+
+    def __init__(self, level=None):
+        self.level = level
+
+    def open(self, file_path, mode):
+        return open(file_path, mode)
+
+
+class ZlibCodec:
+    """
+    DEFLATE compression from zlib (written with gzip framing, so files can be inspected with standard tools). Fast,
+    with a modest ratio. Levels run from 1 (fastest) to 9 (smallest).
+    """
+
+    name = "zlib"
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def open(self, file_path, mode):
+        return gzip.open(file_path, mode, compresslevel=self.level)
+
+
+class BZ2Codec:
+    """
+    bzip2 compression. Slower than zlib, usually smaller on text. Levels run from 1 to 9.
+    """
+
+    name = "bz2"
+
+    def __init__(self, level=9):
+        self.level = level
+
+    def open(self, file_path, mode):
+        return bz2.open(file_path, mode, compresslevel=self.level)
+
+
+class LZMACodec:
+    """
+    LZMA (xz) compression. Slowest to write, smallest output. Presets run from 0 to 9.
+    """
+
+    name = "lzma"
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def open(self, file_path, mode):
+        if 'w' in mode:
+            return lzma.open(file_path, mode, preset=self.level)
+        return lzma.open(file_path, mode)
+
+
+codecs = {
+    NoCompression.name: NoCompression,
+    ZlibCodec.name: ZlibCodec,
+    BZ2Codec.name: BZ2Codec,
+    LZMACodec.name: LZMACodec
+}
+
+
+class CompressedSerializer:
+    """
+    Wraps another serializer, compressing the file as it is written and decompressing it as it is read. Data is
+    streamed through the codec, so the uncompressed file is never held in memory::
+
+        serializer = CompressedSerializer(PickleSerializer(), codec="zlib", level=1)
+        db = EssentialDB(filepath="my.db", serializer=serializer)
+
+    The wrapped serializer must implement load_fp and dump_fp (all of the builtin serializers do, except
+    BinarySerializer, which needs random access to an uncompressed file).
+    """
+
+    def __init__(self, serializer, codec="zlib", level=None):
+        if not hasattr(serializer, 'load_fp') or not hasattr(serializer, 'dump_fp'):
+            raise TypeError(serializer.__class__.__name__ + " does not support streaming (load_fp/dump_fp)")
+        if isinstance(codec, str):
+            codec = codecs[codec]() if level is None else codecs[codec](level)
+        self.serializer = serializer
+        self.codec = codec
+
+    def load(self, file_path):
+        with self.codec.open(file_path, 'rb') as fp:
+            if self.serializer.binary:
+                return self.serializer.load_fp(fp)
+            with io.TextIOWrapper(fp, encoding='utf-8') as text:
+                return self.serializer.load_fp(text)
+
+    def dump(self, data, file_path):
+        with self.codec.open(file_path, 'wb') as fp:
+            if self.serializer.binary:
+                self.serializer.dump_fp(data, fp)
+            else:
+                with io.TextIOWrapper(fp, encoding='utf-8') as text:
+                    self.serializer.dump_fp(data, text)
@@ -0,0 +1,421 @@
+import datetime
+import heapq
+import itertools
+import time
+from essentialdb import EssentialOrderedIndex
+from essentialdb import Projection
+
+_missing = object()
+
+
+class _Other:
+    # sort key for values of types without a rank, compared naturally where they can be
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        try:
+            return bool(self.value == other.value)
+        except Exception:
+            return False
+
+    def __lt__(self, other):
+        try:
+            return bool(self.value < other.value)
+        except Exception:
+            return type(self.value).__name__ < type(other.value).__name__
+
+
+class _Reversed:
+    # inverts the order of a sort key, for descending fields in a sort with mixed directions
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+
+def sort_value(value):
+    """
+    Get a key ordering value among values of any type. Missing fields and None come first, then NaN and numbers
+    (including booleans), strings, bytes, datetimes, dates, timedeltas, dictionaries, lists and tuples (compared
+    element by element) and finally anything else.
+    """
+    cls = value.__class__
+    if cls is float or cls is int:
+        return (1, 1, value) if value == value else (1, 0)
+    if cls in _ranks:
+        return (_ranks[cls], value)
+    if value is None or value is _missing:
+        return (0,)
+    if isinstance(value, (int, float)):
+        if value != value:
+            return (1, 0)
+        return (1, 1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, bytes):
+        return (3, value)
+    if isinstance(value, datetime.datetime):
+        return (4, value)
+    if isinstance(value, datetime.date):
+        return (5, value)
+    if isinstance(value, datetime.timedelta):
+        return (6, value)
+    if isinstance(value, dict):
+        return (7, tuple((sort_value(key), sort_value(value[key])) for key in value))
+    if isinstance(value, (list, tuple)):
+        return (8, tuple(sort_value(item) for item in value))
+    return (9, _Other(value))
+
+
+# exact types ranked without further checks
+_ranks = {str: 2, bytes: 3, datetime.datetime: 4, datetime.date: 5, datetime.timedelta: 6}
+
+
+def _field_value(document, field):
+    # looks a field up the way queries do, _missing if it isn't there
+    try:
+        return document[field]
+    except Exception:
+        pass
+    if isinstance(field, str) and "." in field:
+        try:
+            for item in field.split('.'):
+                document = document[item]
+            return document
+        except Exception:
+            pass
+    return _missing
+
+
+def sort_key(sort):
+    """
+    Get a key function for sorting documents by sort, a list of (field, direction) pairs.
+
+    Returns:
+        A tuple of (key, reverse), to pass to sorted.
+    """
+    directions = set(direction for field, direction in sort)
+    if len(sort) == 1:
+        field = sort[0][0]
+
+        def key(document):
+            try:
+                return sort_value(document[field])
+            except Exception:
+                return sort_value(_field_value(document, field))
+        return key, sort[0][1] == -1
+    if len(directions) == 1:
+        fields = [field for field, direction in sort]
+        return (lambda document: tuple(sort_value(_field_value(document, field)) for field in fields)), \
+            sort[0][1] == -1
+
+    def key(document):
+        return tuple(sort_value(_field_value(document, field)) if direction == 1 else
+                     _Reversed(sort_value(_field_value(document, field))) for field, direction in sort)
+    return key, False
+
+def _kind(values):
+    # the rank shared by all of values, if their natural order is their sort order, otherwise None
+    classes = set(map(type, values))
+    if classes <= {int, float, bool}:
+        # a NaN makes the sum NaN (as does inf - inf, which is then checked the slow way)
+        if float in classes:
+            total = sum(values)
+            if total != total and any(value != value for value in values):
+                return None
+        return 1
+    if len(classes) == 1:
+        return _ranks.get(classes.pop())
+    return None
+
+
+def _column(documents, field):
+    try:
+        return [document[field] for document in documents]
+    except Exception:
+        return [_field_value(document, field) for document in documents]
+
+
+def sort_documents(documents, sort, limit=None):
+    """
+    Sort a list of documents by sort, a list of (field, direction) pairs, keeping the first limit (on a heap) if a
+    limit is given. Fields holding values of a single type (numbers, strings, ...) are compared directly, anything
+    else through sort_value.
+    """
+    columns = []
+    for field, direction in sort:
+        values = _column(documents, field)
+        kind = _kind(values)
+        if kind is None or (direction != sort[0][1] and kind != 1):
+            # descending columns can only be folded into an ascending sort by negating numbers
+            columns = None
+            break
+        if direction != sort[0][1]:
+            values = [-value for value in values]
+        columns.append(values)
+
+    reverse = sort[0][1] == -1
+    if columns is None:
+        key, reverse = sort_key(sort)
+        keys = [key(document) for document in documents]
+    elif len(columns) == 1:
+        keys = columns[0]
+    else:
+        keys = list(zip(*columns))
+
+    positions = range(len(documents))
+    if limit is None:
+        order = sorted(positions, key=keys.__getitem__, reverse=reverse)
+    elif reverse:
+        order = heapq.nlargest(limit, positions, key=keys.__getitem__)
+    else:
+        order = heapq.nsmallest(limit, positions, key=keys.__getitem__)
+    return [documents[position] for position in order]
+
+
+class Cursor:
+    """
+    A lazily evaluated query, returned by Collection.find(query, cursor=True). Nothing is matched until the cursor is
+    iterated, and matching stops as soon as enough documents have been found::
+
+        for book in books.find({'author': 'Langston Hughes'}, cursor=True).skip(20).limit(20):
+            print(book['title'])
+
+    The documents are found in batches of batch_size, each under the collection's read lock, so writers can get in
+    between batches. The documents to consider are fixed when iteration starts: a document inserted later isn't
+    returned, a document removed before its batch is skipped, and each document is tested as it is when its batch is
+    read.
+
+    If a projection is given, each document is projected (see Projection) as it is returned; sorting uses the whole
+    documents, so the sort fields don't need to be projected.
+    """
+
+    def __init__(self, collection, query=None, filter_function=None, projection=None):
+        self.collection = collection
+        # an _id on its own, as find takes it
+        self.query = {"_id": query} if isinstance(query, str) else query
+        self.filter_function = filter_function
+        self.projection = Projection(projection) if projection is not None else None
+        self._limit = 0
+        self._skip = 0
+        self._batch_size = 100
+        self._sort = None
+        self._started = False
+        # how the cursor found its documents, for explain
+        self._access_path = None
+        self._examined = 0
+
+    def __repr__(self):
+        return "Cursor: " + str(self.query)
+
+    def limit(self, limit):
+        """
+        Return at most limit documents (0 for no limit).
+        """
+        self._check_not_started()
+        self._limit = limit
+        return self
+
+    def skip(self, skip):
+        """
+        Skip the first skip matching documents.
+        """
+        self._check_not_started()
+        self._skip = skip
+        return self
+
+    def sort(self, key_or_list, direction=1):
+        """
+        Sort the documents by a field, or by a list of (field, direction) pairs. Direction is 1 for ascending or -1
+        for descending::
+
+            tickets.find({'status': 'open'}, cursor=True).sort([('due', 1), ('priority', -1)]).limit(50)
+
+        Sorting needs every match before the first can be returned, so the whole sort runs under the read lock. With
+        a limit, only the top skip + limit documents are kept, on a heap. If the first field has an ordered index
+        covering every document and the query can't be narrowed down by an index, the index is walked in order
+        instead, stopping once enough documents match.
+        """
+        self._check_not_started()
+        sort = [(key_or_list, direction)] if not isinstance(key_or_list, list) else key_or_list
+        for field, field_direction in sort:
+            if field_direction not in (1, -1):
+                raise ValueError("sort direction must be 1 or -1, not " + repr(field_direction))
+        self._sort = sort
+        return self
+
+    def batch_size(self, batch_size):
+        """
+        Set the number of documents found each time the lock is taken.
+        """
+        self._check_not_started()
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self._batch_size = batch_size
+        return self
+
+    def explain(self):
+        """
+        Run a copy of the cursor (with the same sort, skip, limit and batch size), reporting how it was run rather
+        than its documents. The cursor itself can still be iterated afterwards.
+
+        Returns:
+            A dictionary like Collection.explain's, where access_path can also be "index walk" for a sort walking an
+            ordered index, documents_examined counts only the documents read before the cursor stopped, and returned
+            counts the documents left after skip and limit. The timings are of planning (plan) and of iterating the
+            copy (execution), which plans again. The sort, skip and limit are included too.
+        """
+        local = self.collection.collection
+        with self.collection.threading_lock.read_lock():
+            plan, report = local._filter(self.query).explain_plan(local.documents, local.indexes)
+
+        clone = Cursor(self.collection, self.query, self.filter_function)
+        clone._limit, clone._skip, clone._batch_size, clone._sort = self._limit, self._skip, self._batch_size, self._sort
+        start = time.perf_counter()
+        returned = sum(1 for _ in clone)
+        timings = report["timings"]
+        timings["execution"] = time.perf_counter() - start
+        timings["total"] = timings["plan"] + timings["execution"]
+        report["access_path"] = clone._access_path
+        report["documents_examined"] = clone._examined
+        report["returned"] = returned
+        report["sort"] = self._sort
+        report["skip"] = self._skip
+        report["limit"] = self._limit
+        return report
+
+    def _check_not_started(self):
+        if self._started:
+            raise RuntimeError("the cursor has already been iterated")
+
+    def __iter__(self):
+        self._check_not_started()
+        self._started = True
+        documents = iter(self._sorted()) if self._sort else self._batches()
+        if self.projection is not None:
+            return map(self.projection.apply, documents)
+        return documents
+
+    def _sorted(self):
+        local = self.collection.collection
+        wanted = self._skip + self._limit if self._limit else None
+
+        with self.collection.threading_lock.read_lock():
+            documents = local.documents
+            query_filter = local._filter(self.query)
+            candidates, residual = query_filter.plan(documents, local.indexes)
+            index = local.indexes.get(self._sort[0][0])
+            # walk the index only when nothing narrows the documents down better
+            if candidates is None and isinstance(index, EssentialOrderedIndex) and index.covers(documents):
+                self._access_path = "index walk"
+                results = self._walk(index, documents, query_filter.tester(None, local.query_mode), wanted)
+            else:
+                self._access_path = "scan" if candidates is None else "index"
+                self._examined = len(documents) if candidates is None else len(candidates)
+                if wanted is None:
+                    matches = query_filter.execute_filter(documents, self.filter_function, local.indexes,
+                                                          local.query_mode, (candidates, residual))
+                    results = sort_documents(matches, self._sort)
+                else:
+                    # stream the matches onto the heap rather than collecting them all first
+                    matches = query_filter.iter_filter(documents, self.filter_function, local.indexes,
+                                                       local.query_mode, (candidates, residual))
+                    key, reverse = sort_key(self._sort)
+                    select = heapq.nlargest if reverse else heapq.nsmallest
+                    results = select(wanted, matches, key=key)
+        return results[self._skip:]
+
+    def _walk(self, index, documents, test, wanted):
+        # the first sort field's index gives the order, documents with the same value are sorted by the rest
+        results = []
+        for postings in index.walk(self._sort[0][1]):
+            group = list(self._matches(postings, documents, test))
+            if len(group) > 1 and len(self._sort) > 1:
+                group = sort_documents(group, self._sort)
+            results.extend(group)
+            if wanted is not None and len(results) >= wanted:
+                return results[:wanted]
+        return results
+
+    def _matches(self, keys, documents, test):
+        filter_function = self.filter_function
+        for key in keys:
+            self._examined += 1
+            document = documents[key]
+            if test is not None and test(document) is not True:
+                continue
+            if filter_function is not None and filter_function(document) is not True:
+                continue
+            yield document
+
+    def _batches(self):
+        lock = self.collection.threading_lock
+        local = self.collection.collection
+        remaining = self._limit or None
+        self._skipping = self._skip
+
+        with lock.read_lock():
+            documents = local.documents
+            query_filter = local._filter(self.query)
+            candidates, residual = query_filter.plan(documents, local.indexes)
+            self._access_path = "scan" if candidates is None else "index"
+            pending = iter(documents if candidates is None else candidates)
+            test = query_filter.tester(residual, local.query_mode)
+            if test is None and self.filter_function is None:
+                # every candidate matches, so skipping is just moving past them
+                pending = itertools.islice(pending, self._skipping, None)
+                self._skipping = 0
+            batch = self._fill(pending, documents, test, remaining)
+            if len(batch) == self._wanted(remaining) and (remaining is None or remaining > len(batch)):
+                # the rest of the keys are fixed now, iterating the documents themselves isn't safe once the lock is
+                # released
+                pending = iter(list(pending))
+            else:
+                pending = iter(())
+
+        # the indexes only vouch for the candidates while the lock is still held from planning, later batches test
+        # the whole query
+        test = query_filter.tester(None, local.query_mode)
+        while batch:
+            for document in batch:
+                yield document
+            if remaining is not None:
+                remaining -= len(batch)
+                if remaining <= 0:
+                    return
+            with lock.read_lock():
+                batch = self._fill(pending, local.documents, test, remaining)
+
+    def _wanted(self, remaining):
+        return self._batch_size if remaining is None else min(self._batch_size, remaining)
+
+    def _fill(self, pending, documents, test, remaining):
+        # the next batch of matching documents, taking keys from pending
+        filter_function = self.filter_function
+        wanted = self._wanted(remaining)
+        batch = []
+        if wanted <= 0:
+            return batch
+        examined = 0
+        for key in pending:
+            if key not in documents:
+                continue
+            examined += 1
+            document = documents[key]
+            if test is not None and test(document) is not True:
+                continue
+            if filter_function is not None and filter_function(document) is not True:
+                continue
+            if self._skipping:
+                self._skipping -= 1
+                continue
+            batch.append(document)
+            if len(batch) == wanted:
+                break
+        self._examined += examined
+        return batch
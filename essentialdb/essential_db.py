@@ -9,13 +9,25 @@
 
 from essentialdb import PickleSerializer
 from essentialdb import Collection
+from .essential_journal import EssentialJournal
+from .essential_storage import FileStorage, DirectoryStorage, BackgroundSave
+from .essential_flusher import SyncFlusher
+from .essential_parallel import ParallelScan
+from .essential_lock import ReadWriteLock
+from .essential_metrics import DatabaseMetrics
 import datetime
+import os
+import traceback
+from contextlib import contextmanager
+from functools import partial
 from threading import Lock
 
 
 class EssentialDB:
 
-    def __init__(self, filepath=None, serializer=None, autosync=False):
+    def __init__(self, filepath=None, serializer=None, autosync=False, journal=False, journal_limit=16 * 1024 * 1024,
+                 layout="file", sync_every=None, sync_interval=None, query_mode="compiled", metrics=False,
+                 slow_query_ms=None, slow_query_callback=None, parallel_workers=None, parallel_threshold=100000):
         """
 
         EssentialDB class is the front end interface to the EssentialDB database::
@@ -50,65 +62,343 @@ class EssentialDB:
 
                 authors.insert_many(data)
 
+        Journaled mode appends each change to an operation log (filepath + '.journal') instead of rewriting the
+        whole database on every sync, so the cost of a sync is proportional to the size of the change. The log is
+        replayed on top of the last snapshot when the database is opened, and folded into a fresh snapshot by
+        checkpoint (or automatically by sync once the log grows past journal_limit bytes)::
+
+            db = EssentialDB(filepath="my.db", journal=True, autosync=True)
+            db.authors.insert_one({'first': 'Langston', 'last': 'Hughes', 'born': 1902})
+            db.checkpoint()
+
+        The "directory" layout stores each collection in its own file inside the filepath directory, alongside a
+        small manifest. Sync then only writes collections that have changed since they were last written::
+
+            db = EssentialDB(filepath="my.db", layout="directory")
+
+        Instead of syncing after every change (autosync), a sync policy hands syncing to a background thread that
+        groups changes into a single sync once sync_every operations are waiting or the oldest waiting change is
+        sync_interval milliseconds old, whichever comes first. Close the database to sync anything still waiting::
+
+            db = EssentialDB(filepath="my.db", sync_every=1000, sync_interval=50)
+            ...
+            db.close()
+
+        Each collection has its own reader/writer lock: any number of threads can read a collection at once, writes
+        are exclusive, and collections never contend with each other. Snapshots hold every collection's read lock, so
+        they see a consistent view without blocking readers.
+
+        For large databases, background_save writes the snapshot from a forked child process, so writers are only
+        held off for as long as the fork takes rather than for the whole write.
+
+        By default queries are compiled into Python functions (once per query shape) before they are run. Set
+        query_mode="interpreted" to run them through the expression interpreter instead - the results are the same.
+
+        With metrics=True, each collection records the latency of its operations and how long its lock is waited for
+        and held, and each sync and checkpoint its duration and the bytes it wrote - see stats. Setting slow_query_ms
+        also records metrics, and logs the shape and plan of every query taking at least that many milliseconds,
+        passing each entry to slow_query_callback if it is given::
+
+            db = EssentialDB(filepath="my.db", slow_query_ms=50, slow_query_callback=print)
+            ...
+            print(db.stats()['collections']['authors']['operations']['find']['p99'])
+
+        Queries that can't be answered from an index test every document on a single core. With parallel_workers set,
+        scans of at least parallel_threshold documents are split across that many forked worker processes instead
+        (see ParallelScan) - worth it for ad-hoc queries on large collections, not for small ones::
+
+            db = EssentialDB(filepath="my.db", parallel_workers=os.cpu_count())
+
         """
 
         self.threading_lock = Lock()
+        self.collections_lock = Lock()
         self.collections = {}
+        self.unloaded = {}
         self.filepath = filepath
         self.autosync = autosync
+        self.journal = None
+        self.journal_limit = journal_limit
+        self.storage = None
+        self.flusher = None
+        self.background = None
+        self.query_mode = query_mode
+        self.parallel = ParallelScan(parallel_workers, parallel_threshold) if parallel_workers else None
+        self.metrics = None
+        if metrics or slow_query_ms is not None:
+            self.metrics = DatabaseMetrics(slow_query_ms, slow_query_callback)
 
         if serializer is None:
             serializer = PickleSerializer()
         self.serializer = serializer
 
+        if self.filepath is not None:
+            if layout == "directory":
+                self.storage = DirectoryStorage(self.filepath, self.serializer)
+            else:
+                self.storage = FileStorage(self.filepath, self.serializer)
+            if journal:
+                self.journal = EssentialJournal(self.storage.journal_path)
+            if sync_every is not None or sync_interval is not None:
+                self.flusher = SyncFlusher(self.sync, sync_every, sync_interval)
+
         if self.filepath is not None:
             with self.threading_lock:
                 self._load()
 
+        if self.flusher is not None:
+            self.flusher.start()
+
     def __getattr__(self, name):
         return self.get_collection(name)
 
     def __repr__(self):
         return "EssentialDB: " + str(self.filepath)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Stop the background flusher (if any), wait for a running background save, sync outstanding changes and close
+        the journal.
+        """
+        self._wait_for_background_save()
+        if self.flusher is not None:
+            self.flusher.stop()
+        if any(collection.dirty for collection in list(self.collections.values())):
+            self.sync()
+        if self.journal is not None:
+            self.journal.close()
+
+    def _new_collection(self, documents, name):
+        if self.metrics is not None:
+            metrics = self.metrics.collection(name)
+            return Collection(documents, metrics.lock, self.sync, self.autosync, name, self.journal, self.flusher,
+                              self.query_mode, metrics, self.parallel)
+        return Collection(documents, ReadWriteLock(), self.sync, self.autosync, name, self.journal, self.flusher,
+                          self.query_mode, parallel=self.parallel)
+
     def get_collection(self, name='default', create=True):
         if name not in self.collections:
-            if create:
-                self.collections[name] = Collection({}, self.threading_lock, self.sync, self.autosync, name)
-            else:
-                return None
+            with self.collections_lock:
+                if name in self.collections:
+                    pass
+                elif name in self.unloaded:
+                    # first use of a collection on disk - load its documents now
+                    self.collections[name] = self._new_collection(self.storage.load_collection(name), name)
+                    del self.unloaded[name]
+                elif create:
+                    self.collections[name] = self._new_collection({}, name)
+                else:
+                    return None
         return self.collections[name]
 
     def get_collection_names(self):
-        return list(self.collections.keys())
+        with self.collections_lock:
+            return list(self.collections.keys()) + list(self.unloaded.keys())
 
     def _load(self):
         # TODO: Test if file exists
+        # only the catalog is read here, collections are loaded on first use by get_collection
+        journal_lsn = 0
         try:
-            file_db = self.serializer.load(self.filepath)
-            if 'collections' in file_db:
-                self.collections = {}
-                for collection in file_db['collections']:
-                    self.collections[collection] = Collection(file_db['collections'][collection],
-                                                              self.threading_lock, self.sync,
-                                                              self.autosync)
-
-            elif 'documents' in file_db:
-                # Handle db files created pre v0.5"
-                self.collections['default'] = file_db['documents']
-            else:
-                self.collections = {}
+            meta, names = self.storage.catalog()
+            self.collections = {}
+            self.unloaded = dict.fromkeys(names)
+            journal_lsn = meta.get('journal_lsn', 0)
         except Exception as e:
             print(e)
             self.collections = {}
+            self.unloaded = {}
+
+        if self.journal is not None:
+            self.journal.lsn = journal_lsn
+            self._replay_journal(journal_lsn)
+
+    def _replay_journal(self, after_lsn):
+        for lsn, record in self.journal.replay(after_lsn):
+            operation, name = record[0], record[1]
+            collection = self.get_collection(name)
+            collection._apply(operation, *record[2:])
 
     def sync(self):
-        output = {
-            "meta": {
-                "timestamp": datetime.datetime.now()
-            },
-            "collections": {}
+        """
+        Commit the database to disk. In journaled mode this only flushes the operation log, unless the log has
+        grown past journal_limit, in which case it is folded into a fresh snapshot. In-memory databases (no
+        filepath) have nothing to sync.
+        """
+        if self.storage is None:
+            return
+        if self.metrics is not None:
+            with self.metrics.timed(self.metrics.sync, self._bytes_written):
+                self._sync()
+        else:
+            self._sync()
+
+    def _sync(self):
+        if self.journal is None:
+            with self.threading_lock:
+                self._write_snapshot()
+        elif self.journal_limit is not None and self.journal.size() > self.journal_limit:
+            with self.threading_lock:
+                self._write_snapshot(truncate_journal=True)
+        else:
+            self.journal.flush()
+
+    def checkpoint(self):
+        """
+        Write a full snapshot of the database and truncate the operation log. Writers are held off while the
+        snapshot is written, so no record can slip in between the snapshot and the truncation.
+        """
+        if self.storage is None:
+            return
+        if self.metrics is not None:
+            with self.metrics.timed(self.metrics.checkpoint, self._bytes_written), self.threading_lock:
+                self._write_snapshot(truncate_journal=True)
+        else:
+            with self.threading_lock:
+                self._write_snapshot(truncate_journal=True)
+
+    def _bytes_written(self):
+        # by snapshots and the journal, since the database was opened
+        return self.storage.bytes_written + (self.journal.bytes_written if self.journal is not None else 0)
+
+    def stats(self):
+        """
+        Get the database's statistics: the number of documents in each loaded collection and, if metrics are
+        recorded, each collection's operation latencies and lock timings, the durations of syncs and checkpoints, the
+        bytes they wrote and the slow query log. Durations are in seconds, each summarized by its count, total, mean,
+        max and (approximate) p50, p90 and p99.
+
+        Returns:
+            A dictionary like::
+
+                {
+                    "collections": {
+                        "authors": {
+                            "documents": 1000,
+                            "operations": {"find": {"count": 12, "p99": 0.004, ...}, ...},
+                            "lock": {"read_wait": {...}, "read_hold": {...}, "write_wait": {...}, ...}
+                        }
+                    },
+                    "sync": {...},
+                    "checkpoint": {...},
+                    "bytes_written": 1048576,
+                    "slow_queries": [{"collection": "authors", "operation": "find", "shape": {"last": "?"},
+                                      "plan": {...}, "duration": 0.06, "time": 1508400000.0}]
+                }
+
+        """
+        with self.collections_lock:
+            collections = dict(self.collections)
+        stats = self.metrics.stats() if self.metrics is not None else {"collections": {}}
+        for name, collection in collections.items():
+            stats["collections"].setdefault(name, {})["documents"] = len(collection._get_raw_documents())
+        return stats
+
+    def background_save(self):
+        """
+        Write a snapshot of the database from a forked child process, like Redis' BGSAVE. The child sees a
+        copy-on-write, point-in-time view of every collection, so the parent can keep serving reads and writes while
+        it is written. In journaled mode, the records folded into the snapshot are moved aside and discarded once the
+        child succeeds. On platforms without os.fork, the snapshot is written synchronously.
+
+        Returns:
+            A BackgroundSave tracking the child (status, wait()), or None for in-memory databases.
+
+        Example::
+
+            save = db.background_save()
+            ...
+            if not save.wait():
+                print("background save failed", save.exit_code)
+
+        """
+        if self.storage is None:
+            return None
+
+        with self.threading_lock:
+            if not hasattr(os, 'fork'):
+                self._write_snapshot(truncate_journal=True)
+                self.background = BackgroundSave(None)
+                self.background._complete(0)
+                return self.background
+
+            self._wait_for_background_save()
+            with self._read_view() as collections:
+                meta = self._snapshot_meta()
+                if self.journal is not None:
+                    self.journal.flush()
+                    self.journal.rotate()
+
+                pid = os.fork()
+                if pid == 0:
+                    try:
+                        self.storage.dump(meta, collections)
+                    except BaseException:
+                        traceback.print_exc()
+                        os._exit(1)
+                    os._exit(0)
+
+                # the child writes dirty collections, put the flags back if it fails
+                cleared = [collection for collection in collections.values() if collection.dirty]
+                for collection in cleared:
+                    collection.dirty = False
+            self.background = BackgroundSave(pid, partial(self._background_save_complete, cleared))
+            return self.background
+
+    def _background_save_complete(self, cleared, save):
+        if save.status == "done":
+            if self.journal is not None:
+                self.journal.discard_rotated()
+        else:
+            for collection in cleared:
+                collection.dirty = True
+
+    def _wait_for_background_save(self):
+        # a snapshot written while a background save is running could be overwritten by the child's older one
+        if self.background is not None:
+            self.background.wait()
+
+    def _snapshot_meta(self):
+        meta = {
+            "timestamp": datetime.datetime.now().isoformat()
         }
-        for collection in self.collections:
-            output['collections'][collection] = self.collections[collection]._get_raw_documents()
-        self.serializer.dump(output, self.filepath)
+        if self.journal is not None:
+            meta['journal_lsn'] = self.journal.lsn
+        return meta
+
+    def _write_snapshot(self, truncate_journal=False):
+        # called while holding the database lock, so only one snapshot is written at a time
+        self._wait_for_background_save()
+        with self._read_view() as collections:
+            for collection in self.storage.dump(self._snapshot_meta(), collections):
+                collection.dirty = False
+            if truncate_journal and self.journal is not None:
+                self.journal.truncate()
+
+    @contextmanager
+    def _read_view(self):
+        """
+        Context manager yielding a consistent view of the collections (a dict of name -> Collection) to snapshot.
+        Every collection's read lock is held, so readers carry on but no collection can change (or dirty flags be
+        set, or journal records be appended) until the view is released. New collections can't be created either.
+        """
+        # collections that were never loaded are unchanged, storage that can't skip them needs them loaded first
+        if not self.storage.partial_dump:
+            for name in list(self.unloaded.keys()):
+                self.get_collection(name)
+        with self.collections_lock:
+            collections = dict(self.collections)
+            locks = [collection.threading_lock for collection in collections.values()]
+            for lock in locks:
+                lock.acquire_read()
+            try:
+                yield collections
+            finally:
+                for lock in locks:
+                    lock.release_read()
@@ -0,0 +1,81 @@
+import threading
+import time
+
+
+class SyncFlusher(threading.Thread):
+    """
+    Background thread that coalesces changes into group commits. Collections notify the flusher after each change
+    instead of syncing inline, and the flusher calls sync once either policy is met:
+
+        * every - at least this many operations are waiting to be synced
+        * interval - the oldest waiting operation is at least this many milliseconds old
+
+    Changes that arrive while a sync is running are picked up by the next one, so concurrent writers share a single
+    sync rather than each paying for their own.
+    """
+
+    def __init__(self, sync_callback, every=None, interval=None):
+        threading.Thread.__init__(self, name="essentialdb-flusher", daemon=True)
+        self.sync_callback = sync_callback
+        self.every = every
+        self.interval = interval / 1000.0 if interval is not None else None
+        self.condition = threading.Condition()
+        self.pending = 0
+        self.first_pending = None
+        self.stopped = False
+        self.syncs = 0
+        self.last_error = None
+
+    def notify(self, operations=1):
+        """
+        Record operations waiting to be synced, waking the flusher if the policy may now be met.
+        """
+        with self.condition:
+            if self.pending == 0:
+                self.first_pending = time.monotonic()
+            self.pending += operations
+            if self.every is not None and self.pending >= self.every:
+                self.condition.notify()
+            elif self.pending == operations:
+                # first pending operation - the flusher needs to start its interval timer
+                self.condition.notify()
+
+    def stop(self):
+        """
+        Stop the flusher, syncing any outstanding operations first.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.is_alive():
+            self.join()
+
+    def _should_flush(self):
+        if self.pending == 0:
+            return False
+        if self.stopped:
+            return True
+        if self.every is not None and self.pending >= self.every:
+            return True
+        return self.interval is not None and time.monotonic() - self.first_pending >= self.interval
+
+    def _timeout(self):
+        if self.pending and self.interval is not None:
+            return max(0.0, self.interval - (time.monotonic() - self.first_pending))
+        return None
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self._should_flush():
+                    if self.stopped:
+                        return
+                    self.condition.wait(self._timeout())
+                self.pending = 0
+                self.first_pending = None
+
+            try:
+                self.sync_callback()
+                self.syncs += 1
+            except Exception as e:
+                self.last_error = e
@@ -1,42 +1,335 @@
+import datetime
+from bisect import bisect_left, bisect_right, insort
+
+range_operators = ("$gt", "$gte", "$lt", "$lte")
+
+
+def field_value(document, field):
+    """
+    Look field up in document the way queries do: first as a plain key, then, for dotted fields, as a path into
+    nested documents.
+
+    Returns:
+        A tuple of (found, value).
+    """
+    try:
+        return True, document[field]
+    except (KeyError, TypeError, IndexError):
+        pass
+    if isinstance(field, str) and "." in field:
+        current = document
+        try:
+            for item in field.split('.'):
+                current = current[item]
+            return True, current
+        except Exception:
+            pass
+    return False, None
+
 
 class EssentialIndex:
-    """HashIndex provides fast lookup indexing for dictionary"""
+    """
+    HashIndex provides fast lookup indexing for dictionary. Maps each value of the indexed field to its postings, an
+    insertion ordered set (a dict with None values) of the _ids of the documents holding that value.
+
+    Fields are looked up the same way queries look them up: first as a plain key, then, for dotted fields, as a path
+    into nested documents. Documents whose value is unhashable can't be indexed; their _ids are kept in 'unhashable'
+    so the query planner knows when the index is incomplete.
+    """
 
     def __init__(self, field_key, index_type='hash', index_name=None):
         self.field_key = field_key
         self.index_name = index_name if index_name != None else index_type + field_key
         self.index = {}
+        # _id -> indexed value, so postings can be moved when a document changes
+        self.keys = {}
+        self.unhashable = set()
 
     def find(self, data, value):
         results = {}
-        if value in self.index:
-            for _id in self.index[value]:
-                results[_id] = data[_id]
+        for _id in self.lookup(value) or {}:
+            results[_id] = data[_id]
         return results
 
+    def lookup(self, value):
+        """
+        Get the postings for value, or None if value can't be looked up in the index.
+        """
+        if not self.indexable(value):
+            return None
+        return self.index.get(value, {})
+
+    @staticmethod
+    def indexable(value):
+        """
+        Check whether equality with value can be answered by the index. NaN is excluded, since it isn't equal to
+        itself.
+        """
+        try:
+            hash(value)
+        except TypeError:
+            return False
+        return value == value
+
+    def _value(self, document):
+        # mirrors EqualityOperator.test_document - returns (found, value)
+        return field_value(document, self.field_key)
+
+    def create_index(self, data):
+        self.clear()
+        for key in data:
+            self.update_index(data[key], key)
+        return self.index
+
+    def update_index(self, document, _id=None):
+        """
+        Add a new document to the index, or move an existing one if its value has changed.
+        """
+        if _id is None:
+            _id = document['_id']
+        found, value = self._value(document)
+
+        if _id in self.keys:
+            if found and self.keys[_id] is value:
+                return
+            self._remove_id(_id)
+        self.unhashable.discard(_id)
+
+        if found:
+            try:
+                postings = self.index.get(value)
+            except TypeError:
+                self.unhashable.add(_id)
+                return
+            if postings is None:
+                postings = self.index[value] = {}
+                self._add_key(value)
+            postings[_id] = None
+            self.keys[_id] = value
+
+    def update_index_many(self, documents):
+        """
+        Add a batch of documents to the index in one pass.
+        """
+        for document in documents:
+            self.update_index(document)
+
+    def remove_from_index(self, document, _id=None):
+        if _id is None:
+            if '_id' not in document:
+                return False
+            _id = document['_id']
+        self.unhashable.discard(_id)
+        return self._remove_id(_id)
+
+    def _remove_id(self, _id):
+        if _id not in self.keys:
+            return False
+        value = self.keys.pop(_id)
+        postings = self.index[value]
+        del postings[_id]
+        if not postings:
+            del self.index[value]
+            self._remove_key(value)
+        return True
+
+    def _add_key(self, value):
+        # called when value is first added to the index, for subclasses that keep other structures over the values
+        pass
+
+    def _remove_key(self, value):
+        # called when the last document holding value is removed from the index
+        pass
+
+    def clear(self):
+        self.index = {}
+        self.keys = {}
+        self.unhashable = set()
+
+
+class EssentialOrderedIndex(EssentialIndex):
+    """
+    OrderedIndex adds range lookups to the hash index. The distinct values of the field are also kept in sorted lists,
+    so $gt, $gte, $lt and $lte are answered by bisecting to the bounds and collecting the postings in between.
+
+    Values that don't compare with each other can't share a list: numbers, strings, bytes, datetimes, dates and
+    timedeltas are each sorted separately. Values of any other type are kept in 'unordered', and always returned as
+    candidates for a range so they can be tested directly.
+
+    A range test that fails to compare a dotted field's value goes on to try the nested path, so documents holding both
+    a "a.b" key and a nested a.b value are kept in 'shadowed' and returned as candidates too.
+    """
+
+    # the order sorted values of different families are walked in, see essential_cursor.sort_value
+    family_order = ("number", "str", "bytes", "datetime", "date", "timedelta")
+
+    families = {
+        bool: "number",
+        int: "number",
+        float: "number",
+        str: "str",
+        bytes: "bytes",
+        datetime.datetime: "datetime",
+        datetime.date: "date",
+        datetime.timedelta: "timedelta"
+    }
+
+    def __init__(self, field_key, index_type='ordered', index_name=None, direction=1):
+        self.direction = direction
+        self.sorted = {}
+        self.unordered = {}
+        self.key_families = {}
+        self.shadowed = {}
+        self._bulk = False
+        EssentialIndex.__init__(self, field_key, index_type, index_name)
+        self._path = field_key.split('.') if isinstance(field_key, str) and "." in field_key else None
+
+    @classmethod
+    def family(cls, value):
+        """
+        Get the name of the sorted list values like value are kept in, or None if it isn't ordered.
+        """
+        family = cls.families.get(type(value))
+        if family == "number" and value != value:
+            # NaN doesn't order
+            return None
+        return family
+
+    def _add_key(self, value):
+        family = self.family(value)
+        self.key_families[value] = family
+        if family is None:
+            self.unordered[value] = None
+        elif self._bulk:
+            self.sorted.setdefault(family, []).append(value)
+        else:
+            insort(self.sorted.setdefault(family, []), value)
+
     def create_index(self, data):
-        index = {}
-        #start with a simple numeric indexing
-        for item in data:
-            if self.field_key in data[item] and data[item][self.field_key] not in index:
-                index[data[item][self.field_key]] = []
-
-            index[data[item][self.field_key]].append(item)
-        self.index = index
+        self.clear()
+        self._bulk_update((key, data[key]) for key in data)
         return self.index
 
-    def update_index(self, document):
-        if self.field_key in document:
-            if document[self.field_key] not in self.index:
-                self.index[document[self.field_key]] = []
-                self.index[document[self.field_key]].append(document['_id'])
-            elif document['_id'] not in document[self.field_key]:
-                self.index[document[self.field_key]].append(document['_id'])
-
-
-    def remove_from_index(self, document):
-        if self.field_key in document:
-            if document[self.field_key] in self.index:
-                self.index[document[self.field_key]].remove(document['_id'])
-                return True
-        return False
+    def update_index(self, document, _id=None):
+        EssentialIndex.update_index(self, document, _id)
+        if self._path is not None:
+            if _id is None:
+                _id = document['_id']
+            if self._is_shadowed(document):
+                self.shadowed[_id] = None
+            else:
+                self.shadowed.pop(_id, None)
+
+    def remove_from_index(self, document, _id=None):
+        if _id is None and '_id' in document:
+            _id = document['_id']
+        self.shadowed.pop(_id, None)
+        return EssentialIndex.remove_from_index(self, document, _id)
+
+    def _is_shadowed(self, document):
+        try:
+            document[self.field_key]
+            current = document
+            for item in self._path:
+                current = current[item]
+            return True
+        except Exception:
+            return False
+
+    def update_index_many(self, documents):
+        """
+        Add a batch of documents to the index, sorting the new values in once rather than inserting them one by one.
+        """
+        self._bulk_update((document['_id'], document) for document in documents)
+
+    def _bulk_update(self, items):
+        # items are (_id, document) pairs
+        self._bulk = True
+        try:
+            for _id, document in items:
+                self.update_index(document, _id)
+        finally:
+            self._bulk = False
+            for keys in self.sorted.values():
+                keys.sort()
+
+    def _remove_key(self, value):
+        family = self.key_families.pop(value)
+        if family is None:
+            del self.unordered[value]
+        else:
+            keys = self.sorted[family]
+            if self._bulk:
+                # the keys added so far in the batch aren't sorted in yet
+                keys.remove(value)
+            else:
+                del keys[bisect_left(keys, value)]
+
+    def find_range(self, bounds):
+        """
+        Find the documents whose value is within bounds.
+
+        Args:
+            bounds (list): (operator, value) tuples, where operator is one of $gt, $gte, $lt or $lte. The value must
+                satisfy all of them.
+
+        Returns:
+            A tuple of (candidates, exact), where candidates is an ordered set (dict) of _ids and exact is False if
+            the candidates include documents whose value has to be tested directly. None if the bounds can't be
+            answered by the index.
+        """
+        family = None
+        for operator, value in bounds:
+            value_family = self.family(value)
+            if value_family is None or operator not in range_operators:
+                return None
+            if family is None:
+                family = value_family
+            elif family != value_family:
+                # no ordered value can be on both sides of bounds that don't compare
+                family = False
+
+        candidates = {}
+        if family:
+            keys = self.sorted.get(family, [])
+            low, high = 0, len(keys)
+            for operator, value in bounds:
+                if operator == "$gt":
+                    low = max(low, bisect_right(keys, value))
+                elif operator == "$gte":
+                    low = max(low, bisect_left(keys, value))
+                elif operator == "$lt":
+                    high = min(high, bisect_left(keys, value))
+                else:
+                    high = min(high, bisect_right(keys, value))
+            for key in keys[low:high]:
+                candidates.update(self.index[key])
+
+        for key in self.unordered:
+            candidates.update(self.index[key])
+        candidates.update(dict.fromkeys(self.unhashable))
+        candidates.update(self.shadowed)
+        return candidates, not self.unordered and not self.unhashable and not self.shadowed
+
+    def covers(self, documents):
+        """
+        Check whether every document in documents is in the sorted lists, so walking them visits every document.
+        """
+        return not self.unordered and not self.unhashable and not self.shadowed and len(self.keys) == len(documents)
+
+    def walk(self, direction=1):
+        """
+        Yield the postings of each sorted value in order (descending if direction is -1), families in family_order.
+        """
+        families = self.family_order if direction == 1 else reversed(self.family_order)
+        for family in families:
+            keys = self.sorted.get(family, ())
+            for key in (keys if direction == 1 else reversed(keys)):
+                yield self.index[key]
+
+    def clear(self):
+        EssentialIndex.clear(self)
+        self.sorted = {}
+        self.unordered = {}
+        self.key_families = {}
+        self.shadowed = {}
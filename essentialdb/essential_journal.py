@@ -0,0 +1,156 @@
+import os
+import pickle
+import shutil
+import struct
+import threading
+import zlib
+
+
+class EssentialJournal:
+    """
+    Append-only operation log used by EssentialDB's journaled persistence mode. Every change to a collection is
+    appended as a small framed record instead of rewriting the whole database file::
+
+        [length: 4 bytes][crc32: 4 bytes][pickled (lsn, record)]
+
+    Each record is tagged with a log sequence number (lsn). Snapshots remember the last lsn they contain, so replay
+    can skip records that are already folded into the snapshot. A torn record at the end of the file (for example,
+    after a crash in the middle of a write) fails its checksum and is discarded on the next open.
+    """
+
+    _header = struct.Struct(">II")
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.rotated_path = file_path + ".1"
+        self.lsn = 0
+        self.lock = threading.Lock()
+        self._fp = None
+        # written out of the file's buffer since the journal was opened, and still buffered
+        self.bytes_written = 0
+        self._buffered = 0
+
+    def _file(self):
+        if self._fp is None:
+            self._fp = open(self.file_path, 'ab')
+        return self._fp
+
+    def append(self, record):
+        """
+        Append a record to the journal and return the lsn it was assigned. The write is buffered; call flush to
+        force it to disk.
+        """
+        with self.lock:
+            self.lsn += 1
+            payload = pickle.dumps((self.lsn, record), protocol=pickle.HIGHEST_PROTOCOL)
+            record = self._header.pack(len(payload), zlib.crc32(payload)) + payload
+            self._file().write(record)
+            self._buffered += len(record)
+            return self.lsn
+
+    def flush(self):
+        """
+        Flush buffered records and fsync the journal file.
+        """
+        with self.lock:
+            if self._fp is not None:
+                self._fp.flush()
+                os.fsync(self._fp.fileno())
+                self.bytes_written += self._buffered
+                self._buffered = 0
+
+    def replay(self, after_lsn=0):
+        """
+        Generator yielding (lsn, record) for every intact record with an lsn greater than after_lsn, starting with
+        the rotated journal (if there is one). Once the generator is exhausted, any torn tail has been truncated away
+        and appends continue after the last good record.
+        """
+        for path in [self.rotated_path, self.file_path]:
+            if os.path.exists(path):
+                for lsn, record in self._replay_file(path, after_lsn):
+                    yield lsn, record
+
+    def _replay_file(self, path, after_lsn):
+        good_offset = 0
+        with open(path, 'rb') as fp:
+            while True:
+                header = fp.read(self._header.size)
+                if len(header) < self._header.size:
+                    break
+                length, crc = self._header.unpack(header)
+                payload = fp.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                lsn, record = pickle.loads(payload)
+                good_offset = fp.tell()
+                self.lsn = max(self.lsn, lsn)
+                if lsn > after_lsn:
+                    yield lsn, record
+
+        if good_offset < os.path.getsize(path):
+            with self.lock:
+                self._close()
+                os.truncate(path, good_offset)
+
+    def rotate(self):
+        """
+        Move every record written so far into the rotated journal (file_path + '.1'), so they can be discarded once
+        a background snapshot containing them is complete. If a rotated journal is already waiting (because an
+        earlier snapshot failed), the records are appended to it.
+        """
+        with self.lock:
+            self._close()
+            if not os.path.exists(self.file_path):
+                return
+            if os.path.exists(self.rotated_path):
+                with open(self.rotated_path, 'ab') as rotated, open(self.file_path, 'rb') as current:
+                    shutil.copyfileobj(current, rotated)
+                    rotated.flush()
+                    os.fsync(rotated.fileno())
+                os.remove(self.file_path)
+            else:
+                os.replace(self.file_path, self.rotated_path)
+
+    def discard_rotated(self):
+        """
+        Delete the rotated journal, once its records are folded into a snapshot.
+        """
+        with self.lock:
+            if os.path.exists(self.rotated_path):
+                os.remove(self.rotated_path)
+
+    def truncate(self):
+        """
+        Discard every record in the journal (including the rotated journal), typically after they have been folded
+        into a snapshot.
+        """
+        with self.lock:
+            self._close()
+            open(self.file_path, 'wb').close()
+            if os.path.exists(self.rotated_path):
+                os.remove(self.rotated_path)
+
+    def size(self):
+        """
+        Get the size of the journal in bytes, including buffered records.
+        """
+        with self.lock:
+            if self._fp is not None:
+                return self._fp.tell()
+        if os.path.exists(self.file_path):
+            return os.path.getsize(self.file_path)
+        return 0
+
+    def close(self):
+        """
+        Flush and close the journal file. It will be reopened by the next append.
+        """
+        with self.lock:
+            self._close()
+
+    def _close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+            self.bytes_written += self._buffered
+            self._buffered = 0
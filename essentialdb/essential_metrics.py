@@ -0,0 +1,268 @@
+import collections
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from .essential_lock import ReadWriteLock
+from .query_filter import QueryFilter
+from .essential_cursor import Cursor
+
+
+class Histogram:
+    """
+    A latency histogram, in seconds. Durations are counted in buckets doubling from one microsecond up (to around
+    two minutes, anything longer is counted in a last bucket), so percentiles are accurate to within a factor of two
+    while recording stays cheap and the memory used is fixed.
+    """
+
+    bounds = [0.000001 * 2 ** i for i in range(28)]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, duration):
+        bucket = bisect_left(self.bounds, duration)
+        with self.lock:
+            self.buckets[bucket] += 1
+            self.count += 1
+            self.total += duration
+            if duration > self.max:
+                self.max = duration
+
+    def percentile(self, percent):
+        """
+        Get the upper bound of the bucket holding the percent'th percentile (no more than the longest duration
+        recorded), or 0.0 if nothing has been recorded.
+        """
+        with self.lock:
+            rank = self.count * percent / 100.0
+            seen = 0
+            for bucket, count in enumerate(self.buckets):
+                seen += count
+                if count and seen >= rank:
+                    return min(self.bounds[bucket], self.max) if bucket < len(self.bounds) else self.max
+            return 0.0
+
+    def stats(self):
+        """
+        Get a dictionary of the count, total, mean, max, p50, p90 and p99 durations.
+        """
+        count = self.count
+        return {
+            "count": count,
+            "total": self.total,
+            "mean": self.total / count if count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99)
+        }
+
+
+class TimedReadWriteLock(ReadWriteLock):
+    """
+    A ReadWriteLock recording how long each read_lock and write_lock waited to be acquired and was held, in the
+    read_wait, read_hold, write_wait and write_hold histograms.
+    """
+
+    def __init__(self):
+        ReadWriteLock.__init__(self)
+        self.read_wait = Histogram()
+        self.read_hold = Histogram()
+        self.write_wait = Histogram()
+        self.write_hold = Histogram()
+
+    @contextmanager
+    def read_lock(self):
+        start = time.perf_counter()
+        self.acquire_read()
+        acquired = time.perf_counter()
+        self.read_wait.record(acquired - start)
+        try:
+            yield
+        finally:
+            self.release_read()
+            self.read_hold.record(time.perf_counter() - acquired)
+
+    @contextmanager
+    def write_lock(self):
+        start = time.perf_counter()
+        self.acquire_write()
+        acquired = time.perf_counter()
+        self.write_wait.record(acquired - start)
+        try:
+            yield
+        finally:
+            self.release_write()
+            self.write_hold.record(time.perf_counter() - acquired)
+
+    def stats(self):
+        return {
+            "read_wait": self.read_wait.stats(),
+            "read_hold": self.read_hold.stats(),
+            "write_wait": self.write_wait.stats(),
+            "write_hold": self.write_hold.stats()
+        }
+
+
+def query_shape(query):
+    """
+    Get the shape of a query: the query document with every value replaced by "?", so queries that differ only in
+    their values have the same shape.
+    """
+    if isinstance(query, QueryFilter):
+        query = query.to_query()
+    elif isinstance(query, str):
+        return {"_id": "?"}
+    if not isinstance(query, dict):
+        return "?"
+    shape = {}
+    for key, value in query.items():
+        if key in ("$and", "$or", "$nor", "$not") and isinstance(value, list):
+            shape[key] = [query_shape(item) for item in value]
+        elif isinstance(value, dict) and value and all(isinstance(item, str) and item.startswith("$")
+                                                       for item in value):
+            shape[key] = {operator: "?" for operator in value}
+        else:
+            shape[key] = "?"
+    return shape
+
+
+class SlowQueryLog:
+    """
+    Keeps the last size queries that took at least threshold_ms milliseconds, and passes each to callback (if
+    given) as it is logged. Each entry is a dictionary of the collection, operation, query shape (see query_shape),
+    plan (see QueryFilter.explain_plan), duration in seconds and time it finished (as time.time()).
+    """
+
+    def __init__(self, threshold_ms, callback=None, size=100):
+        self.threshold = threshold_ms / 1000.0
+        self.callback = callback
+        self.entries = collections.deque(maxlen=size)
+
+    def log(self, entry):
+        self.entries.append(entry)
+        if self.callback is not None:
+            try:
+                self.callback(entry)
+            except Exception:
+                # a failing callback mustn't fail the query
+                traceback.print_exc()
+
+
+class CollectionMetrics:
+    """
+    Latency histograms (and so counts) for each operation on a collection, and the timings of its lock. Queries
+    slower than the slow query log's threshold are logged there.
+    """
+
+    operations = ("insert_one", "insert_many", "find", "find_one", "count", "distinct", "update", "remove", "get",
+                  "set")
+
+    # the position of the query among each querying operation's arguments
+    query_arguments = {"find": 0, "find_one": 0, "count": 0, "distinct": 1, "update": 0, "remove": 0}
+
+    def __init__(self, name, slow_queries=None):
+        self.name = name
+        self.slow_queries = slow_queries
+        self.latency = {operation: Histogram() for operation in self.operations}
+        self.lock = TimedReadWriteLock()
+
+    def instrument(self, collection):
+        """
+        Replace each operation of collection with one recording its latency.
+        """
+        for operation in self.operations:
+            setattr(collection, operation, self._timed(collection, operation, getattr(collection, operation)))
+
+    def _timed(self, collection, operation, function):
+        histogram = self.latency[operation]
+        position = self.query_arguments.get(operation)
+        slow_queries = self.slow_queries if position is not None else None
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            duration = time.perf_counter() - start
+            if isinstance(result, Cursor):
+                # the cursor does its work as it is iterated
+                return result
+            histogram.record(duration)
+            if slow_queries is not None and duration >= slow_queries.threshold:
+                query = args[position] if len(args) > position else kwargs.get("query")
+                self._log_slow(collection, operation, query, duration)
+            return result
+        return timed
+
+    def _log_slow(self, collection, operation, query, duration):
+        local = collection.collection
+        with collection.threading_lock.read_lock():
+            plan_query = {"_id": query} if isinstance(query, str) else query
+            plan, report = local._filter(plan_query).explain_plan(local.documents, local.indexes)
+        del report["timings"]
+        self.slow_queries.log({
+            "collection": self.name,
+            "operation": operation,
+            "shape": query_shape(query),
+            "plan": report,
+            "duration": duration,
+            "time": time.time()
+        })
+
+    def stats(self):
+        return {
+            "operations": {operation: self.latency[operation].stats() for operation in self.operations
+                           if self.latency[operation].count},
+            "lock": self.lock.stats()
+        }
+
+
+class DatabaseMetrics:
+    """
+    The metrics of a database: its collections' metrics, the duration of each sync and checkpoint, the bytes they
+    wrote and the slow query log (if slow_query_ms is given).
+    """
+
+    def __init__(self, slow_query_ms=None, slow_query_callback=None):
+        self.slow_queries = SlowQueryLog(slow_query_ms, slow_query_callback) if slow_query_ms is not None else None
+        self.collections = {}
+        self.sync = Histogram()
+        self.checkpoint = Histogram()
+        self.bytes_written = 0
+
+    def collection(self, name):
+        """
+        Get new metrics for the collection name.
+        """
+        metrics = self.collections[name] = CollectionMetrics(name, self.slow_queries)
+        return metrics
+
+    @contextmanager
+    def timed(self, histogram, bytes_written):
+        """
+        Time a sync (or checkpoint) into histogram, adding the difference in bytes_written (a function returning the
+        bytes the database has written so far) to the total.
+        """
+        start = time.perf_counter()
+        written = bytes_written()
+        try:
+            yield
+        finally:
+            histogram.record(time.perf_counter() - start)
+            self.bytes_written += bytes_written() - written
+
+    def stats(self):
+        return {
+            "collections": {name: metrics.stats() for name, metrics in list(self.collections.items())},
+            "sync": self.sync.stats(),
+            "checkpoint": self.checkpoint.stats(),
+            "bytes_written": self.bytes_written,
+            "slow_queries": list(self.slow_queries.entries) if self.slow_queries is not None else []
+        }
@@ -38,3 +38,16 @@ class EssentialOID:
 
         return binascii.hexlify(oid).decode()
 
+    @staticmethod
+    def generate_ids(count):
+        """
+        Generate count ids at once, sharing the timestamp and taking the incrementer lock only once.
+        """
+        prefix = struct.pack(">i", int(time.time())) + EssentialOID._machine_part + EssentialOID._process_part
+        prefix = binascii.hexlify(prefix).decode()
+        with EssentialOID._incrementer_lock:
+            start = EssentialOID._incrementer
+            EssentialOID._incrementer = (start + count) % 0xFFFFFF
+
+        # the low three bytes of the incrementer, as generate_next_id packs them
+        return [prefix + format((start + i) % 0xFFFFFF, '06x') for i in range(count)]
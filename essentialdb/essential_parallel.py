@@ -0,0 +1,68 @@
+import itertools
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# the scans being run, by id - each is registered before its workers are forked, so they inherit the documents and
+# the test rather than having them pickled
+_scans = {}
+_scan_ids = itertools.count()
+_lock = threading.Lock()
+
+
+def _scan_partition(scan_id, start, stop):
+    # runs in a forked worker: the positions of the documents from start to stop that pass the test
+    documents, test = _scans[scan_id]
+    return [position for position in range(start, stop) if test(documents[position]) is True]
+
+
+class ParallelScan:
+    """
+    Runs scans of at least threshold documents across workers forked processes (see EssentialDB's parallel_workers).
+    The documents are split into partitions, each worker tests the documents of a partition and sends back the
+    positions of the matches, and the matches are put back together in order - so the results are the same as a
+    serial scan's. The workers are forked for each scan, so they see the documents as they are, copy-on-write, and
+    nothing but positions is pickled.
+
+    Forking a large process isn't free, so smaller scans stay serial, as do scans on platforms without fork and on
+    Python before 3.7 (the pools there can't be told to fork).
+    """
+
+    def __init__(self, workers=None, threshold=100000):
+        self.workers = workers or os.cpu_count() or 1
+        self.threshold = threshold
+        self.available = sys.version_info >= (3, 7) and "fork" in multiprocessing.get_all_start_methods()
+
+    def applies(self, count):
+        """
+        Check whether a scan of count documents runs in parallel.
+        """
+        return self.available and self.workers > 1 and count >= self.threshold
+
+    def positions(self, documents, test):
+        """
+        Get the positions of the documents (a list) that test returns True for, in order.
+        """
+        # a few partitions per worker, so a slow partition doesn't hold the others up
+        size = max(1, -(-len(documents) // (self.workers * 4)))
+        scan_id = next(_scan_ids)
+        # one parallel scan at a time - each uses every worker, and the registry must not change while forking
+        with _lock:
+            _scans[scan_id] = (documents, test)
+            try:
+                with ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("fork")) as pool:
+                    futures = [pool.submit(_scan_partition, scan_id, start, min(start + size, len(documents)))
+                               for start in range(0, len(documents), size)]
+                    partitions = [future.result() for future in futures]
+            finally:
+                del _scans[scan_id]
+        return list(itertools.chain.from_iterable(partitions))
+
+    def filter(self, documents, test):
+        """
+        Get the documents (an iterable) that test returns True for, in order.
+        """
+        documents = list(documents)
+        return [documents[position] for position in self.positions(documents, test)]
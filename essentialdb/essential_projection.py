@@ -0,0 +1,117 @@
+
+class Projection:
+    """
+    Projection picks the fields of each result to return, like MongoDB projections. Either list the fields to include
+    (the _id is included unless it is excluded)::
+
+        {'title': 1, 'author.last': 1}
+
+    or the fields to exclude::
+
+        {'details': 0}
+
+    but not both, apart from excluding the _id from an inclusion. Dotted fields reach into nested documents, a literal
+    dotted key is used in preference, as in queries. Only the projected fields are copied; documents that aren't
+    dictionaries are returned as they are.
+    """
+
+    def __init__(self, projection):
+        self.include_id = True
+        self.inclusion = False
+        self.fields = []
+        kinds = set()
+        for field in projection:
+            include = bool(projection[field])
+            if field == "_id":
+                self.include_id = include
+                continue
+            kinds.add(include)
+            path = field.split('.') if isinstance(field, str) and "." in field else None
+            self.fields.append((field, path))
+        if len(kinds) > 1:
+            raise ValueError("a projection can't both include and exclude fields (other than the _id)")
+        # {'_id': 1} on its own includes just the _id
+        self.inclusion = kinds == {True} or (not kinds and "_id" in projection and self.include_id)
+        # the keys to copy, when no field is dotted
+        self._keys = None
+        if self.inclusion and all(path is None for field, path in self.fields):
+            self._keys = (["_id"] if self.include_id else []) + [field for field, path in self.fields]
+
+    def apply(self, document):
+        """
+        Get the projected copy of document.
+        """
+        if not isinstance(document, dict):
+            return document
+        if self.inclusion:
+            return self._include(document)
+        return self._exclude(document)
+
+    def _include(self, document):
+        if self._keys is not None:
+            return {key: document[key] for key in self._keys if key in document}
+        result = {}
+        if self.include_id and "_id" in document:
+            result["_id"] = document["_id"]
+        for field, path in self.fields:
+            if field in document:
+                result[field] = document[field]
+            elif path is not None:
+                value = document
+                for item in path:
+                    if not isinstance(value, dict) or item not in value:
+                        break
+                    value = value[item]
+                else:
+                    target = result
+                    for item in path[:-1]:
+                        if not isinstance(target.get(item), dict):
+                            target[item] = {}
+                        target = target[item]
+                    target[path[-1]] = value
+        return result
+
+    def _exclude(self, document):
+        result = dict(document)
+        if not self.include_id:
+            result.pop("_id", None)
+        for field, path in self.fields:
+            if field in result:
+                del result[field]
+            elif path is not None:
+                # copy the nested documents on the way down, the stored ones mustn't change
+                target = result
+                for item in path[:-1]:
+                    if not isinstance(target.get(item), dict):
+                        break
+                    target[item] = dict(target[item])
+                    target = target[item]
+                else:
+                    target.pop(path[-1], None)
+        return result
+
+    def covered(self, indexes):
+        """
+        Check whether the projection can be answered from indexes alone: it includes only the _id and top level
+        fields, each with an index holding every value.
+        """
+        if not self.inclusion:
+            return False
+        for field, path in self.fields:
+            if path is not None or field not in indexes or indexes[field].unhashable:
+                return False
+        return True
+
+    def from_index(self, keys, indexes):
+        """
+        Get the projections of the documents with keys, from the values held by indexes (see covered).
+        """
+        fields = [(field, indexes[field].keys) for field, path in self.fields]
+        results = []
+        for key in keys:
+            result = {"_id": key} if self.include_id else {}
+            for field, values in fields:
+                if key in values:
+                    result[field] = values[key]
+            results.append(result)
+        return results
@@ -1,22 +1,36 @@
-
 import pickle
 import json
+import mmap
+import struct
+import sys
+from array import array
+from collections.abc import MutableMapping
 
 class PickleSerializer:
     """
     Implements a basic (de)serializer based on pickle.
     """
 
+    binary = True
+
     @staticmethod
     def load(file_path):
         with open(file_path, 'rb') as fp:
-            data = pickle.load(fp)
+            data = PickleSerializer.load_fp(fp)
         return data
 
     @staticmethod
     def dump(data, file_path):
         with open(file_path, 'wb') as fp:
-            pickle.dump(data, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            PickleSerializer.dump_fp(data, fp)
+
+    @staticmethod
+    def load_fp(fp):
+        return pickle.load(fp)
+
+    @staticmethod
+    def dump_fp(data, fp):
+        pickle.dump(data, fp, protocol=pickle.HIGHEST_PROTOCOL)
 
 
 class JSONSerializer:
@@ -24,13 +38,255 @@ class JSONSerializer:
     Implements a basic (de)serializer based on builtin json.
     """
 
+    binary = False
+
     @staticmethod
     def load(file_path):
         with open(file_path, 'r') as fp:
-            data = json.load(fp)
+            data = JSONSerializer.load_fp(fp)
         return data
 
     @staticmethod
     def dump(data, file_path):
         with open(file_path, 'w') as fp:
-            json.dump(data, fp, ensure_ascii=False)
+            JSONSerializer.dump_fp(data, fp)
+
+    @staticmethod
+    def load_fp(fp):
+        return json.load(fp)
+
+    @staticmethod
+    def dump_fp(data, fp):
+        json.dump(data, fp, ensure_ascii=False)
+
+
+class JSONLinesSerializer:
+    """
+    Implements a streaming (de)serializer that writes one JSON document per line, so neither dump nor load ever holds
+    more than one encoded document in memory::
+
+        {"$meta": {...}}
+        {"$collection": "authors"}
+        {"_id": "5a1b...", "first": "Langston", "last": "Hughes"}
+        {"_id": "5a1c...", "first": "Ezra", "last": "Pound"}
+        {"$collection": "cache"}
+        {"$key": "https://example.com", "$value": "<html>...</html>"}
+
+    Documents are written as-is when they are dictionaries stored under their own _id, which keeps the file easy to
+    read and to feed to other tools. Anything else (for example, values stored with Collection.set) is wrapped with
+    its key.
+    """
+
+    binary = False
+
+    @staticmethod
+    def iterload(file_path):
+        """
+        Generator yielding ("$meta", None, meta) and (collection, key, document) tuples from the file, one line at a
+        time.
+        """
+        with open(file_path, 'r', encoding='utf-8') as fp:
+            for record in JSONLinesSerializer.iterload_fp(fp):
+                yield record
+
+    @staticmethod
+    def iterload_fp(fp):
+        collection = None
+        for line in fp:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict) and len(record) == 1:
+                if "$collection" in record:
+                    collection = record["$collection"]
+                    yield collection, None, None
+                    continue
+                if "$meta" in record:
+                    yield "$meta", None, record["$meta"]
+                    continue
+            if isinstance(record, dict) and "$key" in record and "$value" in record and len(record) == 2:
+                yield collection, record["$key"], record["$value"]
+            else:
+                yield collection, record["_id"], record
+
+    @staticmethod
+    def load(file_path):
+        with open(file_path, 'r', encoding='utf-8') as fp:
+            data = JSONLinesSerializer.load_fp(fp)
+        return data
+
+    @staticmethod
+    def dump(data, file_path):
+        with open(file_path, 'w', encoding='utf-8') as fp:
+            JSONLinesSerializer.dump_fp(data, fp)
+
+    @staticmethod
+    def load_fp(fp):
+        data = {"meta": {}, "collections": {}}
+        for collection, key, document in JSONLinesSerializer.iterload_fp(fp):
+            if collection == "$meta":
+                data["meta"] = document
+            elif key is None:
+                data["collections"].setdefault(collection, {})
+            else:
+                data["collections"][collection][key] = document
+        return data
+
+    @staticmethod
+    def dump_fp(data, fp):
+        fp.write(json.dumps({"$meta": data.get("meta", {})}, ensure_ascii=False) + "\n")
+        for name, documents in data["collections"].items():
+            fp.write(json.dumps({"$collection": name}, ensure_ascii=False) + "\n")
+            for key, document in documents.items():
+                if not (isinstance(document, dict) and "_id" in document and document["_id"] == key):
+                    document = {"$key": key, "$value": document}
+                fp.write(json.dumps(document, ensure_ascii=False) + "\n")
+
+
+class LazyDocuments(MutableMapping):
+    """
+    A documents dictionary backed by a BinarySerializer file. Keys are known up front from the offset table, but each
+    document is only unpickled the first time it is accessed. Documents that are inserted or overwritten live in an
+    ordinary dict alongside.
+    """
+
+    def __init__(self, buffer, keys, offsets, lengths):
+        self._buffer = buffer
+        self._offsets = offsets
+        self._lengths = lengths
+        # undecoded (or decoded but untouched) documents in the file, key -> slot in the offset table
+        self._slots = dict(zip(keys, range(len(keys))))
+        self._cache = {}
+        # documents inserted or overwritten since the file was loaded
+        self._documents = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._documents[key]
+        except KeyError:
+            pass
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        document = pickle.loads(self._raw(self._slots[key]))
+        # setdefault, so concurrent readers decoding the same key end up sharing one document
+        return self._cache.setdefault(key, document)
+
+    def __setitem__(self, key, value):
+        self._slots.pop(key, None)
+        self._cache.pop(key, None)
+        self._documents[key] = value
+
+    def __delitem__(self, key):
+        if key in self._slots:
+            del self._slots[key]
+            self._cache.pop(key, None)
+        else:
+            del self._documents[key]
+
+    def __contains__(self, key):
+        return key in self._slots or key in self._documents
+
+    def __iter__(self):
+        for key in self._slots:
+            yield key
+        for key in self._documents:
+            yield key
+
+    def __len__(self):
+        return len(self._slots) + len(self._documents)
+
+    def __reduce__(self):
+        # pickled (or deep copied) as a plain dict, never as a view of the mapped file
+        return dict, (list(self.items()),)
+
+    def _raw(self, slot):
+        offset = self._offsets[slot]
+        return self._buffer[offset:offset + self._lengths[slot]]
+
+    def _raw_records(self):
+        """
+        Generator yielding (key, pickled document) for every document, reusing the bytes in the mapped file for
+        documents that haven't been decoded.
+        """
+        for key, slot in self._slots.items():
+            if key in self._cache:
+                yield key, pickle.dumps(self._cache[key], protocol=pickle.HIGHEST_PROTOCOL)
+            else:
+                yield key, self._raw(slot)
+        for key, document in self._documents.items():
+            yield key, pickle.dumps(document, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class BinarySerializer:
+    """
+    Implements a (de)serializer that stores each document as an individually pickled record, followed by a catalog
+    with a per-collection offset table::
+
+        [magic][record][record]...[catalog][catalog offset][magic]
+
+    Loading memory-maps the file and reads only the catalog; documents are returned as LazyDocuments and unpickled
+    on first access, so opening a large database is nearly instant. Documents that were never accessed are copied
+    byte for byte when the database is written again.
+    """
+
+    magic = b"EDBBIN01"
+    _trailer = struct.Struct("<Q8s")
+
+    @staticmethod
+    def load(file_path):
+        with open(file_path, 'rb') as fp:
+            buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        trailer_offset = len(buffer) - BinarySerializer._trailer.size
+        if buffer[:len(BinarySerializer.magic)] != BinarySerializer.magic or trailer_offset < 0:
+            raise ValueError("Not an EssentialDB binary file: " + str(file_path))
+        catalog_offset, magic = BinarySerializer._trailer.unpack_from(buffer, trailer_offset)
+        if magic != BinarySerializer.magic:
+            raise ValueError("Truncated EssentialDB binary file: " + str(file_path))
+        catalog = pickle.loads(buffer[catalog_offset:trailer_offset])
+
+        collections = {}
+        for name, (keys, offsets, lengths) in catalog['collections'].items():
+            collections[name] = LazyDocuments(buffer, keys, _unpack_array(offsets), _unpack_array(lengths))
+        return {"meta": catalog['meta'], "collections": collections}
+
+    @staticmethod
+    def dump(data, file_path):
+        catalog = {"meta": data.get('meta', {}), "collections": {}}
+        with open(file_path, 'wb') as fp:
+            fp.write(BinarySerializer.magic)
+            position = len(BinarySerializer.magic)
+            for name, documents in data['collections'].items():
+                keys = []
+                offsets = array('Q')
+                lengths = array('Q')
+                if isinstance(documents, LazyDocuments):
+                    records = documents._raw_records()
+                else:
+                    records = ((key, pickle.dumps(document, protocol=pickle.HIGHEST_PROTOCOL))
+                               for key, document in documents.items())
+                for key, record in records:
+                    fp.write(record)
+                    keys.append(key)
+                    offsets.append(position)
+                    lengths.append(len(record))
+                    position += len(record)
+                catalog['collections'][name] = (keys, _pack_array(offsets), _pack_array(lengths))
+
+            fp.write(pickle.dumps(catalog, protocol=pickle.HIGHEST_PROTOCOL))
+            fp.write(BinarySerializer._trailer.pack(position, BinarySerializer.magic))
+
+
+def _pack_array(values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unpack_array(data):
+    values = array('Q')
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
@@ -21,7 +21,7 @@ class EssentialPrompt(Cmd):
     def do_show(self, args):
         if args == "collections":
             print("Collections:")
-            print([c for c in self.db.collections])
+            print(self.db.get_collection_names())
 
     def do_quit(self, args):
         """Quits the program."""
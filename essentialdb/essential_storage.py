@@ -0,0 +1,189 @@
+import os
+import json
+import threading
+import time
+from urllib.parse import quote
+
+
+class FileStorage:
+    """
+    Stores the whole database in a single file, written by the serializer as::
+
+        {"meta": {...}, "collections": {name: documents, ...}}
+
+    Every dump rewrites every collection, so every collection must be loaded before a dump.
+    """
+
+    partial_dump = False
+
+    def __init__(self, path, serializer):
+        self.path = path
+        self.serializer = serializer
+        self.journal_path = path + ".journal"
+        self._unloaded = {}
+        self.bytes_written = 0
+
+    def catalog(self):
+        """
+        Read the database and return its meta data and the names of its collections. The whole file is deserialized
+        (unless the serializer is itself lazy), and the documents are held until load_collection asks for them.
+        """
+        file_db = self.serializer.load(self.path)
+        if 'collections' in file_db:
+            self._unloaded = dict(file_db['collections'])
+        elif 'documents' in file_db:
+            # Handle db files created pre v0.5"
+            self._unloaded = {'default': file_db['documents']}
+        else:
+            self._unloaded = {}
+        return file_db.get('meta', {}), list(self._unloaded.keys())
+
+    def load_collection(self, name):
+        return self._unloaded.pop(name)
+
+    def dump(self, meta, collections):
+        """
+        Write the collections (a dict of name -> Collection) to disk and return the list of collections written.
+        """
+        output = {
+            "meta": meta,
+            "collections": {}
+        }
+        for name in collections:
+            output['collections'][name] = collections[name]._get_raw_documents()
+        self.bytes_written += _atomic_dump(self.serializer, output, self.path)
+        return list(collections.values())
+
+
+class DirectoryStorage:
+    """
+    Stores the database as a directory with one file per collection plus a small manifest::
+
+        my.db/
+            manifest.json
+            authors.collection
+            books.collection
+
+    Each collection file is written by the serializer in the same shape as a single file database (holding only
+    that collection), and only collections that are dirty, or have never been written, are written on dump. The
+    manifest is replaced last, so a crash mid-dump leaves the previous manifest pointing at complete files.
+
+    Opening the database only reads the manifest; each collection file is read when the collection is first used,
+    and collections that are never used are never read or written.
+    """
+
+    partial_dump = True
+    manifest_name = "manifest.json"
+
+    def __init__(self, path, serializer):
+        self.path = path
+        self.serializer = serializer
+        self.journal_path = os.path.join(path, "journal")
+        self.files = {}
+        self.meta = {}
+        self.bytes_written = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def catalog(self):
+        """
+        Read the manifest and return the database meta data and the names of its collections.
+        """
+        with open(os.path.join(self.path, self.manifest_name), 'r') as fp:
+            manifest = json.load(fp)
+        self.files = manifest['collections']
+        self.meta = manifest.get('meta', {})
+        return self.meta, list(self.files.keys())
+
+    def load_collection(self, name):
+        file_db = self.serializer.load(os.path.join(self.path, self.files[name]))
+        return file_db['collections'][name]
+
+    def dump(self, meta, collections):
+        """
+        Write dirty collections (from a dict of name -> Collection) to disk, update the manifest and return the list
+        of collections written.
+        """
+        written = []
+        files = dict(self.files)
+        for name in collections:
+            collection = collections[name]
+            if collection.dirty or name not in files:
+                files[name] = quote(name, safe='') + ".collection"
+                output = {
+                    "meta": meta,
+                    "collections": {name: collection._get_raw_documents()}
+                }
+                self.bytes_written += _atomic_dump(self.serializer, output, os.path.join(self.path, files[name]))
+                written.append(collection)
+
+        manifest_path = os.path.join(self.path, self.manifest_name)
+        with open(manifest_path + ".tmp", 'w') as fp:
+            json.dump({"meta": meta, "collections": files}, fp, ensure_ascii=False)
+            self.bytes_written += fp.tell()
+        os.replace(manifest_path + ".tmp", manifest_path)
+        self.files = files
+        self.meta = meta
+        return written
+
+
+def _atomic_dump(serializer, data, path):
+    # returns the size of the file written
+    serializer.dump(data, path + ".tmp")
+    size = os.path.getsize(path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return size
+
+
+class BackgroundSave:
+    """
+    Tracks a snapshot being written by a forked child process (see EssentialDB.background_save). The parent reaps
+    the child on a helper thread, so status changes from "running" to "done" or "failed" without blocking anyone.
+    """
+
+    def __init__(self, pid, on_complete=None):
+        self.pid = pid
+        self.status = "running"
+        self.exit_code = None
+        self.started = time.time()
+        self.finished = None
+        self._on_complete = on_complete
+        self._done = threading.Event()
+        if pid is not None:
+            threading.Thread(target=self._reap, name="essentialdb-bgsave", daemon=True).start()
+
+    def __repr__(self):
+        return "BackgroundSave: " + str(self.pid) + " " + self.status
+
+    def _reap(self):
+        try:
+            _, status = os.waitpid(self.pid, 0)
+            if os.WIFEXITED(status):
+                exit_code = os.WEXITSTATUS(status)
+            else:
+                exit_code = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else -1
+        except Exception:
+            # e.g. ChildProcessError if the child was reaped elsewhere - the waiters mustn't hang
+            exit_code = -1
+        self._complete(exit_code)
+
+    def _complete(self, exit_code):
+        self.exit_code = exit_code
+        self.status = "done" if exit_code == 0 else "failed"
+        self.finished = time.time()
+        try:
+            if self._on_complete is not None:
+                self._on_complete(self)
+        finally:
+            self._done.set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the snapshot to finish. Returns True if it was written successfully.
+        """
+        self._done.wait(timeout)
+        return self.status == "done"
@@ -1,8 +1,18 @@
 __author__ = 'scmason'
 
+import itertools
 import random
 from essentialdb import QueryFilter
-from essentialdb import EssentialIndex
+from essentialdb import EssentialIndex, EssentialOrderedIndex, EssentialColumnIndex, ColumnStore
+from essentialdb import Projection
+from .essential_index import field_value
+
+
+def _copied(value):
+    # a copy of a projected document's dictionaries - they were made for one caller
+    if isinstance(value, dict):
+        return {key: _copied(item) for key, item in value.items()}
+    return value
 
 
 class LocalCollection:
@@ -10,11 +20,20 @@ class LocalCollection:
     LocalCollection implements a simple collection store with rudimentary disk
     persistence and all the logic required to query the store. This class can be
     extended to add or alter database functionality.
+
+    Queries are executed in query_mode, "compiled" or "interpreted" (see QueryFilter). Large scans are split across
+    the workers of parallel (a ParallelScan), if given. If cache (a QueryCache) is set, the results of find and
+    find_one are cached there, and every change invalidates them.
     """
 
-    def __init__(self,  documents={}):
+    def __init__(self,  documents={}, query_mode="compiled", parallel=None):
         self.documents = documents 
+        self.parallel = parallel
+        self.cache = None
         self.indexes = {}
+        # the columns of the columnar indexes, created with the first of them
+        self.column_store = None
+        self.query_mode = query_mode
 
     def _get_raw_documents(self):
         return self.documents
@@ -25,31 +44,129 @@ class LocalCollection:
 
         for field in self.indexes:
             self.indexes[field].update_index(self.documents[document["_id"]])
+        self._changed()
 
         return document["_id"]
 
-    def find_one(self, query=None, filter=None):
+    def insert_many(self, documents):
+        stored = [dict(document) for document in documents]
+        # the documents the batch replaces (None for new _ids), to put back if an index can't take the batch
+        replaced = {}
+        for document in stored:
+            _id = document["_id"]
+            if _id not in replaced:
+                replaced[_id] = self.documents.get(_id)
+            self.documents[_id] = document
+
+        try:
+            for field in self.indexes:
+                self.indexes[field].update_index_many(stored)
+        except Exception:
+            # all or nothing - the indexes may be half updated, so they are rebuilt from the documents put back
+            for _id, document in replaced.items():
+                if document is None:
+                    del self.documents[_id]
+                else:
+                    self.documents[_id] = document
+            for field in self.indexes:
+                self.indexes[field].create_index(self.documents)
+            raise
+        self._changed()
+
+        return [document["_id"] for document in stored]
+
+    def _changed(self, fields=None):
+        # invalidates the cached results a change to fields (any field, if None) could have changed
+        if self.cache is not None:
+            self.cache.invalidate(fields)
+
+    def _cached(self, operation, query, projection, run):
+        # the results of run(), from the cache if they are there
+        cache = self.cache
+        key = cache.key(operation, query, projection)
+        if key is None:
+            return run()
+        results = cache.get(key)
+        if results is None:
+            results = run()
+            cache.put(key, results, self._dependencies(query, projection) if cache.fields else None)
+        if projection is not None:
+            # unlike the documents themselves, projected copies belong to each caller
+            return [_copied(document) for document in results]
+        return results
+
+    def _dependencies(self, query, projection):
+        # the fields the results of a query depend on - those it tests and those its projection copies - or None for
+        # every field
+        fields = ["_id"] if isinstance(query, str) else self._filter(query).fields()
+        if projection is not None:
+            projection = Projection(projection)
+            if not projection.inclusion:
+                return None
+            fields.extend(field for field, path in projection.fields)
+        return fields
+
+    def find_one(self, query=None, filter=None, projection=None):
+        if self.cache is not None and query is not None and filter is None:
+            results = self._cached("find_one", query, projection, lambda: self._find_one(query, None, projection))
+            return results[0] if results else None
+        result = self._find_one(query, filter, projection)
+        return result[0] if result else None
+
+    def _find_one(self, query, filter, projection):
+        # a list of the document found, if any
         if query is None and filter is None:
             if self.documents:
-                return self.documents[random.choice(list(self.documents.keys()))]
+                return [self._project(self.documents[random.choice(list(self.documents.keys()))], projection)]
         else:
-            results = self._query(query, filter)
+            # stops at the first match
+            results = self._query(query, filter, limit=1)
 
             if len(results) > 0:
-                return results[0]
-        return None
+                return [self._project(results[0], projection)]
+        return []
+
+    @staticmethod
+    def _project(document, projection):
+        return document if projection is None else Projection(projection).apply(document)
+
+    def _filter(self, query):
+        # a prepared (QueryFilter) query, or a query document to compile
+        return query if isinstance(query, QueryFilter) else QueryFilter.compile(query)
 
     def _query(self, query, filter_function=None, limit=None):
         # a single string should be an _id query - we can short circuit the whole process
         if isinstance(query, str):
-            return [self.documents[query]]
+            return [self.documents[query]] if query in self.documents else []
+        elif limit is not None:
+            matches = self._filter(query).iter_filter(self.documents, filter_function, self.indexes, self.query_mode)
+            return list(itertools.islice(matches, limit))
         else:
-            query_filter = QueryFilter(query)
-            results = query_filter.execute_filter(self.documents, filter_function, self.indexes)
+            results = self._filter(query).execute_filter(self.documents, filter_function, self.indexes,
+                                                         self.query_mode, parallel=self.parallel)
             return results
 
-    def find(self, query=None, filter=None):
-        return self._query(query, filter)
+    def find(self, query=None, filter=None, projection=None):
+        if self.cache is not None and filter is None:
+            return list(self._cached("find", query, projection, lambda: self._find(query, None, projection)))
+        return self._find(query, filter, projection)
+
+    def _find(self, query, filter, projection):
+        if projection is None:
+            return self._query(query, filter)
+        projection = Projection(projection)
+        if isinstance(query, str):
+            return [projection.apply(document) for document in self._query(query)]
+
+        query_filter = self._filter(query)
+        plan = query_filter.plan(self.documents, self.indexes)
+        candidates, residual = plan
+        if candidates is not None and not residual and filter is None and projection.covered(self.indexes):
+            # the indexes hold every projected value, the documents needn't be read at all
+            return projection.from_index(candidates, self.indexes)
+        apply = projection.apply
+        return [apply(document) for document in
+                query_filter.execute_filter(self.documents, filter, self.indexes, self.query_mode, plan, self.parallel)]
 
     def update(self, query, update):
         to_update = self._query(query)
@@ -58,16 +175,80 @@ class LocalCollection:
                 document[key] = update[key]
             for field in self.indexes:
                 self.indexes[field].update_index(document)
+        if to_update:
+            self._changed(list(update))
         return len(to_update)
 
-    def count(self):
-        return len(self.documents)
+    def count(self, query=None, filter=None):
+        if not query and filter is None:
+            return len(self.documents)
+        if isinstance(query, str):
+            return sum(1 for document in self._query(query) if filter is None or filter(document) is True)
+        query_filter = self._filter(query)
+        if filter is None:
+            columns = query_filter.column_mask(self.indexes, ranged=True)
+            if columns is not None:
+                # answered by the columnar indexes without collecting the _ids
+                return int(columns[1].sum())
+        candidates, residual = query_filter.plan(self.documents, self.indexes)
+        if candidates is not None and not residual and filter is None:
+            # answered by the indexes, e.g. the size of a single posting list
+            return len(candidates)
+        if filter is None:
+            test = query_filter.tester(residual, self.query_mode)
+            scan = self.documents.values() if candidates is None else map(self.documents.__getitem__, candidates)
+            if self.parallel is not None and \
+                    self.parallel.applies(len(self.documents) if candidates is None else len(candidates)):
+                return len(self.parallel.positions(list(scan), test))
+            return sum(1 for document in scan if test(document) is True)
+        if self.parallel is not None:
+            return len(query_filter.execute_filter(self.documents, filter, self.indexes, self.query_mode,
+                                                   parallel=self.parallel))
+        matches = query_filter.iter_filter(self.documents, filter, self.indexes, self.query_mode)
+        return sum(1 for _ in matches)
+
+    def explain(self, query=None, filter=None):
+        if isinstance(query, str):
+            query = {"_id": query}
+        return self._filter(query).explain(self.documents, filter, self.indexes, self.query_mode)
+
+    def distinct(self, field, query=None):
+        index = self.indexes.get(field)
+        if index is not None and not query and not index.unhashable:
+            return list(index.index)
+
+        if index is not None and not index.unhashable and not isinstance(query, str):
+            candidates, residual = self._filter(query).plan(self.documents, self.indexes)
+            if candidates is not None and not residual:
+                keys = index.keys
+                return list(dict.fromkeys(keys[key] for key in candidates if key in keys))
+
+        if not query:
+            documents = self.documents.values()
+        elif isinstance(query, str):
+            documents = self._query(query)
+        else:
+            documents = self._filter(query).iter_filter(self.documents, None, self.indexes, self.query_mode)
+        values = {}
+        unhashable = []
+        for document in documents:
+            found, value = field_value(document, field)
+            if not found:
+                continue
+            try:
+                values[value] = None
+            except TypeError:
+                if value not in unhashable:
+                    unhashable.append(value)
+        return list(values) + unhashable
 
     def remove(self, query=None):
         count = 0
         if query is None:
             count = self.count()
             self.documents = {}
+            for field in self.indexes:
+                self.indexes[field].clear()
         else:
             to_delete = self._query(query)
             count = len(to_delete)
@@ -75,10 +256,15 @@ class LocalCollection:
                 del self.documents[document['_id']]
                 for field in self.indexes:
                     self.indexes[field].remove_from_index(document)
+        if count:
+            self._changed()
         return count
 
     def set(self, key, value):
         self.documents[key] = value
+        for field in self.indexes:
+            self.indexes[field].update_index(value, key)
+        self._changed()
 
     def get(self, key):
         if key in self.documents:
@@ -90,10 +276,27 @@ class LocalCollection:
         for key in index_document:
             if index_document[key] == "hashed":
                 index = EssentialIndex(key)
-                index.create_index(self.documents)
-                self.indexes[key] = index
+            elif index_document[key] in (1, -1):
+                index = EssentialOrderedIndex(key, direction=index_document[key])
+            elif index_document[key] == "columnar":
+                if self.column_store is None:
+                    self.column_store = ColumnStore()
+                index = EssentialColumnIndex(key, self.column_store)
+            else:
+                continue
+            replaced = self.indexes.get(key)
+            if isinstance(replaced, EssentialColumnIndex) and not isinstance(index, EssentialColumnIndex):
+                self.column_store.drop_column(key)
+                if not self.column_store.columns:
+                    self.column_store = None
+            index.create_index(self.documents)
+            self.indexes[key] = index
+        # the order of the results can change
+        self._changed()
 
     def dropIndexes(self):
         self.indexes.clear()
+        self.column_store = None
+        self._changed()
 
 
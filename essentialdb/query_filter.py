@@ -1,5 +1,11 @@
 __author__ = 'scmason'
+import itertools
+import time
+from functools import lru_cache
 from essentialdb import Keys
+from essentialdb import EssentialIndex, EssentialOrderedIndex, EssentialColumnIndex
+from .essential_index import range_operators
+from .essential_columns import column_operators, comparable
 
 class LogicalOperator:
     """
@@ -46,6 +52,12 @@ class LogicalOperator:
 
         return match
 
+    def bind(self, values):
+        return LogicalOperator(self.type, [expression.bind(values) for expression in self.expressions])
+
+    def to_query(self):
+        return {self.type: [expression.to_query() for expression in self.expressions]}
+
 
 class ComparisonOperator:
     """
@@ -92,6 +104,19 @@ class ComparisonOperator:
 
             return False
 
+    def bind(self, values):
+        if self.match_value.__class__ is not Param:
+            return self
+        bound = ComparisonOperator.__new__(ComparisonOperator)
+        bound.field = self.field
+        bound.comparator = self.comparator
+        bound.comparator_function = self.comparator_function
+        bound.match_value = values[self.match_value.name]
+        return bound
+
+    def to_query(self):
+        return {self.field: {self.comparator: self.match_value}}
+
 
 class EqualityOperator:
     """
@@ -129,11 +154,43 @@ class EqualityOperator:
             # then its case 1
             return False
 
+    def bind(self, values):
+        if self.match_value.__class__ is not Param:
+            return self
+        return EqualityOperator(self.field, values[self.match_value.name])
+
+    def to_query(self):
+        return {self.field: self.match_value}
+
+
+class Param:
+    """
+    A placeholder for a value in a query template, filled in when the query is bound::
+
+        query_filter = QueryFilter({'last': Param('last'), 'born': {'$gt': Param('born')}})
+        query_filter.bind({'last': 'Hughes', 'born': 1900}).execute_filter(documents)
+
+    A placeholder stands for a whole value - it can't be nested inside one (in an $in list, say).
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "Param(" + repr(self.name) + ")"
+
 
 class QueryFilter:
     """
     Models a 'compiled' query document. The raw query doscument is sent in and 'parsed' or compiled into a list of
     expressions. Later, the filter can be executed across a set of documents.
+
+    Parsing a query document every time it is run adds up for small queries, so compile caches the parsed filters
+    by the shape of the query - its fields and operators, but not their values - and binds the values into a copy.
+
+    Filters can be executed in one of two modes: "interpreted" walks the expressions for each document, "compiled"
+    generates a single Python function testing the whole query, with the operators inlined, and runs that instead.
+    Both give the same results; the compiled function is built once per query shape.
     """
 
     def __init__(self, query_document):
@@ -142,42 +199,440 @@ class QueryFilter:
         #    self.expressions = [ComparisonOperator("_id", query_document)]
         #else:
         self.expressions = self.__parse_query(query_document, [])
+        self._template = self
+        self._factories = {}
+
+    @staticmethod
+    def compile(query_document):
+        """
+        Get the filter for query_document, reusing a parsed filter of the same shape if there is one in the cache.
+        """
+        values = []
+        shape = _query_shape(query_document or {}, values)
+        return _compile_shape(shape).bind(values)
+
+    @staticmethod
+    def cache_info():
+        """
+        Get the statistics (hits, misses, maxsize, currsize) of the compiled filter cache.
+        """
+        return _compile_shape.cache_info()
 
-    def execute_filter(self, documents, filter_function=None, indexes={}):
+    @staticmethod
+    def cache_clear():
+        """
+        Empty the compiled filter cache and reset its statistics.
+        """
+        _compile_shape.cache_clear()
+
+    def bind(self, values):
+        """
+        Get a copy of the filter with each Param replaced by its value.
+
+        Args:
+            values (dict): Values by Param name (or a list, for Params named by position).
         """
-        Execute the filter across a ser of provided documents.
+        bound = QueryFilter.__new__(QueryFilter)
+        bound.expressions = [expression.bind(values) for expression in self.expressions]
+        bound._template = self._template
+        return bound
+
+    def to_query(self):
+        """
+        Get a query document equivalent to the filter.
+        """
+        if len(self.expressions) == 1:
+            return self.expressions[0].to_query()
+        return {Keys._and: [expression.to_query() for expression in self.expressions]}
+
+    def execute_filter(self, documents, filter_function=None, indexes={}, mode="interpreted", plan=None,
+                       parallel=None):
+        """
+        Execute the filter across a ser of provided documents. The indexes (and the _id) are used to narrow the
+        documents down to a set of candidates first, see plan - or pass the (candidates, residual) already returned
+        by plan. If filter_function is given, documents must pass both the query and the function. mode is
+        "interpreted" or "compiled". If parallel (a ParallelScan) is given, large scans are split across its workers.
         """
-        # first, look for the most simple case, which is an id lookup
-        if len(self.expressions) == 1 and isinstance(self.expressions[0], EqualityOperator) and self.expressions[
-            0].field == Keys.id:
-            id = self.expressions[0].match_value
-            if id in documents:
-                return [documents[id]]
+        candidates, residual = self.plan(documents, indexes) if plan is None else plan
+        test = self.tester(residual, mode)
+        if candidates is None:
+            scan = documents.values()
+        else:
+            scan = (documents[key] for key in candidates)
+
+        if parallel is not None and (test is not None or filter_function) and \
+                parallel.applies(len(documents) if candidates is None else len(candidates)):
+            if test is None:
+                check = filter_function
+            elif filter_function:
+                def check(document):
+                    return test(document) is True and filter_function(document) is True
             else:
-                return []
+                check = test
+            return parallel.filter(scan, check)
 
-        results = []
+        if test is None:
+            if filter_function:
+                return [document for document in scan if filter_function(document) is True]
+            return list(scan)
+        if filter_function:
+            return [document for document in scan if test(document) is True and filter_function(document) is True]
+        return [document for document in scan if test(document) is True]
 
-        #do we only have one expression, and if so, so we have an index on it?
-        if len(self.expressions) == 1 and  self.expressions[0].field in indexes:
-            # if is ir equlity, then lets find just the matches
-            if isinstance(self.expressions[0], EqualityOperator) or (isinstance(self.expressions[0], ComparisonOperator)
-                                                                     and self.expressions[0].comparator == '$eq'):
-                documents = indexes[self.expressions[0].field].find(documents, self.expressions[0].match_value)
+    def iter_filter(self, documents, filter_function=None, indexes={}, mode="interpreted", plan=None):
+        """
+        Like execute_filter, but returns an iterator yielding the matching documents as they are found, so the caller
+        can stop early. The documents must not change while it is being iterated.
+        """
+        candidates, residual = self.plan(documents, indexes) if plan is None else plan
+        test = self.tester(residual, mode)
+        if candidates is None:
+            scan = documents.values()
+        else:
+            scan = (documents[key] for key in candidates)
+
+        if test is None:
+            if filter_function:
+                return (document for document in scan if filter_function(document) is True)
+            return iter(scan)
+        if filter_function:
+            return (document for document in scan if test(document) is True and filter_function(document) is True)
+        return (document for document in scan if test(document) is True)
 
-        for key in documents:
+    def tester(self, expressions=None, mode="interpreted"):
+        """
+        Get a function testing a document against expressions (all of the filter's by default), which returns True
+        for a match - compiled (see matcher), or walking the expressions. None if there are no expressions to test.
+        """
+        if expressions is None:
+            expressions = self.expressions
+        if not expressions:
+            return None
+        if mode == "compiled":
+            return self.matcher(expressions)
+
+        def test(document):
             matches = True
-            for expression in self.expressions:
-                matches = expression.test_document(documents[key])
+            for expression in expressions:
+                matches = expression.test_document(document)
                 if matches is False:
-                    break
-            if filter_function:
-                matches = filter_function(documents[key])
+                    return False
+            return matches
+        return test
+
+    def matcher(self, expressions=None):
+        """
+        Get a compiled function testing a document against expressions, which must be some of the filter's top level
+        expressions (all of them by default). Like the interpreter, it returns True for a match.
+        """
+        if expressions is None:
+            expressions = self.expressions
+        positions = {id(expression): position for position, expression in enumerate(self.expressions)}
+        positions = tuple(sorted(positions[id(expression)] for expression in expressions))
+
+        template = self._template
+        factory = template._factories.get(positions)
+        if factory is None:
+            factory = _MatcherCompiler(template.expressions).compile(positions)
+            template._factories[positions] = factory
+
+        values = []
+        for expression in self.expressions:
+            _leaf_values(expression, values)
+        return factory(values)
+
+    def plan(self, documents, indexes={}, used=None):
+        """
+        Work out which documents need to be tested. Equality tests on the _id or an indexed field are answered from
+        the documents or the index - the candidates for a conjunction are the intersection of the candidates for each
+        of its terms, those for an $or the union. Terms answered exactly don't need to be tested again. The terms of a
+        conjunction on columnar indexes are answered together with one vectorized mask when any of them is a range.
+
+        If used is given (a list), the fields whose index (or the _id) narrowed the documents down are appended to it.
+
+        Returns:
+            A tuple of (candidates, residual): the keys of the documents that can match, or None if every document
+            has to be scanned, and the expressions left to test on each of them.
+        """
+        candidate_sets, residual = self._conjunction(self.expressions, documents, indexes, used)
+        if not candidate_sets:
+            return None, residual
+        return self._intersect(candidate_sets), residual
+
+    def fields(self):
+        """
+        Get the fields the filter tests, in query order, each once.
+        """
+        fields = []
+        _fields(self.expressions, fields)
+        return list(dict.fromkeys(fields))
+
+    def explain_plan(self, documents, indexes={}):
+        """
+        Plan the filter (see plan), describing how.
+
+        Returns:
+            A tuple of ((candidates, residual), report), where report is a dictionary of the query (see to_query),
+            the candidate_indexes (the queried fields that are indexed, and the _id if it is queried), the
+            access_path ("index" if the indexes narrowed the documents down, otherwise "scan"), the indexes_used, the
+            residual terms to test on each document, the number of candidates (None for a scan) and the timings, in
+            seconds, of planning.
+        """
+        start = time.perf_counter()
+        used = []
+        candidates, residual = self.plan(documents, indexes, used)
+        planned = time.perf_counter()
+        fields = self.fields()
+        report = {
+            "query": self.to_query(),
+            "candidate_indexes": [field for field in fields if field == Keys.id or field in indexes],
+            "access_path": "scan" if candidates is None else "index",
+            "indexes_used": list(dict.fromkeys(used)),
+            "residual": [expression.to_query() for expression in residual],
+            "candidates": None if candidates is None else len(candidates),
+            "timings": {"plan": planned - start}
+        }
+        return (candidates, residual), report
+
+    def explain(self, documents, filter_function=None, indexes={}, mode="interpreted"):
+        """
+        Execute the filter like execute_filter, reporting how it was run: explain_plan's report, with the number of
+        documents_examined (read to be tested or returned) and returned, and the timings of the filter and in total.
+        """
+        plan, report = self.explain_plan(documents, indexes)
+        start = time.perf_counter()
+        results = self.execute_filter(documents, filter_function, indexes, mode, plan)
+        timings = report["timings"]
+        timings["filter"] = time.perf_counter() - start
+        timings["total"] = timings["plan"] + timings["filter"]
+        report["documents_examined"] = len(documents) if plan[0] is None else len(plan[0])
+        report["returned"] = len(results)
+        return report
+
+    def _conjunction(self, expressions, documents, indexes, used=None):
+        # returns (candidate_sets, residual), range terms on the same field are looked up together as one range
+        candidate_sets = []
+        residual = []
+        ranges = {}
+        exclusions = []
+        columnar = []
+        for expression in expressions:
+            terms = self._column_terms(expression, indexes)
+            if terms is not None:
+                columnar.append((expression, terms))
+                continue
+            if self._is_range(expression, indexes):
+                ranges.setdefault(expression.field, []).append(expression)
+                continue
+            if isinstance(expression, ComparisonOperator) and expression.comparator == '$nin':
+                exclusions.append(expression)
+                continue
+            candidates, exact = self._candidates(expression, documents, indexes, used)
+            if candidates is not None:
+                candidate_sets.append(candidates)
+            if not exact:
+                residual.append(expression)
+
+        if columnar:
+            terms = [term for expression, expression_terms in columnar for term in expression_terms]
+            if any(operator in range_operators for field, operator, value in terms):
+                # the columnar terms are answered together by one mask over the rows
+                candidates, exact = indexes[terms[0][0]].store.find(terms)
+                candidate_sets.append(candidates)
+                if used is not None:
+                    used.extend(field for field, operator, value in terms)
+                if not exact:
+                    residual.extend(expression for expression, expression_terms in columnar)
+            else:
+                # equality alone is a lookup in the hash index
+                for expression, expression_terms in columnar:
+                    candidates, exact = self._candidates(expression, documents, indexes, used)
+                    if candidates is not None:
+                        candidate_sets.append(candidates)
+                    if not exact:
+                        residual.append(expression)
+
+        for field in ranges:
+            found = indexes[field].find_range([(term.comparator, term.match_value) for term in ranges[field]])
+            if found is None:
+                residual.extend(ranges[field])
+                continue
+            candidates, exact = found
+            candidate_sets.append(candidates)
+            if used is not None:
+                used.append(field)
+            if not exact:
+                residual.extend(ranges[field])
+
+        # a $nin matches most documents, it is only worth a set difference when nothing narrows them down further
+        for expression in exclusions:
+            candidates, exact = (None, False) if candidate_sets else \
+                self._candidates(expression, documents, indexes, used)
+            if candidates is not None:
+                candidate_sets.append(candidates)
+            if not exact:
+                residual.append(expression)
+        return candidate_sets, residual
+
+    @staticmethod
+    def _column_terms(expression, indexes):
+        # the (field, operator, value) terms of an expression the columnar indexes answer, or None
+        if isinstance(expression, LogicalOperator):
+            if expression.type != Keys._and or not expression.expressions:
+                return None
+            terms = []
+            for sub_expression in expression.expressions:
+                sub_terms = QueryFilter._column_terms(sub_expression, indexes)
+                if sub_terms is None:
+                    return None
+                terms.extend(sub_terms)
+            return terms
+        if isinstance(expression, EqualityOperator):
+            operator = "$eq"
+        elif isinstance(expression, ComparisonOperator) and expression.comparator in column_operators:
+            operator = expression.comparator
+        else:
+            return None
+        if not isinstance(indexes.get(expression.field), EssentialColumnIndex):
+            return None
+        value = expression.match_value
+        if operator == "$in":
+            if not isinstance(value, (list, tuple, set, frozenset)) or not all(comparable(item) for item in value):
+                return None
+        elif not comparable(value):
+            return None
+        return [(expression.field, operator, value)]
+
+    def column_mask(self, indexes, ranged=False):
+        """
+        Get a boolean mask over the rows of the columnar store when every term of the filter is answered exactly by
+        the columnar indexes (see EssentialColumnIndex), otherwise None. If ranged, only when some term is a range -
+        equality alone is cheaper to look up in the hash index.
+
+        Returns:
+            A tuple of (store, mask), or None.
+        """
+        terms = []
+        for expression in self.expressions:
+            expression_terms = self._column_terms(expression, indexes)
+            if expression_terms is None:
+                return None
+            terms.extend(expression_terms)
+        if not terms or ranged and not any(operator in range_operators for field, operator, value in terms):
+            return None
+        store = indexes[terms[0][0]].store
+        mask, exact = store.mask(terms)
+        return (store, mask) if exact else None
+
+    @staticmethod
+    def _is_range(expression, indexes):
+        return isinstance(expression, ComparisonOperator) and expression.comparator in range_operators and \
+               isinstance(indexes.get(expression.field), EssentialOrderedIndex)
+
+    def _candidates(self, expression, documents, indexes, used=None):
+        # returns (candidates, exact), candidates is None when the expression can't be answered from an index
+        if isinstance(expression, LogicalOperator):
+            if not expression.expressions:
+                return None, False
+            if expression.type == Keys._and:
+                candidate_sets, residual = self._conjunction(expression.expressions, documents, indexes, used)
+                if not candidate_sets:
+                    return None, False
+                return self._intersect(candidate_sets), not residual
+            if expression.type == Keys._or:
+                candidate_sets = []
+                exact = True
+                # only reported as used if every branch is answered
+                branches_used = [] if used is not None else None
+                for sub_expression in expression.expressions:
+                    candidates, sub_exact = self._candidates(sub_expression, documents, indexes, branches_used)
+                    if candidates is None:
+                        return None, False
+                    candidate_sets.append(candidates)
+                    exact = exact and sub_exact
+                if used is not None:
+                    used.extend(branches_used)
+                return self._union(candidate_sets), exact
+            return None, False
+
+        terms = self._column_terms(expression, indexes)
+        if terms is not None and terms[0][1] in range_operators:
+            found = indexes[expression.field].store.find(terms)
+        elif self._is_range(expression, indexes):
+            found = indexes[expression.field].find_range([(expression.comparator, expression.match_value)])
+            if found is None:
+                return None, False
+        elif isinstance(expression, ComparisonOperator) and expression.comparator in ('$in', '$nin'):
+            found = self._membership_candidates(expression, documents, indexes)
+        else:
+            found = self._equality_candidates(expression, documents, indexes)
+        if used is not None and found[0] is not None:
+            used.append(expression.field)
+        return found
+
+    @staticmethod
+    def _equality_candidates(expression, documents, indexes):
+        # an equality test on the _id or an indexed field is answered exactly
+        if isinstance(expression, EqualityOperator):
+            value = expression.match_value
+        elif isinstance(expression, ComparisonOperator) and expression.comparator == '$eq':
+            value = expression.match_value
+        else:
+            return None, False
+
+        if not EssentialIndex.indexable(value):
+            return None, False
+        if expression.field == Keys.id:
+            return ([value] if value in documents else []), True
+        if expression.field in indexes:
+            return indexes[expression.field].lookup(value), True
+        return None, False
+
+    @staticmethod
+    def _membership_candidates(expression, documents, indexes):
+        # $in is a union of lookups, $nin the documents left after taking them away
+        values = expression.match_value
+        if not isinstance(values, (list, tuple, set, frozenset)):
+            # for anything else (a string, say) 'in' means something other than equality
+            return None, False
+        if not all(EssentialIndex.indexable(value) for value in values):
+            return None, False
+
+        if expression.field == Keys.id:
+            if expression.comparator == '$in':
+                return dict.fromkeys(value for value in values if value in documents), True
+            excluded = set(values)
+            return dict.fromkeys(key for key in documents if key not in excluded), True
+
+        if expression.field not in indexes:
+            return None, False
+        index = indexes[expression.field]
+        if expression.comparator == '$in':
+            candidates = {}
+            for value in values:
+                candidates.update(index.lookup(value))
+            return candidates, True
+        excluded = set(values)
+        candidates = dict.fromkeys(_id for _id, value in index.keys.items() if value not in excluded)
+        # unhashable values can't be looked up, but might still be in values
+        candidates.update(dict.fromkeys(index.unhashable))
+        return candidates, not index.unhashable
 
-            if matches is True:
-                results.append(documents[key])
+    @staticmethod
+    def _intersect(candidate_sets):
+        if len(candidate_sets) == 1:
+            return candidate_sets[0]
+        # walk the smallest set, probing the others
+        candidate_sets = sorted(candidate_sets, key=len)
+        smallest, others = candidate_sets[0], candidate_sets[1:]
+        return dict.fromkeys(key for key in smallest if all(key in others_set for others_set in others))
 
-        return results
+    @staticmethod
+    def _union(candidate_sets):
+        union = {}
+        for candidates in candidate_sets:
+            union.update(dict.fromkeys(candidates))
+        return union
 
     def __parse_query(self, query_document, expression_list):
         expressions = expression_list
@@ -189,6 +644,11 @@ class QueryFilter:
                 logical_operator = LogicalOperator(key, log_expressions)
                 expressions.append(logical_operator)
             # basic expression - something like {"field': {'$eq': 'something'}}
+            elif isinstance(query_document[key], dict) and len(query_document[key]) > 1:
+                # several operators on one field - {'year': {'$gt': 1900, '$lt': 2000}} - must all be true
+                comparisons = [ComparisonOperator(key, {comparator: query_document[key][comparator]})
+                               for comparator in query_document[key]]
+                expressions.append(LogicalOperator(Keys._and, comparisons))
             elif isinstance(query_document[key], dict):
                 expressions.append(ComparisonOperator(key, query_document[key]))
             # then we are left with {"field 1", "value 1"}
@@ -203,4 +663,192 @@ class QueryFilter:
         current = document
         for item in path:
             current = current[item]
-        return current
\ No newline at end of file
+        return current
+
+
+_logical_operators = frozenset([Keys._and, Keys._or, Keys._nor, Keys._not])
+
+
+def _fields(expressions, fields):
+    # appends the fields tested by expressions to fields, in query order
+    for expression in expressions:
+        if isinstance(expression, LogicalOperator):
+            _fields(expression.expressions, fields)
+        else:
+            fields.append(expression.field)
+
+
+def _query_shape(query_document, values):
+    # the hashable structure of a query document, with its values appended to values in the order QueryFilter parses
+    # them
+    shape = []
+    for key, item in query_document.items():
+        if key in _logical_operators:
+            shape.append((key, tuple([_query_shape(sub_document, values) for sub_document in item])))
+        elif isinstance(item, dict):
+            shape.append((key, tuple(item)))
+            values.extend(item.values())
+        else:
+            shape.append((key,))
+            values.append(item)
+    return tuple(shape)
+
+
+def _shape_template(shape, positions):
+    template = {}
+    for item in shape:
+        if len(item) == 1:
+            template[item[0]] = Param(next(positions))
+        elif item[0] in _logical_operators:
+            template[item[0]] = [_shape_template(sub_shape, positions) for sub_shape in item[1]]
+        else:
+            template[item[0]] = {comparator: Param(next(positions)) for comparator in item[1]}
+    return template
+
+
+@lru_cache(maxsize=256)
+def _compile_shape(shape):
+    return QueryFilter(_shape_template(shape, itertools.count()))
+
+
+def _leaf_values(expression, values):
+    # the match values of the expression's leaves, in the order _MatcherCompiler numbers them
+    if isinstance(expression, LogicalOperator):
+        for sub_expression in expression.expressions:
+            _leaf_values(sub_expression, values)
+    else:
+        values.append(expression.match_value)
+
+
+class _MatcherCompiler:
+    """
+    Generates the source of a function testing documents against a list of expressions, equivalent to testing each
+    in turn with test_document. The structure of the query is fixed in the source: each logical operator becomes a
+    nested function, each comparison is inlined (dotted paths split into a chain of lookups) and the expressions are
+    tested in the same order, stopping at the same points. Field names and values are passed in rather than written
+    into the source, so one compiled factory serves every query of the same shape::
+
+        factory = _MatcherCompiler(expressions).compile(positions)
+        match = factory(values)   # the leaves' match values, see _leaf_values
+        match(document)           # True, if the document matches
+
+    """
+
+    operators = {
+        "$eq": "{0} == {1}",
+        "$gt": "{0} > {1}",
+        "$gte": "{0} >= {1}",
+        "$lt": "{0} < {1}",
+        "$lte": "{0} <= {1}",
+        "$ne": "{0} != {1}",
+        "$in": "{0} in {1}",
+        "$nin": "{0} not in {1}"
+    }
+
+    def __init__(self, expressions):
+        self.expressions = expressions
+        self.slots = {}
+        for expression in expressions:
+            self._number_leaves(expression)
+        self.constants = []
+        self.functions = []
+
+    def _number_leaves(self, expression):
+        if isinstance(expression, LogicalOperator):
+            for sub_expression in expression.expressions:
+                self._number_leaves(sub_expression)
+        else:
+            self.slots[id(expression)] = len(self.slots)
+
+    def compile(self, positions):
+        """
+        Compile a factory for a function testing the expressions at positions (a tuple of indexes into expressions).
+        """
+        body = self._conjunction([self.expressions[position] for position in positions])
+
+        lines = ["def make(c):"]
+        if self.constants:
+            lines.append("    " + ", ".join("c%i" % i for i in range(len(self.constants))) + ", = c")
+        lines.append("    def factory(a):")
+        if self.slots:
+            lines.append("        " + ", ".join("a%i" % i for i in range(len(self.slots))) + ", = a")
+        for function in self.functions:
+            lines.extend("        " + line for line in function)
+        lines.append("        def match(document):")
+        lines.extend("            " + line for line in body)
+        lines.append("        return match")
+        lines.append("    return factory")
+
+        namespace = {}
+        exec(compile("\n".join(lines) + "\n", "<query filter>", "exec"), namespace)
+        return namespace["make"](self.constants)
+
+    def _constant(self, value):
+        self.constants.append(value)
+        return "c%i" % (len(self.constants) - 1)
+
+    def _conjunction(self, expressions):
+        lines = ["m = True"] + self._conjunction_terms(expressions)
+        lines.append("return m")
+        return lines
+
+    def _conjunction_terms(self, expressions):
+        # an $and inside a conjunction stops at the same points whether it is a function or not, so it is inlined
+        lines = []
+        for expression in expressions:
+            if isinstance(expression, LogicalOperator) and expression.type == Keys._and:
+                lines.append("m = True")
+                lines.extend(self._conjunction_terms(expression.expressions))
+                continue
+            lines.extend(self._test(expression))
+            lines.extend(["if m is False:", "    return False"])
+        return lines
+
+    def _test(self, expression):
+        # lines setting m to the result of testing expression
+        if isinstance(expression, LogicalOperator):
+            return ["m = %s(document)" % self._logical(expression)]
+
+        value = "a%i" % self.slots[id(expression)]
+        dotted = isinstance(expression.field, str) and "." in expression.field
+        if isinstance(expression, EqualityOperator):
+            template = value + " == {0}"
+        elif expression.comparator in self.operators:
+            template = self.operators[expression.comparator].replace("{1}", value)
+        else:
+            template = self._constant(expression.comparator_function) + "({0}, " + value + ")"
+
+        lines = ["try:",
+                 "    m = " + template.format("document[%s]" % self._constant(expression.field)),
+                 "except Exception:"]
+        if dotted:
+            path = "".join("[%s]" % self._constant(item) for item in expression.field.split("."))
+            lines.extend(["    try:",
+                          "        m = " + template.format("document" + path),
+                          "    except Exception:",
+                          "        m = False"])
+        else:
+            lines.append("    m = False")
+        return lines
+
+    def _logical(self, expression):
+        # adds a function testing a logical operator, returns its name
+        position = len(self.functions)
+        name = "n%i" % position
+        self.functions.append(None)
+        if expression.type == Keys._and:
+            lines = self._conjunction(expression.expressions)
+        else:
+            lines = ["m = True"]
+            for sub_expression in expression.expressions:
+                lines.extend(self._test(sub_expression))
+                if expression.type == Keys._or:
+                    lines.extend(["if m is True:", "    return True"])
+                elif expression.type == Keys._nor:
+                    lines.extend(["if m is True:", "    return False", "m = True"])
+                elif expression.type == Keys._not:
+                    lines.extend(["if m is False:", "    return True"])
+            lines.append("return not m" if expression.type == Keys._not else "return m")
+
+        self.functions[position] = ["def %s(document):" % name] + ["    " + line for line in lines]
+        return name
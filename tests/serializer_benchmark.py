@@ -0,0 +1,63 @@
+"""
+Benchmarks serializer and compression codec combinations on generated ticket data. Run from the repository root::
+
+    python -m tests.serializer_benchmark [document count]
+
+For each combination, reports the time to dump and load the database, the file size, the compression ratio (relative
+to the same serializer uncompressed) and throughput in MB/s of uncompressed data.
+"""
+import os
+import sys
+import time
+from essentialdb import PickleSerializer, JSONSerializer, JSONLinesSerializer, CompressedSerializer
+from .document_generator import DocumentGenerator
+
+BENCHMARK_FILE = "serializer_benchmark.db"
+
+
+def gen_tickets(count):
+    generator = DocumentGenerator()
+    generator.init_word_cache(5000)
+    generator.init_sentence_cache(5000)
+    generator.set_template({
+        "_id": 'gid',
+        "title": 'sentence',
+        "details": 'paragraph',
+        "owner": 'email',
+        "status": ['open', 'closed', 'blocked', 'in progress'],
+        "priority": ['minor', 'major', 'critical', 'blocker'],
+        "created": 'integer'
+    })
+    return {doc['_id']: doc for doc in generator.gen_docs(count)}
+
+
+def run(serializer, data):
+    start = time.perf_counter()
+    serializer.dump(data, BENCHMARK_FILE)
+    dump_time = time.perf_counter() - start
+    size = os.path.getsize(BENCHMARK_FILE)
+
+    start = time.perf_counter()
+    serializer.load(BENCHMARK_FILE)
+    load_time = time.perf_counter() - start
+    os.remove(BENCHMARK_FILE)
+    return dump_time, load_time, size
+
+
+def main(count):
+    data = {"meta": {}, "collections": {"tickets": gen_tickets(count)}}
+    print("%-20s %-6s %5s %10s %10s %12s %7s %10s %10s" % (
+        "serializer", "codec", "level", "dump (s)", "load (s)", "size (bytes)", "ratio", "dump MB/s", "load MB/s"))
+
+    for serializer in [PickleSerializer(), JSONSerializer(), JSONLinesSerializer()]:
+        _, _, raw_size = run(serializer, data)
+        for codec, levels in [("none", [None]), ("zlib", [1, 6, 9]), ("bz2", [1, 9]), ("lzma", [0, 6])]:
+            for level in levels:
+                dump_time, load_time, size = run(CompressedSerializer(serializer, codec, level), data)
+                print("%-20s %-6s %5s %10.3f %10.3f %12i %7.2f %10.1f %10.1f" % (
+                    serializer.__class__.__name__, codec, level if level is not None else "-", dump_time, load_time,
+                    size, raw_size / size, raw_size / dump_time / 1e6, raw_size / load_time / 1e6))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
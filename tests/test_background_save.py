@@ -0,0 +1,79 @@
+import unittest
+import os
+from essentialdb import EssentialDB, PickleSerializer
+from essentialdb.essential_storage import BackgroundSave
+
+BGSAVE_DB_FILE = "bgsave_test_db"
+
+
+class FailingSerializer(PickleSerializer):
+
+    @staticmethod
+    def dump(data, file_path):
+        raise IOError("disk full")
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), "requires os.fork")
+class TestBackgroundSave(unittest.TestCase):
+
+    def tearDown(self):
+        for path in [BGSAVE_DB_FILE, BGSAVE_DB_FILE + ".journal", BGSAVE_DB_FILE + ".journal.1"]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_point_in_time(self):
+        db = EssentialDB(filepath=BGSAVE_DB_FILE)
+        db.authors.insert_many([{'_id': i} for i in range(100)])
+        save = db.background_save()
+        self.assertFalse(db.authors.dirty)
+        # changes after the fork are not part of the snapshot
+        db.authors.insert_one({'_id': 'late'})
+        self.assertTrue(save.wait())
+        self.assertEqual(save.status, "done")
+
+        db2 = EssentialDB(filepath=BGSAVE_DB_FILE)
+        self.assertEqual(db2.authors.count(), 100)
+        self.assertIsNone(db2.authors.get('late'))
+        self.assertTrue(db.authors.dirty)
+
+    def test_journal(self):
+        db = EssentialDB(filepath=BGSAVE_DB_FILE, journal=True)
+        db.authors.insert_many([{'_id': i} for i in range(10)])
+        save = db.background_save()
+        db.authors.insert_one({'_id': 'late'})
+        self.assertTrue(save.wait())
+        db.sync()
+        self.assertFalse(os.path.exists(BGSAVE_DB_FILE + ".journal.1"))
+
+        db2 = EssentialDB(filepath=BGSAVE_DB_FILE, journal=True)
+        self.assertEqual(db2.authors.count(), 11)
+
+    def test_failure(self):
+        db = EssentialDB(filepath=BGSAVE_DB_FILE, serializer=FailingSerializer(), journal=True)
+        db.authors.insert_many([{'_id': i} for i in range(10)])
+        save = db.background_save()
+        self.assertFalse(save.wait())
+        self.assertEqual(save.status, "failed")
+        self.assertTrue(db.authors.dirty)
+        db.close()
+
+        # the rotated journal is kept, so nothing is lost
+        db2 = EssentialDB(filepath=BGSAVE_DB_FILE, journal=True)
+        self.assertEqual(db2.authors.count(), 10)
+
+    def test_exit_codes(self):
+        pid = os.fork()
+        if pid == 0:
+            os._exit(3)
+        save = BackgroundSave(pid)
+        self.assertFalse(save.wait(5))
+        self.assertEqual(save.exit_code, 3)
+        # a child that can't be waited for fails rather than leaving the waiters hanging
+        save = BackgroundSave(pid)
+        self.assertFalse(save.wait(5))
+        self.assertTrue(save.done)
+        self.assertEqual(save.exit_code, -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import random
+import unittest
+from essentialdb import EssentialDB, Pipeline
+
+
+class TestAggregate(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = EssentialDB().get_collection()
+        self.collection.insert_many([{'_id': i, 'project': ['a', 'b', 'c'][i % 3], 'points': i,
+                                      'status': 'open' if i % 2 else 'closed', 'tags': ['x', 'y'][:i % 3],
+                                      'owner': {'name': 'owner' + str(i % 2)}} for i in range(30)])
+
+    def test_match_group(self):
+        results = self.collection.aggregate([
+            {'$match': {'status': 'open'}},
+            {'$group': {'_id': '$project', 'count': {'$sum': 1}, 'points': {'$sum': '$points'},
+                        'average': {'$avg': '$points'}, 'low': {'$min': '$points'}, 'high': {'$max': '$points'},
+                        'ids': {'$push': '$_id'}}},
+            {'$sort': {'_id': 1}}
+        ])
+        results = list(results)
+        self.assertEqual([result['_id'] for result in results], ['a', 'b', 'c'])
+        a = results[0]
+        self.assertEqual(a['ids'], [3, 9, 15, 21, 27])
+        self.assertEqual(a['count'], 5)
+        self.assertEqual(a['points'], 75)
+        self.assertEqual(a['average'], 15)
+        self.assertEqual((a['low'], a['high']), (3, 27))
+
+    def test_compound_group(self):
+        results = self.collection.aggregate([
+            {'$group': {'_id': {'project': '$project', 'owner': '$owner.name'}, 'count': {'$sum': 1}}},
+            {'$sort': {'count': -1, '_id.project': 1}},
+            {'$limit': 2}
+        ])
+        self.assertEqual(list(results), [{'_id': {'project': 'a', 'owner': 'owner0'}, 'count': 5},
+                                         {'_id': {'project': 'a', 'owner': 'owner1'}, 'count': 5}])
+        results = list(self.collection.aggregate([{'$group': {'_id': None, 'total': {'$sum': '$points'},
+                                                              'missing': {'$avg': '$missing'}}}]))
+        self.assertEqual(results, [{'_id': None, 'total': 435, 'missing': None}])
+
+    def test_project_unwind(self):
+        results = self.collection.aggregate([
+            {'$match': {'_id': {'$in': [1, 2, 3]}}},
+            {'$unwind': '$tags'},
+            {'$project': {'tags': 1, 'owner': '$owner.name', '_id': 0}}
+        ])
+        self.assertEqual(list(results), [{'tags': 'x', 'owner': 'owner1'}, {'tags': 'x', 'owner': 'owner0'},
+                                         {'tags': 'y', 'owner': 'owner0'}])
+        # the stored documents aren't changed
+        self.assertEqual(self.collection.get(2)['tags'], ['x', 'y'])
+        results = self.collection.aggregate([
+            {'$match': {'_id': {'$in': [1, 3]}}},
+            {'$unwind': {'path': '$tags', 'preserveNullAndEmptyArrays': True}},
+            {'$project': {'tags': 0, 'owner': 0, 'project': 0}}
+        ])
+        self.assertEqual(list(results), [{'_id': 1, 'points': 1, 'status': 'open'},
+                                         {'_id': 3, 'points': 3, 'status': 'open'}])
+
+    def test_sort_skip_limit(self):
+        random.seed(5)
+        expected = sorted(self.collection.find({'status': 'closed'}), key=lambda document: -document['points'])
+        for index in [None, {'points': 1}]:
+            if index:
+                self.collection.createIndex(index)
+            results = self.collection.aggregate([{'$match': {'status': 'closed'}}, {'$sort': {'points': -1}},
+                                                 {'$skip': 2}, {'$limit': 3}])
+            self.assertEqual(list(results), expected[2:5])
+            # the same, sorted after another stage
+            results = self.collection.aggregate([{'$match': {'status': 'closed'}}, {'$project': {'points': 1}},
+                                                 {'$sort': {'points': -1}}, {'$skip': 2}, {'$limit': 3}])
+            self.assertEqual([result['points'] for result in results], [24, 22, 20])
+
+    def test_lazy(self):
+        results = self.collection.aggregate([{'$project': {'points': 1}}, {'$match': {'points': {'$gt': 3}}},
+                                             {'$limit': 2}])
+        # nothing is read until the results are
+        self.collection.remove({'_id': 4})
+        self.assertEqual(next(results), {'_id': 5, 'points': 5})
+        self.assertEqual(list(results), [{'_id': 6, 'points': 6}])
+        # not even a leading $sort
+        results = self.collection.aggregate([{'$sort': {'points': -1}}, {'$project': {'points': 1}}])
+        self.collection.insert_one({'_id': 'late', 'points': 100})
+        self.assertEqual(next(results), {'_id': 'late', 'points': 100})
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, Pipeline, [{'$lookup': {}}])
+        self.assertRaises(ValueError, Pipeline, [{'$group': {'total': {'$sum': 1}}}])
+        self.assertRaises(ValueError, Pipeline, [{'$group': {'_id': None, 'total': {'$median': 1}}}])
+        self.assertRaises(ValueError, Pipeline, [{'$sort': {'a': 2}}])
+        self.assertRaises(ValueError, Pipeline, [{'$limit': 0}])
+        self.assertRaises(ValueError, Pipeline, [{'$project': {'a': 0, 'b': '$c'}}])
+
+
+if __name__ == '__main__':
+    unittest.main()
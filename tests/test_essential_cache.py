@@ -0,0 +1,92 @@
+import unittest
+from essentialdb import EssentialDB, QueryCache
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = EssentialDB().get_collection()
+        self.collection.insert_many([{'_id': i, 'type': ['flag', 'limit'][i % 2], 'value': i,
+                                      'owner': {'name': 'team' + str(i % 3)}} for i in range(20)])
+
+    def test_key(self):
+        self.assertEqual(QueryCache.key('find', {'a': 1, 'b': {'$gt': 2, '$lt': 5}}),
+                         QueryCache.key('find', {'b': {'$lt': 5, '$gt': 2}, 'a': 1}))
+        self.assertNotEqual(QueryCache.key('find', {'a': 1}), QueryCache.key('find', {'a': 1.0}))
+        self.assertNotEqual(QueryCache.key('find', {'a': 1}), QueryCache.key('find', {'a': 1}, {'a': 1}))
+        self.assertNotEqual(QueryCache.key('find', {'a': [1, 2]}), QueryCache.key('find', {'a': (1, 2)}))
+        self.assertIsNone(QueryCache.key('find', {'a': bytearray(b'x')}))
+
+    def test_hits(self):
+        cache = self.collection.enable_cache()
+        flags = self.collection.find({'type': 'flag', 'value': {'$lt': 10}})
+        self.assertEqual(len(flags), 5)
+        self.assertEqual(self.collection.find({'value': {'$lt': 10}, 'type': 'flag'}), flags)
+        self.assertEqual(self.collection.find_one({'value': 100}), None)
+        self.assertEqual(self.collection.find_one({'value': 100}), None)
+        self.assertEqual(self.collection.find_one({'value': 3}, projection={'value': 1, '_id': 0}), {'value': 3})
+        self.assertEqual(self.collection.find_one({'value': 3}, projection={'value': 1, '_id': 0}), {'value': 3})
+        stats = cache.stats()
+        self.assertEqual((stats['entries'], stats['hits'], stats['misses']), (3, 3, 3))
+        # each caller gets its own list
+        flags.pop()
+        self.assertEqual(len(self.collection.find({'type': 'flag', 'value': {'$lt': 10}})), 5)
+        # and its own projected documents
+        projection = {'owner.name': 1, '_id': 0}
+        self.collection.find_one({'value': 4}, projection=projection)['owner']['name'] = 'changed'
+        self.collection.find({'value': 4}, projection=projection)[0]['owner']['name'] = 'changed'
+        self.assertEqual(self.collection.find_one({'value': 4}, projection=projection), {'owner': {'name': 'team1'}})
+        self.assertEqual(self.collection.find({'value': 4}, projection=projection), [{'owner': {'name': 'team1'}}])
+        # filter functions aren't cached
+        self.collection.find({'type': 'flag'}, filter=lambda document: True)
+        self.assertEqual(cache.stats()['entries'], 5)
+
+    def test_invalidate(self):
+        self.collection.enable_cache()
+        self.assertEqual(self.collection.count({'type': 'flag'}), len(self.collection.find({'type': 'flag'})))
+        self.collection.insert_one({'_id': 'new', 'type': 'flag'})
+        self.assertEqual(len(self.collection.find({'type': 'flag'})), 11)
+        self.collection.remove({'_id': 'new'})
+        self.assertEqual(len(self.collection.find({'type': 'flag'})), 10)
+        self.collection.update({'value': 0}, {'type': 'limit'})
+        self.assertEqual(len(self.collection.find({'type': 'flag'})), 9)
+        self.collection.set(0, {'_id': 0, 'type': 'flag'})
+        self.assertEqual(len(self.collection.find({'type': 'flag'})), 10)
+        self.collection.disable_cache()
+        self.assertEqual(len(self.collection.find({'type': 'flag'})), 10)
+
+    def test_fields(self):
+        cache = self.collection.enable_cache(fields=True)
+        self.collection.find({'type': 'flag'})
+        self.collection.find({'owner.name': 'team0'})
+        self.collection.find({'type': 'flag'}, projection={'value': 1})
+        # the documents are updated in place, results not depending on the field stay cached
+        self.collection.update({'value': 2}, {'value': 200})
+        self.assertEqual(cache.stats()['entries'], 2)
+        self.assertIn(200, [document['value'] for document in self.collection.find({'type': 'flag'})])
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.collection.update({'value': 3}, {'owner': {'name': 'team1'}})
+        self.assertEqual(len(self.collection.find({'owner.name': 'team0'})), 6)
+        self.collection.update({'value': 6}, {'type': 'limit'})
+        self.assertEqual(len(self.collection.find({'type': 'flag'})), 9)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_eviction(self):
+        cache = self.collection.enable_cache(max_entries=2)
+        for value in range(3):
+            self.collection.find({'value': value})
+        self.collection.find({'value': 2})
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.collection.find({'value': 0})
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (1, 4))
+
+        cache = self.collection.enable_cache(max_bytes=4000)
+        self.collection.find({'value': 0})
+        self.collection.find({})
+        stats = cache.stats()
+        self.assertLessEqual(stats['bytes'], 4000)
+        self.assertEqual(stats['entries'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from essentialdb import EssentialDB, QueryFilter
+from essentialdb.essential_columns import numpy
+
+
+@unittest.skipIf(numpy is None, "columnar indexes need numpy")
+class TestColumnIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = EssentialDB().get_collection()
+        self.collection.insert_many([{'_id': i, 'created': i * 10, 'priority': ['minor', 'major', 'critical'][i % 3],
+                                      'hours': i / 2} for i in range(30)])
+        self.collection.createIndex({'created': 'columnar', 'priority': 'columnar', 'hours': 'columnar'})
+
+    def _check(self, query):
+        # the same results as a scan, in any order
+        expected = sorted((document['_id'] for document in QueryFilter(query).execute_filter(
+            self.collection.collection.documents)), key=str)
+        self.assertEqual(sorted((document['_id'] for document in self.collection.find(query)), key=str), expected)
+        self.assertEqual(self.collection.count(query), len(expected))
+        return expected
+
+    def test_range(self):
+        self.assertEqual(self._check({'created': {'$gte': 100, '$lt': 150}}), [10, 11, 12, 13, 14])
+        self.assertEqual(self._check({'created': {'$gt': 200}, 'priority': 'major'}), [22, 25, 28])
+        self.assertEqual(self._check({'priority': {'$gt': 'major'}, 'hours': {'$lte': 3}}), [0, 3, 6])
+        self.assertEqual(self._check({'priority': {'$in': ['critical', 'nothing']}, 'created': {'$lt': 60}}), [2, 5])
+        self.assertEqual(self._check({'$or': [{'created': {'$lt': 20}}, {'hours': {'$gt': 14}}]}), [0, 1, 29])
+        # a number never matches a string
+        self.assertEqual(self._check({'priority': {'$gt': 1}}), [])
+        report = self.collection.explain({'created': {'$gt': 200}, 'priority': 'major'})
+        self.assertEqual(report['indexes_used'], ['created', 'priority'])
+        self.assertEqual(report['residual'], [])
+
+    def test_writes(self):
+        self.collection.insert_one({'_id': 'new', 'created': 1000, 'priority': 'major'})
+        self.collection.update({'_id': 3}, {'created': 5000})
+        self.collection.remove({'_id': 28})
+        self.collection.set(29, {'_id': 29, 'created': 'later'})
+        self.assertEqual(self._check({'created': {'$gt': 250}}), [26, 27, 3, 'new'])
+        self.assertEqual(self._check({'created': {'$gt': 'a'}}), [29])
+        self.assertEqual(self._check({'created': {'$gt': 200}, 'priority': 'major'}), [22, 25, 'new'])
+
+    def test_other_values(self):
+        # values that don't fit a column are tested directly
+        self.collection.insert_many([{'_id': 'bool', 'created': True}, {'_id': 'none', 'created': None},
+                                     {'_id': 'big', 'created': 2 ** 60}, {'_id': 'list', 'created': [500]}])
+        self.assertEqual(self._check({'created': {'$gt': 280}}), [29, 'big'])
+        self.assertEqual(self._check({'created': {'$lte': 1}}), [0, 'bool'])
+        self.assertEqual(self._check({'created': {'$gte': 500}}), ['big'])
+
+    def test_aggregate(self):
+        results = list(self.collection.aggregate([
+            {'$match': {'created': {'$gte': 100}, 'priority': {'$in': ['major', 'critical']}}},
+            {'$group': {'_id': None, 'count': {'$sum': 1}, 'hours': {'$sum': '$hours'}, 'created': {'$avg': '$created'},
+                        'low': {'$min': '$created'}, 'high': {'$max': '$hours'}, 'missing': {'$avg': '$missing'}}}
+        ]))
+        self.assertEqual(results, [{'_id': None, 'count': 14, 'hours': 136.5, 'created': 195.0,
+                                    'low': 100, 'high': 14.5, 'missing': None}])
+        self.assertEqual(list(self.collection.aggregate([{'$match': {'created': {'$gt': 1000}}},
+                                                         {'$group': {'_id': None, 'count': {'$sum': 1}}}])), [])
+        # a string among the values is read from the documents
+        self.collection.set(0, {'_id': 0, 'created': 'first'})
+        results = list(self.collection.aggregate([{'$group': {'_id': 'all', 'sum': {'$sum': '$created'},
+                                                              'high': {'$max': '$created'}}}]))
+        self.assertEqual(results, [{'_id': 'all', 'sum': 4350, 'high': 'first'}])
+
+    def test_replace(self):
+        collection = EssentialDB().get_collection()
+        collection.insert_many([{'_id': i, 'a': i} for i in range(10)])
+        collection.createIndex({'a': 'columnar'})
+        collection.createIndex({'a': 'hashed'})
+        self.assertIsNone(collection.collection.column_store)
+        self.assertEqual(list(collection.aggregate([{'$group': {'_id': None, 'n': {'$sum': 1}}}])),
+                         [{'_id': None, 'n': 10}])
+        self.assertEqual(collection.count({'a': {'$gt': 4}}), 5)
+
+    def test_drop(self):
+        self.collection.createIndex({'created': 'hashed'})
+        self.assertEqual(self._check({'created': {'$lt': 20}}), [0, 1])
+        self.collection.dropIndexes()
+        self.assertEqual(self._check({'priority': {'$lt': 'minor'}, 'created': {'$lt': 50}}), [1, 2, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import datetime
+import random
+import unittest
+from essentialdb import EssentialDB, Cursor
+
+
+class TestCursor(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = EssentialDB().get_collection()
+        self.collection.insert_many([{'_id': i, 'even': i % 2 == 0, 'n': i} for i in range(100)])
+
+    def test_lazy(self):
+        tested = []
+
+        def track(document):
+            tested.append(document['_id'])
+            return True
+
+        cursor = self.collection.find({'even': True}, filter=track, cursor=True)
+        self.assertIsInstance(cursor, Cursor)
+        self.assertEqual(tested, [])
+        self.assertEqual([document['_id'] for document in cursor.limit(3)], [0, 2, 4])
+        self.assertEqual(tested, [0, 2, 4])
+
+    def test_skip_limit(self):
+        page = self.collection.find({'even': True}, cursor=True).skip(10).limit(5)
+        self.assertEqual([document['n'] for document in page], [20, 22, 24, 26, 28])
+        page = self.collection.find({}, cursor=True).skip(95).limit(10)
+        self.assertEqual([document['n'] for document in page], [95, 96, 97, 98, 99])
+
+    def test_batches(self):
+        cursor = iter(self.collection.find({'even': False}, cursor=True).batch_size(10))
+        first = [next(cursor) for _ in range(10)]
+        self.assertEqual(first[-1]['n'], 19)
+        # writers get in between batches, removed documents are skipped and the rest are tested again
+        self.collection.remove({'n': 21})
+        self.collection.update({'n': 23}, {'even': True})
+        self.collection.insert_one({'_id': 'late', 'even': False})
+        rest = [document['n'] for document in cursor]
+        self.assertEqual(rest[:2], [25, 27])
+        self.assertEqual(len(rest), 38)
+
+    def test_batches_recheck_indexed_terms(self):
+        self.collection.createIndex({'even': 'hashed'})
+        cursor = iter(self.collection.find({'even': True}, cursor=True).batch_size(1))
+        self.assertEqual(next(cursor)['n'], 0)
+        self.collection.update({'n': 2}, {'even': False})
+        self.assertEqual(next(cursor)['n'], 4)
+
+    def test_started(self):
+        cursor = self.collection.find(cursor=True)
+        iter(cursor)
+        with self.assertRaises(RuntimeError):
+            cursor.limit(1)
+
+    def test_find_one_stops_early(self):
+        tested = []
+
+        def track(document):
+            tested.append(document['_id'])
+            return document['n'] > 2
+
+        self.assertEqual(self.collection.find_one({'even': False}, filter=track)['n'], 3)
+        self.assertEqual(tested, [1, 3])
+        self.assertIsNone(self.collection.find_one('missing'))
+
+    def test_sort(self):
+        cursor = self.collection.find({'even': True}, cursor=True).sort('n', -1).limit(3)
+        self.assertEqual([document['n'] for document in cursor], [98, 96, 94])
+        cursor = self.collection.find({}, cursor=True).sort([('even', 1), ('n', -1)]).skip(1).limit(2)
+        self.assertEqual([document['n'] for document in cursor], [97, 95])
+        self.assertEqual(len(list(self.collection.find({}, cursor=True).sort('n'))), 100)
+
+    def test_sort_mixed_types(self):
+        collection = EssentialDB().get_collection()
+        values = ['b', 2, None, 1.5, {'a': 1}, [1, 2], 'a', True, datetime.date(2017, 1, 1)]
+        collection.insert_many([{'_id': i, 'v': value} for i, value in enumerate(values)])
+        collection.insert_one({'_id': 'missing'})
+        ordered = [document.get('v', 'missing') for document in collection.find(cursor=True).sort('v')]
+        self.assertEqual(ordered, [None, 'missing', True, 1.5, 2, 'a', 'b', datetime.date(2017, 1, 1), {'a': 1},
+                                   [1, 2]])
+        # a limit keeps the same order, ties included
+        top = [document.get('v', 'missing') for document in collection.find(cursor=True).sort('v').limit(4)]
+        self.assertEqual(top, ordered[:4])
+        last = [document['_id'] for document in collection.find(cursor=True).sort('v', -1)]
+        top = [document['_id'] for document in collection.find(cursor=True).sort('v', -1).skip(2).limit(3)]
+        self.assertEqual(top, last[2:5])
+
+    def test_sort_by_index(self):
+        self.collection.createIndex({'n': 1})
+        examined = []
+
+        def track(document):
+            examined.append(document['n'])
+            return True
+
+        cursor = self.collection.find({'even': False}, filter=track, cursor=True).sort('n', -1).limit(2)
+        self.assertEqual([document['n'] for document in cursor], [99, 97])
+        # the index is walked from the top, so only the first few documents are looked at
+        self.assertEqual(examined, [99, 97])
+
+        cursor = self.collection.find({'n': {'$gte': 10}}, cursor=True).sort([('n', 1)]).limit(2)
+        self.assertEqual([document['n'] for document in cursor], [10, 11])
+
+    def test_sort_matches_sorted(self):
+        random.seed(3)
+        collection = EssentialDB().get_collection()
+        collection.insert_many([{'a': random.randint(0, 5), 'b': random.random()} for _ in range(200)])
+        expected = sorted(collection.find(), key=lambda document: (-document['a'], document['b']))[5:25]
+        for index in [None, {'a': 1}]:
+            if index:
+                collection.createIndex(index)
+            cursor = collection.find(cursor=True).sort([('a', -1), ('b', 1)]).skip(5).limit(20)
+            self.assertEqual(list(cursor), expected)
+
+    def test_id(self):
+        self.collection.insert_one({'_id': 'named', 'n': 'named'})
+        cursor = self.collection.find('named', cursor=True)
+        self.assertEqual(cursor.explain()['returned'], 1)
+        self.assertEqual(list(cursor), [{'_id': 'named', 'n': 'named'}])
+        self.assertEqual(list(self.collection.find('missing', cursor=True)), [])
+
+    def test_explain(self):
+        cursor = self.collection.find({'even': True}, cursor=True).limit(3)
+        report = cursor.explain()
+        self.assertEqual(report['access_path'], 'scan')
+        self.assertEqual(report['documents_examined'], 5)
+        self.assertEqual(report['returned'], 3)
+        self.assertEqual(report['limit'], 3)
+        # the cursor itself is untouched
+        self.assertEqual(len(list(cursor)), 3)
+
+        self.collection.createIndex({'n': 1})
+        report = self.collection.find({'even': False}, cursor=True).sort('n', -1).limit(2).explain()
+        self.assertEqual(report['access_path'], 'index walk')
+        self.assertEqual(report['documents_examined'], 3)
+        report = self.collection.find({'n': {'$lt': 10}}, cursor=True).sort('n', -1).explain()
+        self.assertEqual(report['access_path'], 'index')
+        self.assertEqual(report['indexes_used'], ['n'])
+        self.assertEqual(report['documents_examined'], 10)
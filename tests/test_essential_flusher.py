@@ -0,0 +1,62 @@
+import unittest
+import os
+import time
+from essentialdb import EssentialDB, PickleSerializer
+
+FLUSHER_DB_FILE = "flusher_test_db"
+
+
+class CountingSerializer(PickleSerializer):
+
+    def __init__(self):
+        self.dumps = 0
+
+    def dump(self, data, file_path):
+        self.dumps += 1
+        PickleSerializer.dump(data, file_path)
+
+
+class TestSyncPolicy(unittest.TestCase):
+
+    def tearDown(self):
+        if os.path.exists(FLUSHER_DB_FILE):
+            os.remove(FLUSHER_DB_FILE)
+
+    def test_autosync_insert_many_syncs_once(self):
+        serializer = CountingSerializer()
+        db = EssentialDB(filepath=FLUSHER_DB_FILE, serializer=serializer, autosync=True)
+        db.authors.insert_many([{'n': i} for i in range(50)])
+        self.assertEqual(serializer.dumps, 1)
+
+    def test_sync_every(self):
+        serializer = CountingSerializer()
+        db = EssentialDB(filepath=FLUSHER_DB_FILE, serializer=serializer, sync_every=10)
+        for i in range(25):
+            db.authors.insert_one({'n': i})
+        db.close()
+        self.assertLessEqual(serializer.dumps, 3)
+        self.assertGreaterEqual(serializer.dumps, 1)
+        self.assertEqual(EssentialDB(filepath=FLUSHER_DB_FILE).authors.count(), 25)
+
+    def test_sync_interval(self):
+        serializer = CountingSerializer()
+        db = EssentialDB(filepath=FLUSHER_DB_FILE, serializer=serializer, sync_interval=20)
+        db.authors.insert_one({'_id': 'lh', 'first': 'Langston'})
+        deadline = time.monotonic() + 5
+        while db.flusher.syncs == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(serializer.dumps, 1)
+        self.assertEqual(EssentialDB(filepath=FLUSHER_DB_FILE).authors.get('lh')['first'], 'Langston')
+        db.close()
+        # nothing was waiting, so close doesn't sync again
+        self.assertEqual(serializer.dumps, 1)
+
+    def test_with_closes(self):
+        with EssentialDB(filepath=FLUSHER_DB_FILE, sync_every=1000) as db:
+            db.authors.insert_many([{'n': i} for i in range(50)])
+        self.assertFalse(db.flusher.is_alive())
+        self.assertEqual(EssentialDB(filepath=FLUSHER_DB_FILE).authors.count(), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 __author__ = 'scmason'
 import unittest
-from essentialdb import EssentialIndex, EssentialDB
+from essentialdb import EssentialIndex, EssentialOrderedIndex, EssentialDB
 from .document_generator import DocumentGenerator
 
 
@@ -83,3 +83,97 @@ class TestEssentialIndex(unittest.TestCase):
         removed = index.remove_from_index({'no id': 'doesnt exist'})
         self.assertFalse(removed)
 
+
+    def test_update_moves_posting(self):
+        data = self._gen_data()
+        index = EssentialIndex('f2')
+        index.create_index(data)
+        data['b']['f2'] = 'changed'
+        index.update_index(data['b'])
+        self.assertEqual(len(index.find(data, 'v2')), 2)
+        self.assertEqual(list(index.find(data, 'changed')), ['b'])
+
+    def test_unhashable_values(self):
+        data = self._gen_data()
+        data['b']['f2'] = ['a', 'list']
+        index = EssentialIndex('f2')
+        index.create_index(data)
+        self.assertEqual(index.unhashable, {'b'})
+        self.assertIsNone(index.lookup(['a', 'list']))
+        data['b']['f2'] = 'v2'
+        index.update_index(data['b'])
+        self.assertEqual(index.unhashable, set())
+        self.assertEqual(len(index.find(data, 'v2')), 3)
+
+    def test_dot_path(self):
+        data = self._gen_data()
+        data['a']['nested'] = {'n': 1}
+        data['b']['nested.n'] = 1
+        index = EssentialIndex('nested.n')
+        index.create_index(data)
+        self.assertEqual(sorted(index.find(data, 1)), ['a', 'b'])
+
+
+class TestEssentialOrderedIndex(unittest.TestCase):
+    def _gen_data(self):
+        data = {}
+        for i in range(10):
+            data[i] = {'_id': i, 'n': i * 10}
+        data['s'] = {'_id': 's', 'n': 'a string'}
+        data['none'] = {'_id': 'none', 'n': None}
+        return data
+
+    def test_range(self):
+        data = self._gen_data()
+        index = EssentialOrderedIndex('n')
+        index.create_index(data)
+        candidates, exact = index.find_range([('$gte', 20), ('$lt', 50)])
+        # None doesn't order, so it is always a candidate
+        self.assertEqual(list(candidates), [2, 3, 4, 'none'])
+        self.assertFalse(exact)
+        candidates, exact = index.find_range([('$gt', 20), ('$lte', 50.0)])
+        self.assertEqual(list(candidates), [3, 4, 5, 'none'])
+        candidates, exact = index.find_range([('$gt', 'a')])
+        self.assertEqual(list(candidates), ['s', 'none'])
+        self.assertFalse(exact)
+        self.assertIsNone(index.find_range([('$gt', None)]))
+
+    def test_contradictory_bounds(self):
+        data = self._gen_data()
+        del data['none']
+        index = EssentialOrderedIndex('n')
+        index.create_index(data)
+        self.assertEqual(index.find_range([('$gt', 0), ('$lt', 'z')]), ({}, True))
+
+    def test_maintenance(self):
+        data = self._gen_data()
+        index = EssentialOrderedIndex('n')
+        index.create_index(data)
+        data[3]['n'] = 1000
+        index.update_index(data[3])
+        index.remove_from_index(data[4])
+        index.remove_from_index(data['none'])
+        candidates, exact = index.find_range([('$gt', 10)])
+        self.assertEqual(list(candidates), [2, 5, 6, 7, 8, 9, 3])
+        self.assertTrue(exact)
+        self.assertEqual(index.sorted['number'], [0, 10, 20, 50, 60, 70, 80, 90, 1000])
+
+    def test_shadowed_dot_path(self):
+        # a range test on 'n.x' falls back to the nested value when the literal one doesn't compare
+        data = {'a': {'_id': 'a', 'n.x': 'literal', 'n': {'x': 1}}, 'b': {'_id': 'b', 'n': {'x': 2}}}
+        index = EssentialOrderedIndex('n.x')
+        index.create_index(data)
+        candidates, exact = index.find_range([('$lt', 5)])
+        self.assertEqual(list(candidates), ['b', 'a'])
+        self.assertFalse(exact)
+
+    def test_bulk_overwrite(self):
+        # a batch replacing a document indexed earlier in the same batch, before its keys are sorted in
+        collection = EssentialDB().get_collection()
+        collection.createIndex({'n': 1})
+        collection.insert_many([{'_id': 'a', 'n': 5}, {'_id': 'b', 'n': 1}, {'_id': 'a', 'n': 3}])
+        self.assertEqual(collection.collection.indexes['n'].sorted['number'], [1, 3])
+        collection.insert_many([{'_id': 'c', 'n': 9}, {'_id': 'd', 'n': 7}, {'_id': 'b', 'n': 8}, {'_id': 'e', 'n': 0}])
+        self.assertEqual(collection.collection.indexes['n'].sorted['number'], [0, 3, 7, 8, 9])
+        self.assertEqual(sorted(document['_id'] for document in collection.find({'n': {'$gt': 2}})),
+                         ['a', 'b', 'c', 'd'])
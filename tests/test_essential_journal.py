@@ -0,0 +1,84 @@
+import unittest
+import os
+from essentialdb import EssentialDB, EssentialJournal, Param
+
+JOURNAL_DB_FILE = "journal_test_db"
+
+
+class TestEssentialJournal(unittest.TestCase):
+
+    def tearDown(self):
+        for path in [JOURNAL_DB_FILE, JOURNAL_DB_FILE + ".journal"]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_replay_without_snapshot(self):
+        db = EssentialDB(filepath=JOURNAL_DB_FILE, journal=True)
+        db.authors.insert_one({'_id': 'lh', 'first': 'Langston', 'last': 'Hughes'})
+        db.authors.insert_one({'_id': 'ep', 'first': 'Ezra', 'last': 'Pound'})
+        db.authors.update({'_id': 'lh'}, {'born': 1902})
+        db.authors.remove({'_id': 'ep'})
+        db.cache.set('key', 'value')
+        db.books.insert_many([{'_id': 'b1'}, {'_id': 'b2'}])
+        db.sync()
+        self.assertFalse(os.path.exists(JOURNAL_DB_FILE))
+
+        db2 = EssentialDB(filepath=JOURNAL_DB_FILE, journal=True)
+        self.assertEqual(db2.authors.count(), 1)
+        self.assertEqual(db2.authors.get('lh')['born'], 1902)
+        self.assertEqual(db2.cache.get('key'), 'value')
+        self.assertEqual(db2.books.count(), 2)
+
+    def test_checkpoint(self):
+        db = EssentialDB(filepath=JOURNAL_DB_FILE, journal=True)
+        db.authors.insert_one({'_id': 'lh', 'first': 'Langston'})
+        db.checkpoint()
+        self.assertEqual(os.path.getsize(JOURNAL_DB_FILE + ".journal"), 0)
+        db.authors.insert_one({'_id': 'ep', 'first': 'Ezra'})
+        db.sync()
+
+        db2 = EssentialDB(filepath=JOURNAL_DB_FILE, journal=True)
+        self.assertEqual(db2.authors.count(), 2)
+        # new records continue the sequence from the snapshot
+        db2.authors.insert_one({'_id': 'ts', 'first': 'Thomas'})
+        self.assertEqual(db2.journal.lsn, 3)
+
+    def test_torn_tail_is_discarded(self):
+        db = EssentialDB(filepath=JOURNAL_DB_FILE, journal=True)
+        db.authors.insert_one({'_id': 'lh', 'first': 'Langston'})
+        db.authors.insert_one({'_id': 'ep', 'first': 'Ezra'})
+        db.sync()
+        db.journal.close()
+        os.truncate(JOURNAL_DB_FILE + ".journal", os.path.getsize(JOURNAL_DB_FILE + ".journal") - 3)
+
+        db2 = EssentialDB(filepath=JOURNAL_DB_FILE, journal=True)
+        self.assertEqual(db2.authors.count(), 1)
+        db2.authors.insert_one({'_id': 'ts', 'first': 'Thomas'})
+        db2.sync()
+
+        db3 = EssentialDB(filepath=JOURNAL_DB_FILE, journal=True)
+        self.assertEqual(db3.authors.count(), 2)
+
+    def test_replay_skips_records_in_snapshot(self):
+        journal = EssentialJournal(JOURNAL_DB_FILE + ".journal")
+        journal.append(('insert', 'c', {'_id': 1}))
+        journal.append(('insert', 'c', {'_id': 2}))
+        journal.flush()
+        replayed = [lsn for lsn, record in journal.replay(1)]
+        self.assertEqual(replayed, [2])
+        journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+    def test_prepared_queries_are_journaled(self):
+        db = EssentialDB(filepath=JOURNAL_DB_FILE, journal=True)
+        db.authors.insert_many([{'_id': 'lh', 'born': 1902}, {'_id': 'ep', 'born': 1885}, {'_id': 'ts', 'born': 1888}])
+        born_after = db.authors.prepare({'born': {'$gt': Param('year')}})
+        born_after.update({'modern': True}, year=1900)
+        born_after.remove(year=1886)
+        db.sync()
+
+        db2 = EssentialDB(filepath=JOURNAL_DB_FILE, journal=True)
+        self.assertEqual([author['_id'] for author in db2.authors.find()], ['ep'])
@@ -0,0 +1,85 @@
+import unittest
+import os
+import threading
+from essentialdb import EssentialDB, ReadWriteLock
+
+LOCK_DB_FILE = "lock_test_db"
+
+
+class TestReadWriteLock(unittest.TestCase):
+
+    def test_concurrent_readers(self):
+        lock = ReadWriteLock()
+        both_reading = threading.Barrier(2, timeout=5)
+
+        def reader():
+            with lock.read_lock():
+                both_reading.wait()
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        reader()
+        thread.join()
+
+    def test_writer_is_exclusive(self):
+        lock = ReadWriteLock()
+        events = []
+        lock.acquire_read()
+
+        def writer():
+            with lock.write_lock():
+                events.append("write")
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        thread.join(0.1)
+        events.append("read released")
+        lock.release_read()
+        thread.join()
+        self.assertEqual(events, ["read released", "write"])
+
+    def test_collections_do_not_contend(self):
+        db = EssentialDB()
+        authors, books = db.authors, db.books
+        with authors.threading_lock.write_lock():
+            thread = threading.Thread(target=books.insert_one, args=({'_id': 'b1'},))
+            thread.start()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(books.count(), 1)
+
+
+class TestConcurrentSync(unittest.TestCase):
+
+    def tearDown(self):
+        if os.path.exists(LOCK_DB_FILE):
+            os.remove(LOCK_DB_FILE)
+
+    def test_sync_during_writes(self):
+        db = EssentialDB(filepath=LOCK_DB_FILE)
+        errors = []
+
+        def writer(name):
+            try:
+                for i in range(300):
+                    db.get_collection(name).insert_one({'n': i})
+                    db.get_collection(name).find({'n': {'$lt': 10}})
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer, args=("c" + str(i),)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for i in range(20):
+            db.sync()
+        for thread in threads:
+            thread.join()
+        db.sync()
+        self.assertEqual(errors, [])
+
+        db2 = EssentialDB(filepath=LOCK_DB_FILE)
+        self.assertEqual(sum(db2.get_collection(name).count() for name in db2.get_collection_names()), 1200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import unittest
+from essentialdb import EssentialDB, Histogram, Param
+from essentialdb.essential_metrics import query_shape
+
+METRICS_DB = "metrics_test_db"
+
+
+class TestMetrics(unittest.TestCase):
+
+    def tearDown(self):
+        for path in (METRICS_DB, METRICS_DB + ".journal"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_histogram(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.percentile(99), 0.0)
+        for _ in range(98):
+            histogram.record(0.0001)
+        histogram.record(0.5)
+        histogram.record(0.9)
+        stats = histogram.stats()
+        self.assertEqual(stats["count"], 100)
+        self.assertEqual(stats["max"], 0.9)
+        # within a factor of two
+        self.assertTrue(0.0001 <= stats["p50"] < 0.0002)
+        self.assertTrue(0.5 <= stats["p99"] <= 0.9)
+
+    def test_query_shape(self):
+        self.assertEqual(query_shape({"status": "open", "due": {"$lt": 5}}), {"status": "?", "due": {"$lt": "?"}})
+        self.assertEqual(query_shape({"$or": [{"a": 1}, {"b": {"c": 1}}]}), {"$or": [{"a": "?"}, {"b": "?"}]})
+        self.assertEqual(query_shape("some id"), {"_id": "?"})
+
+    def test_operations(self):
+        db = EssentialDB(metrics=True)
+        authors = db.authors
+        authors.insert_many([{"_id": i, "n": i} for i in range(10)])
+        authors.insert_one({"n": 10})
+        for i in range(3):
+            authors.find({"n": i})
+        authors.find({"n": 1}, cursor=True)
+        by_n = authors.prepare({"n": Param("n")})
+        by_n.find(n=2)
+        authors.update({"n": 1}, {"m": 1})
+        authors.get(3)
+
+        stats = db.stats()["collections"]["authors"]
+        self.assertEqual(stats["documents"], 11)
+        operations = stats["operations"]
+        self.assertEqual(operations["find"]["count"], 4)
+        self.assertEqual(operations["insert_many"]["count"], 1)
+        self.assertEqual(operations["update"]["count"], 1)
+        self.assertNotIn("remove", operations)
+        self.assertGreaterEqual(stats["lock"]["read_hold"]["count"], 5)
+        self.assertEqual(stats["lock"]["write_wait"]["count"], 3)
+
+    def test_no_metrics(self):
+        db = EssentialDB()
+        db.authors.insert_one({"n": 1})
+        self.assertEqual(db.stats(), {"collections": {"authors": {"documents": 1}}})
+
+    def test_slow_queries(self):
+        logged = []
+        db = EssentialDB(slow_query_ms=0, slow_query_callback=logged.append)
+        db.authors.insert_many([{"_id": i, "n": i} for i in range(10)])
+        db.authors.createIndex({"n": 1})
+        db.authors.find({"n": {"$gt": 7}})
+        db.authors.get(1)
+        self.assertEqual(len(logged), 1)
+        entry = logged[0]
+        self.assertEqual(entry["operation"], "find")
+        self.assertEqual(entry["shape"], {"n": {"$gt": "?"}})
+        self.assertEqual(entry["plan"]["indexes_used"], ["n"])
+        self.assertEqual(db.stats()["slow_queries"], logged)
+
+        db = EssentialDB(slow_query_ms=1000)
+        db.authors.find({"n": 1})
+        self.assertEqual(db.stats()["slow_queries"], [])
+
+    def test_sync(self):
+        db = EssentialDB(filepath=METRICS_DB, metrics=True, journal=True)
+        db.authors.insert_one({"n": 1})
+        db.sync()
+        db.checkpoint()
+        stats = db.stats()
+        self.assertEqual(stats["sync"]["count"], 1)
+        self.assertEqual(stats["checkpoint"]["count"], 1)
+        self.assertEqual(stats["bytes_written"], os.path.getsize(METRICS_DB) + db.journal.bytes_written)
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+from essentialdb import EssentialDB, ParallelScan
+
+
+@unittest.skipIf(not ParallelScan().available, "parallel scans need fork")
+class TestParallelScan(unittest.TestCase):
+
+    def setUp(self):
+        documents = [{'_id': i, 'value': i % 7, 'name': 'item' + str(i)} for i in range(500)]
+        self.serial = EssentialDB().get_collection()
+        self.serial.insert_many(documents)
+        self.parallel = EssentialDB(parallel_workers=3, parallel_threshold=100).get_collection()
+        self.parallel.insert_many(documents)
+
+    def test_positions(self):
+        scan = ParallelScan(workers=4, threshold=1)
+        documents = list(range(103))
+        self.assertEqual(scan.positions(documents, lambda value: value % 10 == 3), list(range(3, 103, 10)))
+        self.assertEqual(scan.filter(iter(documents), lambda value: value > 100), [101, 102])
+        self.assertFalse(scan.applies(0))
+        self.assertFalse(ParallelScan(workers=1, threshold=1).applies(1000))
+
+    def test_find(self):
+        queries = [{'value': 3}, {'value': {'$gt': 4}, 'name': {'$ne': 'item5'}}, {'$or': [{'value': 1}, {'_id': 2}]}]
+        for query in queries:
+            self.assertEqual(self.parallel.find(query), self.serial.find(query))
+            self.assertEqual(self.parallel.count(query), self.serial.count(query))
+        # the order of the documents is kept
+        self.assertEqual([document['_id'] for document in self.parallel.find({'value': 0})][:3], [0, 7, 14])
+        # a filter function is inherited by the workers along with the documents
+        self.assertEqual(self.parallel.find({'value': 2}, filter=lambda document: document['_id'] > 450),
+                         [{'_id': 457, 'value': 2, 'name': 'item457'}, {'_id': 464, 'value': 2, 'name': 'item464'},
+                          {'_id': 471, 'value': 2, 'name': 'item471'}, {'_id': 478, 'value': 2, 'name': 'item478'},
+                          {'_id': 485, 'value': 2, 'name': 'item485'}, {'_id': 492, 'value': 2, 'name': 'item492'},
+                          {'_id': 499, 'value': 2, 'name': 'item499'}])
+        self.assertEqual(self.parallel.count({'value': 2}, filter=lambda document: document['_id'] > 450), 7)
+
+    def test_writes(self):
+        # the workers see the documents as they are when the scan starts
+        self.parallel.update({'value': 6}, {'value': 'six'})
+        self.assertEqual(self.parallel.count({'value': 'six'}), 71)
+        self.assertEqual(self.parallel.remove({'value': {'$lt': 3}}), 216)
+        self.assertEqual(self.parallel.count({'value': {'$lt': 3}}), 0)
+
+    def test_errors(self):
+        def fails(document):
+            raise ValueError("no")
+        with self.assertRaises(ValueError):
+            self.parallel.find({'value': 1}, filter=fails)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from essentialdb import EssentialDB, Projection, Param
+
+
+class TestProjection(unittest.TestCase):
+
+    def setUp(self):
+        self.document = {'_id': 1, 'title': 'Poems', 'status': 'open', 'details': {'pages': 10, 'isbn': 'x'},
+                         'tags': ['a']}
+
+    def test_include(self):
+        projection = Projection({'title': 1, 'details.pages': 1, 'missing': 1, 'details.missing': 1})
+        self.assertEqual(projection.apply(self.document), {'_id': 1, 'title': 'Poems', 'details': {'pages': 10}})
+        self.assertEqual(Projection({'title': 1, '_id': 0}).apply(self.document), {'title': 'Poems'})
+        self.assertEqual(Projection({'_id': 1}).apply(self.document), {'_id': 1})
+
+    def test_exclude(self):
+        projection = Projection({'details.isbn': 0, 'tags': 0})
+        self.assertEqual(projection.apply(self.document),
+                         {'_id': 1, 'title': 'Poems', 'status': 'open', 'details': {'pages': 10}})
+        # the stored document is left alone
+        self.assertEqual(self.document['details'], {'pages': 10, 'isbn': 'x'})
+        self.assertEqual(Projection({'_id': 0}).apply({'_id': 1, 'a': 2}), {'a': 2})
+
+    def test_literal_dotted_key(self):
+        document = {'_id': 1, 'a.b': 1, 'a': {'b': 2}}
+        self.assertEqual(Projection({'a.b': 1}).apply(document), {'_id': 1, 'a.b': 1})
+        self.assertEqual(Projection({'a.b': 0}).apply(document), {'_id': 1, 'a': {'b': 2}})
+
+    def test_mixed(self):
+        self.assertRaises(ValueError, Projection, {'title': 1, 'details': 0})
+        Projection({'title': 1, '_id': 0})
+
+    def test_find(self):
+        collection = EssentialDB().get_collection()
+        collection.insert_many([{'_id': i, 'n': i, 'even': i % 2 == 0, 'big': 'x' * 100} for i in range(20)])
+        results = collection.find({'even': True, 'n': {'$lt': 6}}, projection={'n': 1})
+        self.assertEqual(results, [{'_id': 0, 'n': 0}, {'_id': 2, 'n': 2}, {'_id': 4, 'n': 4}])
+        self.assertEqual(collection.find({'_id': 3}, projection={'big': 0}), [{'_id': 3, 'n': 3, 'even': False}])
+        self.assertEqual(collection.find_one({'n': 5}, projection={'_id': 0, 'n': 1}), {'n': 5})
+        # the stored documents are untouched
+        self.assertIn('big', collection.find({'n': 3})[0])
+
+        cursor = collection.find({'even': False}, cursor=True, projection={'n': 1, '_id': 0}).sort('n', -1).limit(2)
+        self.assertEqual(list(cursor), [{'n': 19}, {'n': 17}])
+
+        by_n = collection.prepare({'n': Param('n')})
+        self.assertEqual(by_n.find(projection={'even': 1}, n=4), [{'_id': 4, 'even': True}])
+
+    def test_ids_only(self):
+        collection = EssentialDB().get_collection()
+        collection.insert_many([{'_id': i, 'body': 'x' * 100} for i in range(3)])
+        self.assertEqual(collection.find({}, projection={'_id': 1}), [{'_id': 0}, {'_id': 1}, {'_id': 2}])
+        self.assertEqual(list(collection.aggregate([{'$project': {'_id': 1}}])), [{'_id': 0}, {'_id': 1}, {'_id': 2}])
+
+    def test_covered(self):
+        collection = EssentialDB().get_collection()
+        collection.insert_many([{'_id': i, 'n': i, 'even': i % 2 == 0} for i in range(20)])
+        collection.createIndex({'n': 1})
+        collection.createIndex({'even': 'hashed'})
+        local = collection.collection
+        self.assertTrue(Projection({'n': 1, 'even': 1}).covered(local.indexes))
+        self.assertFalse(Projection({'n': 1, 'other': 1}).covered(local.indexes))
+
+        # answered without reading the documents
+        documents = local.documents
+        local.documents = dict.fromkeys(documents)
+        try:
+            results = local.find({'even': True, 'n': {'$gte': 14}}, projection={'n': 1})
+        finally:
+            local.documents = documents
+        self.assertEqual(results, [{'_id': 14, 'n': 14}, {'_id': 16, 'n': 16}, {'_id': 18, 'n': 18}])
+
+        # a residual term, or a filter, reads the documents
+        self.assertEqual(collection.find({'even': True, 'n': {'$ne': 0}}, projection={'n': 1, '_id': 0})[:2],
+                         [{'n': 2}, {'n': 4}])
+        self.assertEqual(collection.find({'even': True}, filter=lambda document: document['n'] > 15,
+                                         projection={'n': 1}), [{'_id': 16, 'n': 16}, {'_id': 18, 'n': 18}])
+
+
+if __name__ == '__main__':
+    unittest.main()
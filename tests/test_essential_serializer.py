@@ -1,6 +1,7 @@
 import unittest
 import os
-from essentialdb import PickleSerializer, JSONSerializer
+from essentialdb import PickleSerializer, JSONSerializer, JSONLinesSerializer, BinarySerializer, LazyDocuments, EssentialDB, \
+    CompressedSerializer
 
 
 
@@ -8,6 +9,9 @@ class TestSerializers(unittest.TestCase):
 
     json_file_path = "test.json"
     pickle_file_path = "test.pickle"
+    binary_file_path = "test.bin"
+    json_lines_file_path = "test.jsonl"
+    compressed_file_path = "test.compressed"
 
     def __get_data(self):
         return dict({'f1': [1,2,3], 'f2': {'n1':'a', 'n2': 2}})
@@ -26,3 +30,65 @@ class TestSerializers(unittest.TestCase):
         loaded = JSONSerializer.load(self.json_file_path)
         self.assertEqual(loaded['f2']['n1'], 'a')
         os.remove(self.json_file_path)
+
+    def test_binary(self):
+        data = {'meta': {}, 'collections': {'c': {'a': {'_id': 'a', 'n': 1}, 'b': {'_id': 'b', 'n': 2}}}}
+        BinarySerializer.dump(data, self.binary_file_path)
+        loaded = BinarySerializer.load(self.binary_file_path)
+        documents = loaded['collections']['c']
+        self.assertIsInstance(documents, LazyDocuments)
+        self.assertEqual(len(documents), 2)
+        self.assertEqual(len(documents._cache), 0)
+        self.assertEqual(documents['b']['n'], 2)
+        self.assertEqual(len(documents._cache), 1)
+        self.assertEqual(sorted(documents), ['a', 'b'])
+        documents._buffer.close()
+        os.remove(self.binary_file_path)
+
+    def test_binary_database(self):
+        db = EssentialDB(filepath=self.binary_file_path, serializer=BinarySerializer())
+        db.authors.insert_many([{'_id': str(i), 'n': i} for i in range(100)])
+        db.sync()
+
+        db2 = EssentialDB(filepath=self.binary_file_path, serializer=BinarySerializer())
+        self.assertEqual(db2.authors.count(), 100)
+        self.assertEqual(db2.authors.get('5')['n'], 5)
+        db2.authors.update({'_id': '6'}, {'n': 'six'})
+        db2.authors.remove({'_id': '7'})
+        db2.authors.insert_one({'_id': 'new', 'n': 101})
+        self.assertEqual(len(db2.authors.find({'n': {'$gt': 50}})), 50)
+        db2.sync()
+
+        db3 = EssentialDB(filepath=self.binary_file_path, serializer=BinarySerializer())
+        self.assertEqual(db3.authors.count(), 100)
+        self.assertEqual(db3.authors.get('6')['n'], 'six')
+        self.assertIsNone(db3.authors.get('7'))
+        self.assertEqual(db3.authors.get('new')['n'], 101)
+        os.remove(self.binary_file_path)
+
+    def test_json_lines(self):
+        data = {'meta': {'journal_lsn': 3},
+                'collections': {'c': {'a': {'_id': 'a', 'n': 1}, 5: {'_id': 5, 'text': 'line\nbreak'}},
+                                'kv': {'k': 'v', 'd': {'no': 'id'}},
+                                'empty': {}}}
+        JSONLinesSerializer.dump(data, self.json_lines_file_path)
+        with open(self.json_lines_file_path) as fp:
+            self.assertEqual(len(fp.readlines()), 8)
+        loaded = JSONLinesSerializer.load(self.json_lines_file_path)
+        self.assertEqual(loaded, data)
+        os.remove(self.json_lines_file_path)
+
+    def test_compressed(self):
+        data = {'meta': {}, 'collections': {'c': {'a': {'_id': 'a', 'text': 'words ' * 1000}}}}
+        for codec in ['none', 'zlib', 'bz2', 'lzma']:
+            for serializer in [PickleSerializer(), JSONSerializer(), JSONLinesSerializer()]:
+                compressed = CompressedSerializer(serializer, codec=codec, level=1)
+                compressed.dump(data, self.compressed_file_path)
+                self.assertEqual(compressed.load(self.compressed_file_path), data)
+                if codec != 'none':
+                    self.assertLess(os.path.getsize(self.compressed_file_path), 1000)
+        os.remove(self.compressed_file_path)
+
+    def test_compressed_requires_streaming(self):
+        with self.assertRaises(TypeError):
+            CompressedSerializer(BinarySerializer())
@@ -0,0 +1,126 @@
+import unittest
+import os
+import shutil
+from essentialdb import EssentialDB, PickleSerializer, JSONSerializer
+
+DIRECTORY_DB = "directory_test_db"
+
+
+class CountingSerializer(PickleSerializer):
+
+    def __init__(self):
+        self.dumped = []
+        self.loaded = []
+
+    def dump(self, data, file_path):
+        self.dumped.extend(data['collections'].keys())
+        PickleSerializer.dump(data, file_path)
+
+    def load(self, file_path):
+        data = PickleSerializer.load(file_path)
+        self.loaded.extend(data['collections'].keys())
+        return data
+
+
+class TestDirectoryStorage(unittest.TestCase):
+
+    def tearDown(self):
+        shutil.rmtree(DIRECTORY_DB, ignore_errors=True)
+
+    def test_sync_load(self):
+        db = EssentialDB(filepath=DIRECTORY_DB, layout="directory")
+        db.authors.insert_one({'_id': 'lh', 'first': 'Langston'})
+        db.books.insert_one({'_id': 'b1', 'title': 'The Weary Blues'})
+        db.sync()
+        self.assertTrue(os.path.exists(os.path.join(DIRECTORY_DB, "manifest.json")))
+
+        db2 = EssentialDB(filepath=DIRECTORY_DB, layout="directory")
+        self.assertEqual(sorted(db2.get_collection_names()), ['authors', 'books'])
+        self.assertEqual(db2.books.get('b1')['title'], 'The Weary Blues')
+
+    def test_sync_only_writes_dirty(self):
+        serializer = CountingSerializer()
+        db = EssentialDB(filepath=DIRECTORY_DB, serializer=serializer, layout="directory")
+        db.authors.insert_one({'_id': 'lh', 'first': 'Langston'})
+        db.books.insert_one({'_id': 'b1', 'title': 'The Weary Blues'})
+        db.sync()
+        self.assertEqual(sorted(serializer.dumped), ['authors', 'books'])
+        self.assertFalse(db.authors.dirty)
+
+        serializer.dumped = []
+        db.authors.insert_one({'_id': 'ep', 'first': 'Ezra'})
+        db.sync()
+        self.assertEqual(serializer.dumped, ['authors'])
+
+        serializer.dumped = []
+        db.sync()
+        self.assertEqual(serializer.dumped, [])
+
+    def test_lazy_load(self):
+        db = EssentialDB(filepath=DIRECTORY_DB, layout="directory")
+        db.authors.insert_one({'_id': 'lh', 'first': 'Langston'})
+        db.books.insert_one({'_id': 'b1', 'title': 'The Weary Blues'})
+        db.sync()
+
+        serializer = CountingSerializer()
+        db2 = EssentialDB(filepath=DIRECTORY_DB, serializer=serializer, layout="directory")
+        self.assertEqual(sorted(db2.get_collection_names()), ['authors', 'books'])
+        self.assertEqual(serializer.loaded, [])
+        self.assertEqual(db2.books.get('b1')['title'], 'The Weary Blues')
+        self.assertEqual(serializer.loaded, ['books'])
+
+        db2.books.insert_one({'_id': 'b2', 'title': 'Cathay'})
+        db2.sync()
+        self.assertEqual(serializer.dumped, ['books'])
+        self.assertEqual(serializer.loaded, ['books'])
+        self.assertIsNone(db2.get_collection('missing', create=False))
+
+        db3 = EssentialDB(filepath=DIRECTORY_DB, layout="directory")
+        self.assertEqual(db3.authors.get('lh')['first'], 'Langston')
+        self.assertEqual(db3.books.count(), 2)
+
+    def test_json_collections(self):
+        db = EssentialDB(filepath=DIRECTORY_DB, serializer=JSONSerializer(), layout="directory")
+        db.authors.insert_one({'_id': 'lh', 'first': 'Langston'})
+        db.sync()
+        db2 = EssentialDB(filepath=DIRECTORY_DB, serializer=JSONSerializer(), layout="directory")
+        self.assertEqual(db2.authors.get('lh')['first'], 'Langston')
+
+    def test_journal(self):
+        db = EssentialDB(filepath=DIRECTORY_DB, layout="directory", journal=True)
+        db.authors.insert_one({'_id': 'lh', 'first': 'Langston'})
+        db.sync()
+
+        db2 = EssentialDB(filepath=DIRECTORY_DB, layout="directory", journal=True)
+        db2.checkpoint()
+        db3 = EssentialDB(filepath=DIRECTORY_DB, layout="directory")
+        self.assertEqual(db3.authors.get('lh')['first'], 'Langston')
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class TestFileStorage(unittest.TestCase):
+
+    file_path = "file_storage_test_db"
+
+    def tearDown(self):
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+    def test_unloaded_collections_are_kept(self):
+        db = EssentialDB(filepath=self.file_path)
+        db.authors.insert_one({'_id': 'lh', 'first': 'Langston'})
+        db.books.insert_one({'_id': 'b1', 'title': 'The Weary Blues'})
+        db.sync()
+
+        db2 = EssentialDB(filepath=self.file_path)
+        self.assertEqual(db2.collections, {})
+        self.assertEqual(sorted(db2.get_collection_names()), ['authors', 'books'])
+        db2.books.insert_one({'_id': 'b2', 'title': 'Cathay'})
+        db2.sync()
+
+        db3 = EssentialDB(filepath=self.file_path)
+        self.assertEqual(db3.authors.get('lh')['first'], 'Langston')
+        self.assertEqual(db3.books.count(), 2)
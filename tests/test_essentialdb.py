@@ -1,4 +1,4 @@
-from essentialdb import EssentialDB, Collection
+from essentialdb import EssentialDB, Collection, BulkWriteError, Param
 import unittest
 from .document_generator import DocumentGenerator
 
@@ -70,6 +70,55 @@ class TestEssentialDBActions(unittest.TestCase):
         self.collection.insert_many(self.docs)
         self.assertEqual(self.collection.count(), 10)
 
+    def test_insert_many_result(self):
+        self.docs[0]["_id"] = "given"
+        result = self.collection.insert_many(self.docs)
+        self.assertEqual(len(result.inserted_ids), 10)
+        self.assertEqual(result.inserted_ids[0], "given")
+        self.assertEqual(len(set(result.inserted_ids)), 10)
+        self.assertEqual(self.collection.get(result.inserted_ids[5])["field 0"], self.docs[5]["field 0"])
+
+    def test_insert_many_ordered(self):
+        docs = self.docs[:3] + ["not a document"] + self.docs[3:]
+        with self.assertRaises(BulkWriteError) as context:
+            self.collection.insert_many(docs)
+        self.assertEqual(len(context.exception.result.inserted_ids), 3)
+        self.assertEqual(context.exception.errors[0][0], 3)
+        self.assertEqual(self.collection.count(), 3)
+
+    def test_insert_many_unordered(self):
+        docs = self.docs[:3] + [{"_id": ["unhashable"]}] + self.docs[3:]
+        with self.assertRaises(BulkWriteError) as context:
+            self.collection.insert_many(docs, ordered=False)
+        self.assertEqual(len(context.exception.result.inserted_ids), 10)
+        self.assertEqual(self.collection.count(), 10)
+
+    def test_insert_many_rollback(self):
+        self.collection.insert_one({"_id": "kept", "n": 1})
+        self.collection.createIndex({"n": 1, "field 1": "hashed"})
+        index = self.collection.collection.indexes["n"]
+
+        def fails(documents):
+            index.update_index(documents[0])
+            raise ValueError("no")
+
+        index.update_index_many = fails
+        with self.assertRaises(BulkWriteError) as context:
+            self.collection.insert_many([{"_id": "kept", "n": 2}] + self.docs)
+        self.assertEqual(context.exception.result.inserted_ids, [])
+        self.assertEqual([position for position, error in context.exception.errors], list(range(11)))
+        # nothing of the batch is left, in the documents or the indexes
+        self.assertEqual(self.collection.count(), 1)
+        self.assertEqual(self.collection.get("kept"), {"_id": "kept", "n": 1})
+        self.assertEqual(self.collection.find({"n": {"$gt": 0}}), [{"_id": "kept", "n": 1}])
+        self.assertEqual(self.collection.find({"field 1": self.docs[5]["field 1"]}), [])
+
+    def test_insert_many_updates_index(self):
+        self.collection.createIndex({"field 1": "hashed"})
+        self.collection.insert_many(self.docs)
+        response = self.collection.find({"field 1": self.docs[5]["field 1"]})
+        self.assertEqual(len(response), 1)
+
     def test_find_one_of_many_by_id(self):
         self.collection.insert_many(self.docs)
         response = self.collection.find_one({"_id": self.docs[0]["_id"]})
@@ -290,6 +339,126 @@ class TestEssentialDBActions(unittest.TestCase):
         response = self.collection.find(q)
         self.assertEqual(len(response), 1)
 
+    def test_multiple_indexes(self):
+        self.docs[3]["field 1"] = self.docs[2]["field 1"]
+        self.collection.insert_many(self.docs)
+        self.collection.createIndex({"field 1": "hashed"})
+        self.collection.createIndex({"field 2": "hashed"})
+        q = {"field 1": self.docs[2]["field 1"], "field 2": self.docs[3]["field 2"]}
+        self.assertEqual(self.collection.find(q)[0]["_id"], self.docs[3]["_id"])
+        q = {"$or": [{"field 1": self.docs[2]["field 1"]}, {"field 2": self.docs[6]["field 2"]}]}
+        self.assertEqual(len(self.collection.find(q)), 3)
+
+    def test_index_follows_updates(self):
+        self.collection.insert_many(self.docs)
+        self.collection.createIndex({"field 1": "hashed"})
+        self.collection.update({"_id": self.docs[5]["_id"]}, {"field 1": "changed"})
+        self.assertEqual(len(self.collection.find({"field 1": self.docs[5]["field 1"]})), 0)
+        self.assertEqual(len(self.collection.find({"field 1": "changed"})), 1)
+        self.collection.set(self.docs[5]["_id"], {"field 1": "set"})
+        self.assertEqual(len(self.collection.find({"field 1": "changed"})), 0)
+        self.assertEqual(len(self.collection.find({"field 1": "set"})), 1)
+        self.collection.remove()
+        self.assertEqual(len(self.collection.find({"field 1": "set"})), 0)
+
+    def test_find_query_and_filter(self):
+        self.collection.insert_many(self.docs)
+        response = self.collection.find({"_id": self.docs[5]["_id"]}, filter=lambda doc: True)
+        self.assertEqual(len(response), 1)
+
+    def test_ordered_index(self):
+        for i, doc in enumerate(self.docs):
+            doc["number"] = i
+        self.docs[9]["number"] = "not a number"
+        self.collection.insert_many(self.docs)
+        self.collection.createIndex({"number": 1})
+        response = self.collection.find({"number": {"$gte": 3, "$lt": 6}})
+        self.assertEqual([doc["number"] for doc in response], [3, 4, 5])
+        self.collection.update({"number": 4}, {"number": 40})
+        response = self.collection.find({"number": {"$gt": 5}})
+        self.assertEqual([doc["number"] for doc in response], [6, 7, 8, 40])
+
+    def test_prepare(self):
+        self.collection.insert_many(self.docs)
+        by_field = self.collection.prepare({"field 0": Param("value")})
+        for doc in self.docs:
+            self.assertEqual(by_field.find_one(value=doc["field 0"])["_id"], doc["_id"])
+        self.assertEqual(by_field.count(value="not a value"), 0)
+
+    def test_count_query(self):
+        for i, doc in enumerate(self.docs):
+            doc["status"] = "open" if i % 3 == 0 else "closed"
+            doc["number"] = i
+        self.collection.insert_many(self.docs)
+        self.assertEqual(self.collection.count({"status": "open"}), 4)
+        self.assertEqual(self.collection.count({"status": "open", "number": {"$gt": 3}}), 2)
+        self.assertEqual(self.collection.count({"status": "open"}, filter=lambda doc: doc["number"] < 5), 2)
+        self.collection.createIndex({"status": "hashed"})
+        self.collection.createIndex({"number": 1})
+        self.assertEqual(self.collection.count({"status": "open"}), 4)
+        self.assertEqual(self.collection.count({"status": "open", "number": {"$gt": 3}}), 2)
+        self.assertEqual(self.collection.count({"status": {"$in": ["open", "closed"]}}), 10)
+        self.assertEqual(self.collection.count({}), 10)
+        _id = self.docs[0]["_id"]
+        self.assertEqual(self.collection.count(_id), 1)
+        self.assertEqual(self.collection.count(_id, filter=lambda doc: doc["number"] > 0), 0)
+        self.assertEqual(self.collection.count("missing"), 0)
+
+    def test_distinct(self):
+        for i, doc in enumerate(self.docs):
+            doc["status"] = ["open", "closed", "held"][i % 3]
+            doc["tags"] = ["a"] if i % 2 else ["b"]
+        del self.docs[0]["status"]
+        self.collection.insert_many(self.docs)
+        self.assertEqual(sorted(self.collection.distinct("status")), ["closed", "held", "open"])
+        self.assertEqual(self.collection.distinct("tags"), [["b"], ["a"]])
+        self.assertEqual(sorted(self.collection.distinct("status", {"tags": ["a"]})), ["closed", "held", "open"])
+        self.assertEqual(self.collection.distinct("nested.n0", {"_id": self.docs[3]["_id"]}),
+                         [self.docs[3]["nested"]["n0"]])
+        self.collection.createIndex({"status": "hashed"})
+        self.assertEqual(sorted(self.collection.distinct("status")), ["closed", "held", "open"])
+        self.assertEqual(self.collection.distinct("status", {"status": {"$in": ["held", "gone"]}}), ["held"])
+        self.collection.remove({"status": "held"})
+        self.assertEqual(sorted(self.collection.distinct("status")), ["closed", "open"])
+
+    def test_explain(self):
+        for i, doc in enumerate(self.docs):
+            doc["number"] = i
+        self.collection.insert_many(self.docs)
+        q = {"number": {"$gte": 7}, "field 0": {"$ne": "x"}}
+        report = self.collection.explain(q)
+        self.assertEqual(report["query"], {"$and": [{"number": {"$gte": 7}}, {"field 0": {"$ne": "x"}}]})
+        self.assertEqual(report["access_path"], "scan")
+        self.assertEqual(report["candidate_indexes"], [])
+        self.assertEqual(report["documents_examined"], 10)
+        self.assertEqual(report["returned"], 3)
+
+        self.collection.createIndex({"number": 1})
+        report = self.collection.explain(q)
+        self.assertEqual(report["access_path"], "index")
+        self.assertEqual(report["candidate_indexes"], ["number"])
+        self.assertEqual(report["indexes_used"], ["number"])
+        self.assertEqual(report["residual"], [{"field 0": {"$ne": "x"}}])
+        self.assertEqual(report["documents_examined"], 3)
+        self.assertEqual(report["returned"], 3)
+        self.assertGreaterEqual(report["timings"]["total"], report["timings"]["plan"])
+
+        # an $or is only narrowed down if every branch is
+        report = self.collection.explain({"$or": [{"number": 1}, {"field 1": "x"}]})
+        self.assertEqual(report["access_path"], "scan")
+        self.assertEqual(report["indexes_used"], [])
+        report = self.collection.explain({"$or": [{"number": 1}, {"_id": self.docs[2]["_id"]}]})
+        self.assertEqual(report["indexes_used"], ["number", "_id"])
+        self.assertEqual(report["returned"], 2)
+
+    def test_interpreted_query_mode(self):
+        collection = EssentialDB(query_mode="interpreted").get_collection()
+        collection.insert_many(self.docs)
+        self.collection.insert_many(self.docs)
+        q = {"$or": [{"field 0": self.docs[5]["field 0"]}, {"nested.n0": self.docs[6]["nested"]["n0"]}]}
+        self.assertEqual(len(collection.find(q)), 2)
+        self.assertEqual(collection.find(q), self.collection.find(q))
+
     def test_missing_fields(self):
         self.docs[6]["new field"] = 1
         self.docs[7]["new field"] = 1
@@ -1,5 +1,5 @@
 import unittest
-from essentialdb import QueryFilter
+from essentialdb import QueryFilter, EssentialIndex, EssentialOrderedIndex, Param
 
 
 class TestQueryFilter(unittest.TestCase):
@@ -30,3 +30,181 @@ class TestQueryFilter(unittest.TestCase):
         q = {"$or": [{'a': {'$eq': 'b'}}, {'c': 'd'}, {'e': 'f'}], 'e': 'f'}
         qf = QueryFilter(q)
         self.assertEqual(len(qf.expressions), 2)
+
+    def _indexed_documents(self):
+        documents = {}
+        for i in range(20):
+            documents[i] = {'_id': i, 'a': i % 2, 'b': i % 5, 'c': i % 3}
+        indexes = {}
+        for field in ['a', 'b']:
+            indexes[field] = EssentialIndex(field)
+            indexes[field].create_index(documents)
+        return documents, indexes
+
+    def test_plan_intersection(self):
+        documents, indexes = self._indexed_documents()
+        qf = QueryFilter({'a': 0, 'b': {'$eq': 2}, 'c': 1})
+        candidates, residual = qf.plan(documents, indexes)
+        self.assertEqual(sorted(candidates), [2, 12])
+        self.assertEqual([expression.field for expression in residual], ['c'])
+        self.assertEqual([document['_id'] for document in qf.execute_filter(documents, None, indexes)], [])
+        self.assertEqual(len(QueryFilter({'a': 0, 'b': 2}).execute_filter(documents, None, indexes)), 2)
+
+    def test_plan_union(self):
+        documents, indexes = self._indexed_documents()
+        qf = QueryFilter({'$or': [{'b': 1}, {'b': 2}]})
+        candidates, residual = qf.plan(documents, indexes)
+        self.assertEqual(sorted(candidates), [1, 2, 6, 7, 11, 12, 16, 17])
+        self.assertEqual(residual, [])
+
+        # an unindexed branch means the $or has to be scanned
+        qf = QueryFilter({'$or': [{'b': 1}, {'c': 2}]})
+        candidates, residual = qf.plan(documents, indexes)
+        self.assertIsNone(candidates)
+        self.assertEqual(len(qf.execute_filter(documents, None, indexes)), 9)
+
+    def test_plan_matches_scan(self):
+        documents, indexes = self._indexed_documents()
+        queries = [
+            {'a': 1, 'b': 3},
+            {'$and': [{'a': 1}, {'$or': [{'b': 3}, {'b': 4}]}], 'c': {'$gt': 0}},
+            {'$nor': [{'a': 1}, {'b': 3}]},
+            {'_id': 4, 'a': 0},
+            {'_id': 4, 'a': 1},
+        ]
+        for query in queries:
+            qf = QueryFilter(query)
+            indexed = [document['_id'] for document in qf.execute_filter(documents, None, indexes)]
+            scanned = [document['_id'] for document in qf.execute_filter(documents)]
+            self.assertEqual(sorted(indexed), sorted(scanned))
+
+    def test_multiple_operators(self):
+        qf = QueryFilter({'a': {'$gt': 1, '$lt': 3}})
+        self.assertEqual(len(qf.expressions), 1)
+        self.assertEqual(len(qf.expressions[0].expressions), 2)
+        documents = {i: {'_id': i, 'a': i} for i in range(5)}
+        self.assertEqual([document['a'] for document in qf.execute_filter(documents)], [2])
+
+    def test_plan_range(self):
+        documents, indexes = self._indexed_documents()
+        indexes['c'] = EssentialOrderedIndex('c')
+        indexes['c'].create_index(documents)
+        qf = QueryFilter({'c': {'$gte': 1, '$lt': 2}, 'a': 0})
+        candidates, residual = qf.plan(documents, indexes)
+        self.assertEqual(sorted(candidates), [4, 10, 16])
+        self.assertEqual(residual, [])
+
+        queries = [
+            {'c': {'$gt': 0}, 'b': {'$lte': 2}},
+            {'$or': [{'c': {'$lt': 1}}, {'b': 4}]},
+            {'c': {'$gt': 0, '$ne': 2}},
+        ]
+        for query in queries:
+            qf = QueryFilter(query)
+            indexed = [document['_id'] for document in qf.execute_filter(documents, None, indexes)]
+            scanned = [document['_id'] for document in qf.execute_filter(documents)]
+            self.assertEqual(sorted(indexed), sorted(scanned))
+
+    def test_plan_in(self):
+        documents, indexes = self._indexed_documents()
+        qf = QueryFilter({'_id': {'$in': [3, 5, 'missing']}})
+        candidates, residual = qf.plan(documents, indexes)
+        self.assertEqual(list(candidates), [3, 5])
+        self.assertEqual(residual, [])
+
+        qf = QueryFilter({'b': {'$in': [1, 2]}, 'a': 0})
+        candidates, residual = qf.plan(documents, indexes)
+        self.assertEqual(sorted(candidates), [2, 6, 12, 16])
+
+        # a string isn't a list of values
+        qf = QueryFilter({'b': {'$in': 'abc'}})
+        self.assertIsNone(qf.plan(documents, indexes)[0])
+
+    def test_plan_nin(self):
+        documents, indexes = self._indexed_documents()
+        qf = QueryFilter({'b': {'$nin': [0, 1, 2]}})
+        candidates, residual = qf.plan(documents, indexes)
+        self.assertEqual(sorted(candidates), [3, 4, 8, 9, 13, 14, 18, 19])
+        self.assertEqual(residual, [])
+
+        # with an equality to narrow things down, the $nin is tested instead
+        qf = QueryFilter({'b': {'$nin': [0, 1, 2]}, 'a': 1})
+        candidates, residual = qf.plan(documents, indexes)
+        self.assertEqual(len(candidates), 10)
+        self.assertEqual(len(residual), 1)
+
+        queries = [
+            {'_id': {'$nin': [1, 2, 3]}},
+            {'$or': [{'b': {'$nin': [1, 2]}}, {'a': {'$in': [1]}}]},
+            {'$and': [{'b': {'$in': [1, 2]}}, {'c': {'$nin': [0]}}]},
+        ]
+        for query in queries:
+            qf = QueryFilter(query)
+            indexed = [document['_id'] for document in qf.execute_filter(documents, None, indexes)]
+            scanned = [document['_id'] for document in qf.execute_filter(documents)]
+            self.assertEqual(sorted(indexed), sorted(scanned))
+
+    def test_compile_cache(self):
+        # the cache is shared by every test, start from an empty one
+        QueryFilter.cache_clear()
+        documents = {i: {'_id': i, 'a': i % 2, 'b': i} for i in range(10)}
+        first = QueryFilter.compile({'a': 1, 'b': {'$gt': 4, '$lt': 9}})
+        self.assertEqual(QueryFilter.cache_info().hits, 0)
+        second = QueryFilter.compile({'a': 0, 'b': {'$gt': 1, '$lt': 5}})
+        self.assertEqual(QueryFilter.cache_info().hits, 1)
+        self.assertEqual([document['_id'] for document in first.execute_filter(documents)], [5, 7])
+        self.assertEqual([document['_id'] for document in second.execute_filter(documents)], [2, 4])
+
+        # a different shape is compiled separately
+        third = QueryFilter.compile({'$or': [{'a': 1}, {'b': {'$in': [2, 4]}}]})
+        self.assertEqual(QueryFilter.cache_info()[:2], (1, 2))
+        self.assertEqual([document['_id'] for document in third.execute_filter(documents)], [1, 2, 3, 4, 5, 7, 9])
+
+    def test_bind(self):
+        template = QueryFilter({'a': Param('a'), '$or': [{'b': {'$lt': Param('low')}}, {'b': {'$gt': Param('high')}}]})
+        documents = {i: {'_id': i, 'a': i % 2, 'b': i} for i in range(10)}
+        bound = template.bind({'a': 0, 'low': 3, 'high': 6})
+        self.assertEqual([document['_id'] for document in bound.execute_filter(documents)], [0, 2, 8])
+        self.assertIsInstance(template.expressions[0].match_value, Param)
+        self.assertEqual(bound.to_query(), {'$and': [{'a': 0}, {'$or': [{'b': {'$lt': 3}}, {'b': {'$gt': 6}}]}]})
+
+    def test_compiled_matches_interpreter(self):
+        documents = {}
+        for i in range(30):
+            documents[i] = {'_id': i, 'a': [i % 3, str(i), None][i % 3], 'n': {'x': i % 4}}
+        documents[30] = {'_id': 30, 'n.x': 'literal', 'n': {'x': 2}}
+        documents[31] = 'not a dict'
+        queries = [
+            {'a': 1},
+            {'a': {'$gte': 1}, 'n.x': {'$ne': 2}},
+            {'n.x': {'$lt': 3}},
+            {'n.x': 'literal'},
+            {'a': {'$in': [0, '4', None]}},
+            {'a': {'$nin': [0, None]}},
+            {'$or': [{'a': 0}, {'$and': [{'n.x': 3}, {'a': {'$gt': '2'}}]}]},
+            {'$nor': [{'a': 0}, {'n.x': {'$gt': 1}}]},
+            {'$not': [{'a': None, 'n.x': 1}]},
+            {'$or': [], 'a': {'$gt': 0, '$lt': 2}},
+            {'$not': []},
+        ]
+        for query in queries:
+            qf = QueryFilter(query)
+            interpreted = qf.execute_filter(documents)
+            compiled = qf.execute_filter(documents, mode="compiled")
+            self.assertEqual([id(document) for document in interpreted], [id(document) for document in compiled])
+
+    def test_matcher(self):
+        qf = QueryFilter({'a': {'$gt': 1}, 'b': 'x'})
+        match = qf.matcher()
+        self.assertTrue(match({'a': 2, 'b': 'x'}))
+        self.assertFalse(match({'a': 2, 'b': 'y'}))
+        self.assertFalse(match({'b': 'x'}))
+        # a subset of the expressions, as left over after planning
+        self.assertTrue(qf.matcher(qf.expressions[1:])({'b': 'x'}))
+        # one compiled factory serves every query of the same shape
+        first = QueryFilter.compile({'a': {'$gt': 1}})
+        first.matcher()
+        second = QueryFilter.compile({'a': {'$gt': 5}})
+        self.assertIs(second._template, first._template)
+        self.assertEqual(len(first._template._factories), 1)
+        self.assertFalse(second.matcher()({'a': 3}))